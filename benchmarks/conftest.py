@@ -0,0 +1,126 @@
+"""
+Fixtures for the benchmarks.
+
+The shop fixture runs a fake shop in a thread of the test process. It serves synthetic
+product pages, so the scrapers can be measured without network access or the
+webserver container the tests use. The page is controlled by query parameters:
+
+    /product?size=100000&latency=0.05&where=end&structured=0
+
+    size:       the approximate size of the page in bytes
+    latency:    the number of seconds the server waits before it answers
+    where:      put the price near the start or the end of the page
+    structured: 1 to describe the product with a JSON-LD block in the head
+"""
+
+import json
+import threading
+import tracemalloc
+from datetime import datetime, timedelta
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+from urllib.parse import urlsplit, parse_qs
+
+import pytest
+
+PRICE = "3,21"
+filler = '<div class="tile"><a href="/other">Another product you might like</a><span>lorem ipsum dolor sit amet</span></div>\n'
+
+
+@lru_cache(maxsize=None)
+def page(size: int, where: str = "end", structured: bool = False) -> bytes:
+    head = '<html><head><meta charset="utf-8"><title>Dolce Gusto Lungo XL</title>'
+    if structured:
+        data = {"@context": "https://schema.org", "@type": "Product", "name": "Lungo XL", "offers": {"@type": "Offer", "price": "3.21"}}
+        head += f'<script type="application/ld+json">{json.dumps(data)}</script>'
+    head += "</head><body>"
+    price = f'<span class="price">{PRICE}</span>'
+    tail = "</body></html>"
+    body = filler * max(0, (size - len(head) - len(price) - len(tail)) // len(filler))
+    return (head + (price + body if where == "start" else body + price) + tail).encode()
+
+
+class ShopHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        query = parse_qs(urlsplit(self.path).query)
+        latency = float(query.get("latency", ["0"])[0])
+        if latency:
+            sleep(latency)
+        body = page(
+            int(query.get("size", ["10000"])[0]),
+            query.get("where", ["end"])[0],
+            query.get("structured", ["0"])[0] == "1",
+        )
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ShopServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # a streaming scraper closes the connection as soon as it found the price
+        pass
+
+
+@pytest.fixture(scope="session")
+def pages():
+    """
+    Return the function that creates the synthetic pages served by the shop, to use them without a server.
+    """
+    return page
+
+
+@pytest.fixture(scope="session")
+def shop():
+    server = ShopServer(("127.0.0.1", 0), ShopHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(scope="session")
+def rows():
+    """
+    Return a function that creates n synthetic rows of id, url, price and timestamp, one row per site per hour.
+    """
+
+    @lru_cache(maxsize=None)
+    def create(n: int, sites: int = 6) -> list[tuple[int, str, float, datetime]]:
+        start = datetime(2023, 1, 1)
+        return [
+            (i + 1, f"https://shop{i % sites}.example.org/lungo-xl", 3.0 + (i * 7 % 50) / 100, start + timedelta(hours=i // sites))
+            for i in range(n)
+        ]
+
+    return create
+
+
+@pytest.fixture
+def peak_memory(benchmark):
+    """
+    Return a function that runs its arguments once under tracemalloc and records the peak memory in the benchmark.
+    """
+
+    def measure(func, *args, **kwargs):
+        tracemalloc.start()
+        try:
+            func(*args, **kwargs)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        benchmark.extra_info["peak_memory_kib"] = peak // 1024
+        return peak
+
+    return measure
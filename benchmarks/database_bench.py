@@ -0,0 +1,47 @@
+import pytest
+
+from coffeescraper.sqlite import SQLitePriceDatabase
+
+# the SQLite backend stands in for PostgreSQL, it needs no server and shares the
+# insert and query code paths of BasePriceDatabase
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = SQLitePriceDatabase(str(tmp_path / "bench.db"))
+    db.create_table()
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def filled(tmp_path, rows):
+    db = SQLitePriceDatabase(str(tmp_path / "filled.db"))
+    db.insert_rows([row[1:] for row in rows(50_000)])
+    yield db
+    db.close()
+
+
+class TestDatabase:
+    @pytest.mark.parametrize("n", [100, 10_000])
+    def test_insert_rows(self, benchmark, db, rows, n):
+        values = [row[1:] for row in rows(n)]
+        assert benchmark(db.insert_rows, values) == n
+        if benchmark.stats:
+            benchmark.extra_info["rows_per_second"] = n / benchmark.stats.stats.mean
+
+    @pytest.mark.parametrize("itersize", [100, 2000])
+    def test_get_prices(self, benchmark, filled, itersize):
+        assert benchmark(lambda: sum(1 for _ in filled.get_prices(itersize=itersize))) == 50_000
+        if benchmark.stats:
+            benchmark.extra_info["rows_per_second"] = 50_000 / benchmark.stats.stats.mean
+
+    def test_get_prices_after_id(self, benchmark, filled):
+        assert benchmark(lambda: sum(1 for _ in filled.get_prices(after_id=49_000))) == 1_000
+
+    @pytest.mark.parametrize("per_site", [False, True])
+    def test_get_daily(self, benchmark, filled, per_site):
+        assert benchmark(lambda: list(filled.get_daily(per_site=per_site)))
+
+    def test_get_difference(self, benchmark, filled):
+        benchmark(filled.get_difference)
@@ -0,0 +1,38 @@
+import pytest
+
+from coffeescraper.html import generate_graph_html
+from coffeescraper.report import ReportState
+from coffeescraper.spreadsheet import write_sheet
+
+counts = [1_000, 10_000, 100_000]
+# openpyxl writes about 10000 rows per second, more rows only make the suite slow
+sheet_counts = [1_000, 10_000, 30_000]
+
+
+class TestSpreadsheet:
+    @pytest.mark.parametrize("per_site", [False, True])
+    @pytest.mark.parametrize("n", sheet_counts)
+    def test_write_sheet(self, benchmark, peak_memory, tmp_path, rows, n, per_site):
+        data = rows(n)
+        filename = str(tmp_path / "bench.xlsx")
+        benchmark.pedantic(write_sheet, args=(data, filename, per_site), rounds=3)
+        peak_memory(write_sheet, data, filename, per_site)
+
+
+class TestHtml:
+    @pytest.mark.parametrize("n", counts)
+    def test_generate_graph_html(self, benchmark, peak_memory, tmp_path, rows, n):
+        data = rows(n)
+        filename = str(tmp_path / "bench.html")
+        benchmark.pedantic(generate_graph_html, args=(data,), kwargs={"filename": filename}, rounds=3)
+        peak_memory(generate_graph_html, data, filename=filename)
+        benchmark.extra_info["page_kib"] = (tmp_path / "bench.html").stat().st_size // 1024
+
+    @pytest.mark.parametrize("n", counts)
+    def test_report_state_update(self, benchmark, tmp_path, rows, n):
+        data = rows(n)
+
+        def update():
+            ReportState(str(tmp_path / "state.json")).update(data)
+
+        benchmark(update)
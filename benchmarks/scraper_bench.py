@@ -0,0 +1,62 @@
+import re
+
+import pytest
+
+from coffeescraper.engine import scrape_all
+from coffeescraper.scraper import CoffeeScraper
+from coffeescraper.structured import find_price
+
+pattern = r'<span class="price">(?P<price>\d+,\d+)</span>'
+sizes = [10_000, 100_000, 1_000_000]
+
+
+def comma(text):
+    return text.replace(",", ".")
+
+
+def chunked(text, size=8192):
+    return [text[i : i + size] for i in range(0, len(text), size)]
+
+
+class TestScraper:
+    @pytest.mark.parametrize("stream", [False, True], ids=["full", "stream"])
+    @pytest.mark.parametrize("size", sizes)
+    def test_fetch(self, benchmark, shop, size, stream):
+        scraper = CoffeeScraper(f"{shop}/product?size={size}&where=start", pattern, comma, stream=stream)
+        assert benchmark(scraper) == (scraper.url, 3.21)
+
+    @pytest.mark.parametrize("workers", [1, 8])
+    def test_throughput(self, benchmark, shop, workers):
+        # 24 pages with 50ms latency each, the time per round shows how well the latency is hidden
+        sites = [CoffeeScraper(f"{shop}/product?size=50000&latency=0.05&n={i}", pattern, comma) for i in range(24)]
+        report = benchmark.pedantic(scrape_all, args=(sites,), kwargs={"max_workers": workers}, rounds=3)
+        assert len(report.results) == 24
+        # there are no stats with --benchmark-disable
+        if benchmark.stats:
+            benchmark.extra_info["pages_per_second"] = 24 / benchmark.stats.stats.mean
+
+
+class TestExtraction:
+    @pytest.mark.parametrize("where", ["start", "end"])
+    @pytest.mark.parametrize("size", sizes)
+    def test_regex(self, benchmark, pages, size, where):
+        scraper = CoffeeScraper("http://shop", pattern, comma)
+        text = pages(size, where).decode()
+        assert benchmark(scraper.extract_price, text) == ("http://shop", 3.21)
+
+    @pytest.mark.parametrize("where", ["start", "end"])
+    @pytest.mark.parametrize("size", sizes)
+    def test_regex_stream(self, benchmark, pages, size, where):
+        scraper = CoffeeScraper("http://shop", pattern, comma)
+        chunks = chunked(pages(size, where).decode())
+        assert benchmark(scraper.extract_price_stream, chunks) == ("http://shop", 3.21)
+
+    @pytest.mark.parametrize("size", sizes)
+    def test_structured(self, benchmark, pages, size):
+        chunks = chunked(pages(size, structured=True).decode())
+        assert benchmark(find_price, chunks) == 3.21
+
+    def test_compiled_pattern(self, benchmark, pages):
+        text = pages(100_000).decode()
+        compiled = re.compile(pattern)
+        assert benchmark(compiled.search, text) is not None
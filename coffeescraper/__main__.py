@@ -5,17 +5,26 @@
 # coffeescraper is an experiment in webscraping both with and without Selenium
 
 import logging
-
-from .scraper import sites
-from .database import PriceDatabase
+import os
+import posixpath
+from time import time
+
+from .scraper import ChromiumCoffeeScraper, CoffeeScraper
+from .registry import load_sites
+from .browser import BrowserPool, chromium_options
+from .cache import HttpCache
+from .engine import scrape_all
+from .scheduler import PoliteScheduler, crawl_delays
+from .resilience import RetryPolicy, CircuitBreaker
+from .database import open_database
 from .spreadsheet import write_sheet
-from .html import generate_graph_html
-from .sftp import upload_file_via_sftp
+from .export import export_parquet
+from .report import ReportState, render_reports
+from .sftp import SFTPUploader
 from .smtp import send_message
+from .metrics import metrics
 from .utils import get_env, get_secret_file
 
-# TODO: improve the excel sheet (table headers)
-
 if __name__ == "__main__":
 
     loglevel = get_env("LOGLEVEL","WARNING")
@@ -25,54 +34,143 @@ if __name__ == "__main__":
     logging.basicConfig(level=numeric_level, format='%(levelname)s:%(module)s - %(asctime)s %(message)s')
 
     filename = "/tmp/coffeescraper.xlsx"
-    filename_html = "/tmp/coffeescraper.html"
+    directory_html = "/tmp/coffeescraper-html"
 
     logging.info("coffeescraper started")
 
-    db = PriceDatabase()
-
-    lowest_price_today = 1000000.0
-    cheapest_site = None
-    for site in sites:
-        try:
-            result = site()
-            db.insert_tuple_into_table(*result)
-            if result[1] < lowest_price_today:
-                lowest_price_today = result[1]
-                cheapest_site = result[0]
-        except Exception as e:
-            logging.warning(f"error retrieving price from {site.url} {e}")
-
-    write_sheet(db.get_prices(), filename=filename)
-
-    generate_graph_html(db.get_prices(), cheapest_site=cheapest_site, lowest_price_today=lowest_price_today, filename=filename_html)
-
-    upload_file_via_sftp(
-        hostfile="/run/secrets/sftp_host",
-        usernamefile="/run/secrets/sftp_user",
-        passwordfile="/run/secrets/sftp_password",
-        local_file_path=filename,
-        remote_file_path=get_env("EXCELREPORT","/coffeescraper.xlsx"),
-    )
-
-    upload_file_via_sftp(
-        hostfile="/run/secrets/sftp_host",
-        usernamefile="/run/secrets/sftp_user",
-        passwordfile="/run/secrets/sftp_password",
-        local_file_path=filename_html,
-        remote_file_path=get_env("HTMLREPORT","/coffeescraper.html"),
-    )
+    with metrics.timer("db_seconds", operation="connect"):
+        db = open_database()
 
-    limit = float(get_env("ALERTLIMIT",0.50))
-    diff = db.get_difference()
-    if  diff <= -limit:
-        send_message(
-            get_env("ALERTSENDER"),
-            get_env("ALERTRECIPIENTS"),
-            get_env("ALERTSUBJECT","Coffee Alert"),
-            get_secret_file("/run/secrets/smtp_message").format(limit=limit)
+    httpcache = get_env("HTTPCACHE")
+    cache = HttpCache(httpcache) if httpcache is not None else None
+
+    sites = load_sites(get_env("SITES", os.path.join(os.path.dirname(__file__), "sites.toml")), cache=cache)
+
+    with BrowserPool(
+        size=int(get_env("BROWSERS", 2)),
+        options=chromium_options(CoffeeScraper.headers["User-Agent"]),
+    ) as pool:
+        for site in sites:
+            if isinstance(site, ChromiumCoffeeScraper):
+                site.pool = pool
+
+        robots = get_env("ROBOTS", "yes").lower() in ("yes", "true", "1")
+        scheduler = PoliteScheduler(
+            rate=float(get_env("HOSTRATE", 1.0)),
+            burst=int(get_env("HOSTBURST", 2)),
+            concurrency=int(get_env("HOSTCONCURRENCY", 2)),
+            delays=crawl_delays([site.url for site in sites], CoffeeScraper.headers["User-Agent"]) if robots else None,
         )
+
+        breaker = CircuitBreaker(
+            get_env("BREAKERSTATE", "/tmp/coffeescraper-breaker.json"),
+            threshold=int(get_env("BREAKERTHRESHOLD", 3)),
+            cooldown=float(get_env("BREAKERCOOLDOWN", 24)) * 3600,
+        )
+
+        with metrics.timer("stage_seconds", stage="scrape"):
+            report = scrape_all(
+                sites,
+                max_workers=int(get_env("SCRAPEWORKERS", 8)),
+                timeout=float(get_env("SCRAPETIMEOUT", 60.0)),
+                scheduler=scheduler,
+                retry=RetryPolicy(retries=int(get_env("RETRIES", 2)), base=float(get_env("RETRYBACKOFF", 1.0))),
+                breaker=breaker,
+            )
+
+    breaker.save()
+
+    for url, duration in report.durations.items():
+        metrics.observe("site_seconds", duration, url=url)
+    metrics.set("sites", len(report.results), outcome="price")
+    metrics.set("sites", len(report.not_found), outcome="not_found")
+    metrics.set("sites", len(report.errors), outcome="error")
+
+    if cache is not None:
+        cache.save()
+
+    products = {site.url: site.product for site in sites}
+    with metrics.timer("stage_seconds", stage="database"):
+        with metrics.timer("db_seconds", operation="set_products"):
+            db.set_products(products)
+        with metrics.timer("db_seconds", operation="insert_rows"):
+            db.insert_rows(report.results)
+
+    cheapest = report.cheapest_per_product(products)
+
+    parquetdir = get_env("PARQUETDIR")
+    if parquetdir is not None:
+        with metrics.timer("stage_seconds", stage="parquet"):
+            export_parquet(db, parquetdir)
+
+    # the reports only change when there are new prices, the state is saved only after
+    # a successful upload, so a failed upload is retried by the next run
+    state = ReportState(get_env("REPORTSTATE", "/tmp/coffeescraper-report.json"))
+    with metrics.timer("db_seconds", operation="refresh"):
+        new_rows = state.refresh(db)
+    if new_rows > 0:
+        # the spreadsheet holds every price, it is a streaming export that cannot be appended to
+        with metrics.timer("stage_seconds", stage="spreadsheet"):
+            write_sheet(db.get_prices(), filename=filename, per_site=get_env("EXCELPERSITE", "no").lower() in ("yes", "true", "1"))
+
+        # the index page takes the place of the single page of earlier versions, the product pages are uploaded next to it
+        htmlreport = get_env("HTMLREPORT","/coffeescraper.html")
+        htmlcompress = get_env("HTMLCOMPRESS", [])
+        with metrics.timer("stage_seconds", stage="html"):
+            pages = render_reports(
+                state,
+                db.get_sites(),
+                directory_html,
+                cheapest=cheapest,
+                max_points=int(get_env("HTMLMAXPOINTS", 500)),
+                index=posixpath.basename(htmlreport),
+                max_workers=int(get_env("REPORTWORKERS", os.cpu_count())),
+                split_data=get_env("HTMLDATAFILE", "no").lower() in ("yes", "true", "1"),
+                compress=[htmlcompress] if isinstance(htmlcompress, str) else htmlcompress,
+            )
+
+        # one session for all files, files that did not change since the previous upload are skipped
+        with metrics.timer("stage_seconds", stage="upload"), SFTPUploader(
+            hostfile="/run/secrets/sftp_host",
+            usernamefile="/run/secrets/sftp_user",
+            passwordfile="/run/secrets/sftp_password",
+            channels=int(get_env("SFTPCHANNELS", 4)),
+            manifest=get_env("SFTPMANIFEST", "/tmp/coffeescraper-sftp.json"),
+        ) as uploader:
+            uploader.upload_many(
+                [(filename, get_env("EXCELREPORT","/coffeescraper.xlsx"))]
+                + [(page, posixpath.join(posixpath.dirname(htmlreport), os.path.basename(page))) for page in pages]
+            )
+
+        state.save()
     else:
-        logging.info(f"no mailing sent, limit not reached {diff} > -{limit}")
+        logging.info("no new prices, reports not updated")
+
+    limit = float(get_env("ALERTLIMIT",0.50))
+    subject = get_env("ALERTSUBJECT","Coffee Alert")
+    for product in sorted(set(products.values())):
+        with metrics.timer("db_seconds", operation="get_difference"):
+            diff = db.get_difference(product)
+        if  diff <= -limit:
+            with metrics.timer("stage_seconds", stage="mail"):
+                send_message(
+                    get_env("ALERTSENDER"),
+                    get_env("ALERTRECIPIENTS"),
+                    subject if len(set(products.values())) == 1 else f"{subject} ({product})",
+                    get_secret_file("/run/secrets/smtp_message").format(limit=limit)
+                )
+        else:
+            logging.info(f"no mailing sent for {product}, limit not reached {diff} > -{limit}")
+
+    db.close()
+
+    metrics.set("run_seconds", time() - metrics.started)
+    metrics.set("last_run_timestamp_seconds", time())
+    metricsfile = get_env("METRICSFILE")
+    if metricsfile is not None:
+        metrics.write_prometheus(metricsfile)
+    runsummary = get_env("RUNSUMMARY")
+    if runsummary is not None:
+        metrics.write_json(runsummary)
 
     logging.info("coffeescraper completed")
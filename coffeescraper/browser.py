@@ -0,0 +1,178 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Module for managing headless Chromium instances driven by Selenium.
+
+Starting a Chromium browser takes several seconds and a lot of memory, so instead of
+starting a browser for every page, a BrowserPool keeps a number of browsers alive for
+the duration of a run and hands them out to scrapers one at a time.
+
+Classes:
+    BrowserPool:
+        A thread safe pool of warm Chromium WebDriver instances.
+
+Functions:
+    chromium_options(user_agent=None) -> Options:
+        Create the options for a headless Chromium browser.
+    new_driver(options) -> webdriver.Chrome:
+        Start a new Chromium browser.
+"""
+
+import logging
+import queue
+import threading
+from contextlib import contextmanager
+
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+
+from .metrics import metrics
+
+
+def chromium_options(user_agent: str | None = None) -> Options:
+    """
+    Create the options for a headless Chromium browser.
+
+    Args:
+        user_agent (str | None): The User-Agent string the browser should send, or None for the default.
+
+    Returns:
+        Options: The Chromium options.
+    """
+    options = Options()
+    options.add_argument("--headless")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    if user_agent is not None:
+        options.add_argument(f"--user-agent={user_agent}")
+    return options
+
+
+def new_driver(options: Options) -> webdriver.Chrome:
+    """
+    Start a new Chromium browser.
+
+    Args:
+        options (Options): The Chromium options, see chromium_options().
+
+    Returns:
+        webdriver.Chrome: The driver of the new browser. It should be quit by the caller.
+    """
+    with metrics.timer("browser_start_seconds"):
+        driver = webdriver.Chrome(
+            service=Service(service_args=["--verbose", "--log-path=/tmp/webdriver.log"]),
+            options=options,
+        )
+    driver.implicitly_wait(15)
+    logging.debug("chromium browser started")
+    return driver
+
+
+class BrowserPool:
+    """
+    A thread safe pool of warm Chromium WebDriver instances.
+
+    Browsers are started on demand, up to size browsers in total, and are kept alive
+    when they are checked back in, so subsequent scrapers can reuse them. A browser
+    that no longer responds is quit and replaced by a new one on the next checkout.
+
+    The pool should be closed when it is no longer needed, preferably by using it as a context manager.
+
+    Args:
+        size (int): The maximum number of browsers that are alive at the same time.
+        options (Options | None): The Chromium options for new browsers, or None for chromium_options().
+
+    Methods:
+        driver(self, timeout=None):
+            Context manager that checks out a browser and checks it back in afterwards.
+        close(self) -> None:
+            Quit all browsers in the pool.
+    """
+
+    def __init__(self, size: int = 2, options: Options | None = None) -> None:
+        self.size = size
+        self.options = options if options is not None else chromium_options()
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @contextmanager
+    def driver(self, timeout: float | None = None):
+        """
+        Check out a browser for exclusive use and check it back in afterwards.
+
+        Args:
+            timeout (float | None): The maximum number of seconds to wait for a free browser, or None to wait indefinitely.
+
+        Yields:
+            webdriver.Chrome: A running browser.
+
+        Raises:
+            TimeoutError: If no browser became available within timeout seconds.
+            RuntimeError: If the pool is closed.
+        """
+        if self._closed:
+            raise RuntimeError("browser pool is closed")
+        if not self._slots.acquire(timeout=-1 if timeout is None else timeout):
+            raise TimeoutError(f"no browser available within {timeout}s")
+        try:
+            driver = self._checkout()
+            try:
+                yield driver
+            finally:
+                if self._closed:
+                    self._quit(driver)
+                else:
+                    self._idle.put(driver)
+        finally:
+            self._slots.release()
+
+    def close(self) -> None:
+        """
+        Quit all browsers in the pool.
+
+        Browsers that are checked out at this moment are quit when they are checked back in.
+        """
+        self._closed = True
+        while True:
+            try:
+                self._quit(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        logging.debug("browser pool closed")
+
+    def _checkout(self) -> webdriver.Chrome:
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if self._alive(driver):
+                return driver
+            logging.warning("chromium browser stopped responding, recycling it")
+            self._quit(driver)
+
+        return new_driver(self.options)
+
+    @staticmethod
+    def _alive(driver: webdriver.Chrome) -> bool:
+        try:
+            driver.current_url
+            return True
+        except WebDriverException:
+            return False
+
+    @staticmethod
+    def _quit(driver: webdriver.Chrome) -> None:
+        try:
+            driver.quit()
+        except Exception as e:
+            logging.debug(f"error quitting chromium browser {e}")
@@ -0,0 +1,118 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Module for caching HTTP validators and prices between runs.
+
+Most product pages hardly change from one day to the next. By remembering the ETag and
+Last-Modified headers of a page, together with the price extracted from it, the next
+request can be a conditional GET. If the server answers with 304 Not Modified, the
+cached price is used and the page is neither downloaded nor scanned again.
+
+Classes:
+    HttpCache:
+        A thread safe, JSON file backed cache of validators and prices keyed by URL.
+"""
+
+import json
+import logging
+import threading
+
+from .utils import load_json, write_atomic
+
+
+class HttpCache:
+    """
+    A thread safe, JSON file backed cache of validators and prices keyed by URL.
+
+    The cache is read when it is created and written by save(), or when used as a context manager, on exit.
+
+    Args:
+        filename (str): The path of the JSON file that holds the cache. It does not need to exist yet.
+
+    Methods:
+        conditional_headers(self, url) -> dict[str, str]:
+            Return the headers for a conditional GET of url.
+        price(self, url) -> float | None:
+            Return the cached price of url.
+        store(self, url, headers, price) -> None:
+            Remember the validators in the response headers and the price of url.
+        save(self) -> None:
+            Write the cache to disk.
+    """
+
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._entries = load_json(filename, {})
+        logging.debug(f"http cache loaded from {filename} ({len(self._entries)} entries)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.save()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def conditional_headers(self, url: str) -> dict[str, str]:
+        """
+        Return the headers for a conditional GET of url.
+
+        Args:
+            url (str): The URL of the page.
+
+        Returns:
+            dict[str, str]: If-None-Match and/or If-Modified-Since headers, or an empty dict if nothing is cached for url.
+        """
+        with self._lock:
+            entry = self._entries.get(url)
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def price(self, url: str) -> float | None:
+        """
+        Return the cached price of url.
+
+        Args:
+            url (str): The URL of the page.
+
+        Returns:
+            float | None: The price extracted the last time the page was downloaded, or None if nothing is cached for url.
+        """
+        with self._lock:
+            entry = self._entries.get(url)
+        return None if entry is None else entry["price"]
+
+    def store(self, url: str, headers, price: float) -> None:
+        """
+        Remember the validators in the response headers and the price of url.
+
+        Nothing is stored if the response has neither an ETag nor a Last-Modified header.
+
+        Args:
+            url (str): The URL of the page.
+            headers (Mapping[str, str]): The case insensitive response headers.
+            price (float): The price extracted from the page.
+        """
+        etag = headers.get("ETag")
+        last_modified = headers.get("Last-Modified")
+        with self._lock:
+            if etag is None and last_modified is None:
+                self._entries.pop(url, None)
+            else:
+                self._entries[url] = {"etag": etag, "last_modified": last_modified, "price": price}
+
+    def save(self) -> None:
+        """
+        Write the cache to disk, atomically.
+        """
+        with self._lock:
+            content = json.dumps(self._entries)
+        write_atomic(self.filename, content)
+        logging.debug(f"http cache saved to {self.filename} ({len(self._entries)} entries)")
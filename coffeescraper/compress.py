@@ -0,0 +1,68 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Module for precompressing the files of the reports.
+
+Web servers like nginx (gzip_static, brotli_static) and Caddy (precompressed) can serve
+a file.gz or file.br sibling directly to browsers that accept it, instead of compressing
+the file on every request or serving it uncompressed. Writing the siblings once, when
+the reports are created, also means fewer bytes to upload.
+
+The gzip files are written without a timestamp or file name in their header, so an
+unchanged file always compresses to exactly the same bytes and is not uploaded again.
+
+Brotli compression needs the optional brotli package.
+
+Functions:
+    precompress(filename, formats=("gz",), level=9) -> list[str]:
+        Write compressed siblings of a file and return their paths.
+"""
+
+import gzip
+import logging
+import shutil
+from typing import Iterable
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+suffixes = {"gz", "br"}
+
+
+def precompress(filename: str, formats: Iterable[str] = ("gz",), level: int = 9) -> list[str]:
+    """
+    Write compressed siblings of a file and return their paths.
+
+    Args:
+        filename (str): The path of the file.
+        formats (Iterable[str]): The formats to write, gz for gzip and br for brotli.
+        level (int): The gzip compression level, brotli always uses its highest quality.
+
+    Returns:
+        list[str]: The paths of the compressed files, filename with .gz or .br appended.
+
+    Raises:
+        ValueError: If a format is not gz or br.
+    """
+    filename = str(filename)
+    paths = []
+    for format in formats:
+        if format not in suffixes:
+            raise ValueError(f"unknown compression format {format}, use one of {', '.join(sorted(suffixes))}")
+        path = f"{filename}.{format}"
+        if format == "gz":
+            with open(filename, "rb") as src, open(path, "wb") as raw:
+                with gzip.GzipFile(filename="", mode="wb", compresslevel=level, fileobj=raw, mtime=0) as dst:
+                    shutil.copyfileobj(src, dst)
+        elif brotli is None:
+            logging.warning(f"brotli is not installed, {path} not written")
+            continue
+        else:
+            with open(filename, "rb") as src:
+                data = brotli.compress(src.read(), mode=brotli.MODE_TEXT)
+            with open(path, "wb") as dst:
+                dst.write(data)
+        paths.append(path)
+    return paths
@@ -1,60 +1,313 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import logging
-from typing import Generator
-from datetime import datetime
+import queue
+from abc import ABC, abstractmethod
+import threading
+from contextlib import contextmanager
+from itertools import count
+from time import sleep, monotonic
+from typing import Generator, Iterable, Mapping
+from datetime import datetime, date, timedelta
 import psycopg2
+from psycopg2.extras import execute_values
+
+from .utils import get_env
+
+# the product of the sites that were stored before products were introduced
+DEFAULT_PRODUCT = "Dolce Gusto Lungo XL (30 cups)"
 
 def now():
     return datetime.now() # pragma: no cover
 
-class PriceDatabase:
+
+def open_database():
+    """
+    Open the price database selected by the DATABASE environment variable.
+
+    DATABASE can be "postgres" (the default) or "sqlite". The SQLite database file
+    is given by the SQLITEDB environment variable.
+
+    Returns:
+        BasePriceDatabase: A PriceDatabase or an SQLitePriceDatabase.
+
+    Raises:
+        ValueError: If DATABASE names an unknown backend.
+    """
+    backend = get_env("DATABASE", "postgres")
+    if backend == "postgres":
+        return PriceDatabase()
+    if backend == "sqlite":
+        from .sqlite import SQLitePriceDatabase
+        return SQLitePriceDatabase(get_env("SQLITEDB", "/tmp/coffeescraper.db"))
+    raise ValueError(f"Invalid database backend: {backend}")
+
+
+class BasePriceDatabase(ABC):
+    """
+    The storage interface for coffee prices, shared by all database backends.
+
+    A backend stores prices per site in a 'site' and a 'url_price' table and maintains
+    a daily rollup per site in a 'price_daily' table. Every site sells a single product,
+    the product of a site is stored in the 'site' table. The base class takes care of
+    everything that does not depend on the backend, like adding timestamps to new rows
+    and deciding which days to compare. A backend implements the remaining, abstract methods.
+
+    Attributes:
+        table_created (bool): Flag indicating if the tables have been created.
+        identity (str): The backend and location of the database, to tell databases apart.
+
+    Methods:
+        create_table(self) -> None:
+            Creates the tables and their indexes if they don't exist.
+        max_id(self) -> int | None:
+            Returns the highest id in the 'url_price' table.
+        insert_tuple_into_table(self, url, price) -> None:
+            Inserts a tuple of URL, price, and timestamp into the database.
+        insert_rows(self, rows) -> int:
+            Inserts many (url, price) or (url, price, timestamp) rows in a single transaction.
+        set_products(self, products) -> None:
+            Stores the product of each site.
+        get_sites(self) -> dict[str, str]:
+            Retrieves the product of each site.
+        max_id(self) -> int | None:
+            Retrieves the highest id in the 'url_price' table.
+        get_prices(self, itersize, since, until, urls, after_id, product) -> Generator[tuple[int, str, float, datetime], None, None]:
+            Streams rows from the 'url_price' table, optionally filtered, as a generator of tuples.
+        get_daily(self, since, until, per_site, product) -> Generator[tuple, None, None]:
+            Retrieves the daily rollup, either per site or over all sites.
+        get_difference(self, product) -> float:
+            Calculates the price difference between minimum prices of today and yesterday.
+        cursor(self):
+            Context manager that yields a cursor and commits afterwards.
+        close(self) -> None:
+            Closes all connections.
+    """
+
+    table_created = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    @abstractmethod
+    def identity(self) -> str:
+        """The backend and location of the database, to tell databases apart."""
+
+    @abstractmethod
+    def close(self) -> None:
+        """Closes all connections."""
+
+    @abstractmethod
+    def cursor(self):
+        """Context manager that yields a cursor and commits afterwards."""
+
+    @abstractmethod
+    def create_table(self) -> None:
+        """Creates the tables and their indexes if they don't exist."""
+
+    @abstractmethod
+    def set_products(self, products:Mapping[str,str]) -> None:
+        """Stores the product of each site."""
+
+    @abstractmethod
+    def get_sites(self) -> dict[str,str]:
+        """Retrieves the product of each site."""
+
+    @abstractmethod
+    def max_id(self) -> int|None:
+        """Returns the highest id in the 'url_price' table, None if it is empty."""
+
+    @abstractmethod
+    def get_prices(self, itersize:int=2000, since:datetime|None=None, until:datetime|None=None, urls:Iterable[str]|None=None, after_id:int|None=None, product:str|None=None) -> Generator[tuple[int,str,float,datetime],None,None]:
+        """Streams rows from the 'url_price' table, optionally filtered, as a generator of tuples."""
+
+    @abstractmethod
+    def get_daily(self, since:date|None=None, until:date|None=None, per_site:bool=False, product:str|None=None) -> Generator[tuple,None,None]:
+        """Retrieves the daily rollup, either per site or over all sites."""
+
+    @abstractmethod
+    def _insert_values(self, values:list[tuple[str,float,datetime]]) -> None:
+        """Inserts rows with a timestamp and updates the daily rollup, in a single transaction."""
+
+    @abstractmethod
+    def _difference(self, today:date, yesterday:date, product:str|None) -> float|None:
+        """Returns the difference between the minimum prices of two days, None if a day has no prices."""
+
+    def insert_tuple_into_table(self, url:str, price:float) -> None:
+        """
+        Insert a tuple of URL, price, and timestamp into the database.
+
+        The timestamp added to the record is the current time.
+
+        Args:
+            url (str): The URL associated with the price.
+            price (float): The price value to be inserted.
+
+        Returns:
+            None
+        """
+        
+        self.insert_rows([(url, price)])
+        logging.debug(f"Tuple {url},{price} inserted successfully!")
+
+
+    def insert_rows(self, rows:Iterable[tuple[str,float]|tuple[str,float,datetime]]) -> int:
+        """
+        Insert many rows into the database in a single transaction.
+
+        The daily rollup is updated in the same transaction.
+
+        Args:
+            rows (Iterable[tuple[str, float] | tuple[str, float, datetime]]): The rows to insert.
+                Rows without a timestamp get the current time.
+
+        Returns:
+            int: The number of rows inserted.
+        """
+
+        if not self.table_created: self.create_table()
+
+        timestamp = now()
+        values = [(row[0], row[1], row[2] if len(row) > 2 else timestamp) for row in rows]
+        if not values:
+            return 0
+
+        self._insert_values(values)
+        logging.debug(f"{len(values)} rows inserted successfully!")
+        return len(values)
+
+
+    def get_difference(self, product:str|None=None) -> float:
+        """
+        Return the price difference between the minimum prices of today and yesterday.
+
+        If the result is negative this means the price is lower today than it was yesterday.
+        The minimum prices are read from the daily rollup, so the cost does not depend on
+        the length of the price history.
+
+        Args:
+            product (str | None): If given, only the sites selling this product are compared.
+
+        Returns:
+            float: The price difference between today and yesterday.
+        """
+        if not self.table_created: self.create_table()
+
+        today = now().date()
+        result = self._difference(today, today - timedelta(days=1), product)
+        if result is None:
+            return 0.0
+        return result
+
+
+class PriceDatabase(BasePriceDatabase):
     """
     A class for managing a PostgreSQL database of coffee prices.
 
     This class provides methods to create the necessary table, insert price data,
     retrieve price data, and calculate the price difference between two days.
 
+    Besides the raw prices, a daily rollup with the minimum, maximum, sum and count
+    of the prices per site per day is maintained in the 'price_daily' table. It is updated
+    in the same statement that inserts the prices, so daily figures never need a scan
+    of the full price history.
+
+    Connections are taken from a thread safe pool and only opened when they are needed, so
+    creating a PriceDatabase does not connect yet and several threads can use the same
+    instance at the same time. A connection that was idle for a while is checked before
+    it is handed out, and an operation that fails because the connection was lost, for
+    example because the database restarted, is retried on a new connection.
+
+    A PriceDatabase should be closed when it is no longer needed, preferably by using it as a context manager.
+
     Attributes:
-        connection (psycopg2.extensions.connection): The database connection.
         table_created (bool): Flag indicating if the table has been created.
+        identity (str): The user, host, port and name of the database.
 
     Methods:
-        __init__(self, host, port, username, password, dbname):
+        __init__(self, host, port, username, password, dbname, maxconn, retries, retry_delay):
             Initializes a PriceDatabase instance with database connection parameters.
         get_password() -> str:
             Static method to retrieve the database password from a secrets file.
+        cursor(self, name=None):
+            Context manager that yields a cursor on a pooled connection and commits afterwards.
+        close(self) -> None:
+            Closes all connections.
         create_table(self) -> None:
-            Creates the 'url_price' table if it doesn't exist.
+            Creates the 'site', 'url_price' and 'price_daily' tables and their indexes if they don't exist, upgrading older tables in place.
         insert_tuple_into_table(self, url, price) -> None:
             Inserts a tuple of URL, price, and timestamp into the database.
-        get_prices(self) -> Generator[tuple[int, str, float, datetime], None, None]:
-            Retrieves all rows from the 'url_price' table as a generator of tuples.
-        get_difference(self) -> float:
+        insert_rows(self, rows) -> int:
+            Inserts many (url, price) or (url, price, timestamp) rows in a single transaction.
+        set_products(self, products) -> None:
+            Stores the product of each site.
+        get_sites(self) -> dict[str, str]:
+            Retrieves the product of each site.
+        get_prices(self, itersize, since, until, urls, after_id, product) -> Generator[tuple[int, str, float, datetime], None, None]:
+            Streams rows from the 'url_price' table, optionally filtered, as a generator of tuples.
+        get_daily(self, since, until, per_site, product) -> Generator[tuple, None, None]:
+            Retrieves the daily rollup, either per site or over all sites.
+        get_difference(self, product) -> float:
             Calculates the price difference between minimum prices of today and yesterday.
 
     """
    
-    def __init__(self, host:str="db", port:str="5432", username:str="postgres", password:str|None=None, dbname:str="postgres"):
+    # connections idle for longer than this number of seconds are checked before use
+    health_check_interval = 30.0
+
+    def __init__(self, host:str="db", port:str="5432", username:str="postgres", password:str|None=None, dbname:str="postgres", maxconn:int=4, retries:int=3, retry_delay:float=1.0):
         """
         Initialize a PriceDatabase instance with the given database connection parameters.
 
+        No connection is opened until the database is actually used.
+
         Args:
             host (str): Database host name.
             port (str): Database port number.
             username (str): Database username.
             password (str | None): Database password or None to read from secrets file.
             dbname (str): Database name.
+            maxconn (int): The maximum number of simultaneous connections.
+            retries (int): The number of times an operation is retried after the connection was lost.
+            retry_delay (float): The delay in seconds before the first retry, it doubles with every retry.
         """
-        self.connection = psycopg2.connect(
+        self._params = dict(
             dbname=dbname,
             user=username,
             password=password if password is not None else self.get_password(),
             host=host,
             port=port,
         )
-        logging.info(f"database connection to {host}:{port}/{dbname} opened")
+        self.maxconn = maxconn
+        self.retries = retries
+        self.retry_delay = retry_delay
         self.table_created = False
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._table_lock = threading.Lock()
+        self._cursors = count()
+
+    @property
+    def identity(self) -> str:
+        return f"postgres://{self._params['user']}@{self._params['host']}:{self._params['port']}/{self._params['dbname']}"
+
+    def close(self) -> None:
+        """
+        Close all idle connections.
+
+        The database can still be used afterwards, new connections are opened when needed.
+        """
+        while True:
+            try:
+                connection, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            connection.close()
+        logging.info(f"database connections to {self._params['host']}:{self._params['port']}/{self._params['dbname']} closed")
     
     @staticmethod
     def get_password() -> str:
@@ -75,52 +328,293 @@ class PriceDatabase:
             return "postgres"
 
 
+    @contextmanager
+    def cursor(self, name:str|None=None):
+        """
+        Check out a connection from the pool and yield a cursor on it.
+
+        The transaction is committed when the block ends normally and rolled back if it raises.
+        A connection that turns out to be broken is closed instead of returned to the pool.
+        If all maxconn connections are in use, this waits until one is returned.
+
+        Args:
+            name (str | None): If given, a named server-side cursor is created.
+
+        Yields:
+            psycopg2.extensions.cursor: The cursor.
+        """
+        with self._slots:
+            connection = self._checkout()
+            broken = False
+            try:
+                with connection.cursor(name) as cursor:
+                    yield cursor
+                connection.commit()
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                broken = True
+                raise
+            except BaseException:
+                connection.rollback()
+                raise
+            finally:
+                if broken or connection.closed != 0:
+                    connection.close()
+                else:
+                    self._idle.put((connection, monotonic()))
+
+
+    def _checkout(self):
+        while True:
+            try:
+                connection, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                connection = psycopg2.connect(**self._params)
+                logging.info(f"database connection to {self._params['host']}:{self._params['port']}/{self._params['dbname']} opened")
+                return connection
+            idle = monotonic() - last_used
+            if connection.closed == 0 and (idle < self.health_check_interval or self._healthy(connection)):
+                return connection
+            logging.warning("database connection lost, reconnecting")
+            connection.close()
+
+
+    @staticmethod
+    def _healthy(connection) -> bool:
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1;")
+            connection.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+
+    def _run(self, operation):
+        """
+        Call operation with a cursor and return its result, retrying when the connection is lost.
+
+        Retrying an INSERT is safe unless the connection was lost after the server
+        committed but before it acknowledged the commit, which is very unlikely.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                with self.cursor() as cursor:
+                    return operation(cursor)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                if attempt == self.retries:
+                    raise
+                delay = self.retry_delay * 2 ** attempt
+                logging.warning(f"database error {e}, retrying in {delay}s")
+                sleep(delay)
+
+
     def create_table(self) -> None:
+        """
+        Create the 'site' and 'url_price' tables and their indexes if they don't exist.
+
+        Each url is stored once in the 'site' table and 'url_price' refers to it by site_id.
+        A 'url_price' table created by an earlier version, with a url in every row, is
+        upgraded in place: its urls are moved to the 'site' table and the url column is dropped.
+        Everything happens in a single transaction, so an interrupted upgrade leaves the
+        original table untouched.
+
+        The composite index on (site_id, timestamp) serves per site queries, the BRIN index
+        on timestamp serves date range queries over all sites. A BRIN index stays very small
+        because prices are inserted in timestamp order.
+
+        When the 'price_daily' rollup table is created it is filled from the existing prices.
+        Sites stored before the 'product' column was added get DEFAULT_PRODUCT as their product.
+
+        Returns:
+            None
+        """
         create_table_query = """
+            CREATE TABLE IF NOT EXISTS site (
+                id SERIAL PRIMARY KEY,
+                url TEXT NOT NULL UNIQUE,
+                product TEXT NOT NULL DEFAULT %(product)s
+            );
+            ALTER TABLE site ADD COLUMN IF NOT EXISTS product TEXT NOT NULL DEFAULT %(product)s;
             CREATE TABLE IF NOT EXISTS url_price (
                 id SERIAL PRIMARY KEY,
-                url TEXT,
+                site_id INTEGER REFERENCES site (id),
                 price FLOAT,
                 timestamp TIMESTAMP
             );
+            ALTER TABLE url_price ADD COLUMN IF NOT EXISTS site_id INTEGER REFERENCES site (id);
+        """
+        old_schema_query = """
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'url_price' AND column_name = 'url';
+        """
+        upgrade_query = """
+            INSERT INTO site (url)
+            SELECT DISTINCT url FROM url_price WHERE url IS NOT NULL
+            ON CONFLICT (url) DO NOTHING;
+            UPDATE url_price SET site_id = site.id
+            FROM site
+            WHERE url_price.url = site.url AND url_price.site_id IS NULL;
+            ALTER TABLE url_price DROP COLUMN url;
+        """
+        create_index_query = """
+            CREATE INDEX IF NOT EXISTS url_price_site_timestamp ON url_price (site_id, timestamp);
+            CREATE INDEX IF NOT EXISTS url_price_timestamp_brin ON url_price USING BRIN (timestamp);
+            CREATE INDEX IF NOT EXISTS site_product ON site (product);
+        """
+        rollup_exists_query = """
+            SELECT to_regclass('price_daily') IS NOT NULL;
+        """
+        create_rollup_query = """
+            CREATE TABLE price_daily (
+                day DATE NOT NULL,
+                site_id INTEGER NOT NULL REFERENCES site (id),
+                min_price FLOAT NOT NULL,
+                max_price FLOAT NOT NULL,
+                sum_price FLOAT NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (day, site_id)
+            );
+            INSERT INTO price_daily (day, site_id, min_price, max_price, sum_price, count)
+            SELECT DATE(timestamp), site_id, MIN(price), MAX(price), SUM(price), COUNT(*)
+            FROM url_price
+            WHERE site_id IS NOT NULL AND price IS NOT NULL AND timestamp IS NOT NULL
+            GROUP BY DATE(timestamp), site_id;
         """
-        with self.connection.cursor() as cursor:
-            cursor.execute(create_table_query)
-            self.connection.commit()
+        def create(cursor):
+            cursor.execute(create_table_query, {"product": DEFAULT_PRODUCT})
+            cursor.execute(old_schema_query)
+            if cursor.fetchone() is not None:
+                cursor.execute(upgrade_query)
+                logging.info(f"table url_price upgraded, urls moved to table site")
+            cursor.execute(create_index_query)
+            cursor.execute(rollup_exists_query)
+            if not cursor.fetchone()[0]:
+                cursor.execute(create_rollup_query)
+                logging.info(f"new table price_daily created and filled from url_price")
+
+        # concurrent callers should not try to upgrade the tables at the same time
+        with self._table_lock:
+            if self.table_created:
+                return
+            self._run(create)
             self.table_created = True
-            logging.info(f"new table url_price created if it did not exist")
+            logging.info(f"new tables site and url_price created if they did not exist")
 
 
-    def insert_tuple_into_table(self, url:str, price:float) -> None:
+    def _insert_values(self, values:list[tuple[str,float,datetime]]) -> None:
         """
-        Insert a tuple of URL, price, and timestamp into the database.
+        Insert (url, price, timestamp) rows and update the daily rollup.
 
-        The timestamp added to the record is the current time.
+        New sites are added by a first statement, then all rows are sent as a single multi-row
+        INSERT statement that also updates the daily rollup, so a full run costs two round-trips
+        and one commit instead of one per price.
+        """
+
+        def insert(cursor):
+            # the sites are added in a separate statement. A statement only sees the rows committed
+            # when it started, so a site that a concurrent session added while the insert waited on
+            # its conflict would be missing from a join in the same statement. The next statement
+            # sees it. The urls are sorted so concurrent sessions lock them in the same order.
+            site_query = "INSERT INTO site (url) VALUES %s ON CONFLICT (url) DO NOTHING;"
+            urls = sorted({url for url, _, _ in values})
+            execute_values(cursor, site_query, [(url,) for url in urls], page_size=len(urls))
+            insert_query = """
+                WITH v (url, price, timestamp) AS (VALUES %s),
+                new_price AS (
+                    INSERT INTO url_price (site_id, price, timestamp)
+                    SELECT site.id, v.price, v.timestamp
+                    FROM v
+                    JOIN site ON site.url = v.url
+                    RETURNING site_id, price, timestamp
+                )
+                INSERT INTO price_daily AS d (day, site_id, min_price, max_price, sum_price, count)
+                SELECT DATE(timestamp), site_id, MIN(price), MAX(price), SUM(price), COUNT(*)
+                FROM new_price
+                GROUP BY DATE(timestamp), site_id
+                ON CONFLICT (day, site_id) DO UPDATE SET
+                    min_price = LEAST(d.min_price, EXCLUDED.min_price),
+                    max_price = GREATEST(d.max_price, EXCLUDED.max_price),
+                    sum_price = d.sum_price + EXCLUDED.sum_price,
+                    count = d.count + EXCLUDED.count;
+            """
+            execute_values(cursor, insert_query, values, page_size=len(values))
+
+        self._run(insert)
+
+
+    def set_products(self, products:Mapping[str,str]) -> None:
+        """
+        Store the product of each site, sites that are not in the database yet are added.
 
         Args:
-            url (str): The URL associated with the price.
-            price (float): The price value to be inserted.
+            products (Mapping[str, str]): The product of each site, keyed by url.
 
         Returns:
             None
         """
-        
+
         if not self.table_created: self.create_table()
+        if not products:
+            return
 
-        with self.connection.cursor() as cursor:
-            timestamp = now()
-            insert_query = """
-                INSERT INTO url_price (url, price, timestamp)
-                VALUES (%s, %s, %s);
+        def store(cursor):
+            query = """
+                INSERT INTO site (url, product) VALUES %s
+                ON CONFLICT (url) DO UPDATE SET product = EXCLUDED.product;
             """
-            cursor.execute(insert_query, (url, price, timestamp))
-            self.connection.commit()
-            logging.debug(f"Tuple {url},{price} inserted successfully!")
+            execute_values(cursor, query, list(products.items()), page_size=len(products))
+
+        self._run(store)
+
+
+    def get_sites(self) -> dict[str,str]:
+        """
+        Retrieve the product of each site.
+
+        Returns:
+            dict[str, str]: The product of each site, keyed by url.
+        """
+
+        if not self.table_created: self.create_table()
+
+        def sites(cursor):
+            cursor.execute("SELECT url, product FROM site ORDER BY url;")
+            return dict(cursor.fetchall())
+
+        return self._run(sites)
+
+
+    def max_id(self) -> int|None:
+        """
+        Retrieve the highest id in the 'url_price' table.
+
+        Returns:
+            int | None: The highest id, or None if the table is empty.
+        """
+
+        if not self.table_created: self.create_table()
+
+        def maximum(cursor):
+            cursor.execute("SELECT MAX(id) FROM url_price;")
+            return cursor.fetchone()[0]
+
+        return self._run(maximum)
 
 
-    def get_prices(self) -> Generator[tuple[int,str,float,datetime],None,None]:
+    def get_prices(self, itersize:int=2000, since:datetime|None=None, until:datetime|None=None, urls:Iterable[str]|None=None, after_id:int|None=None, product:str|None=None) -> Generator[tuple[int,str,float,datetime],None,None]:
         """
-        Retrieve all rows from the 'url_price' table as a generator of tuples.
+        Retrieve rows from the 'url_price' table as a generator of tuples, ordered by id.
+
+        The rows are read through a server-side cursor, itersize rows at a time,
+        so memory use does not depend on the size of the table.
+
+        Args:
+            itersize (int): The number of rows fetched from the server in each round-trip.
+            since (datetime | None): If given, only rows with a timestamp at or after since are returned.
+            until (datetime | None): If given, only rows with a timestamp before until are returned.
+            urls (Iterable[str] | None): If given, only rows for these urls are returned.
+            after_id (int | None): If given, only rows with an id greater than after_id are returned.
+            product (str | None): If given, only rows for sites selling this product are returned.
 
         Yields:
             tuple[int, str, float, datetime]: Generator yielding rows with id, url, price, and timestamp.
@@ -131,45 +625,117 @@ class PriceDatabase:
         
         if not self.table_created: self.create_table()
 
-        with self.connection.cursor() as cursor:
-            query = """
-                SELECT * FROM url_price;
+        conditions = []
+        params = []
+        if since is not None:
+            conditions.append("url_price.timestamp >= %s")
+            params.append(since)
+        if until is not None:
+            conditions.append("url_price.timestamp < %s")
+            params.append(until)
+        if urls is not None:
+            conditions.append("site.url = ANY(%s)")
+            params.append(list(urls))
+        if after_id is not None:
+            conditions.append("url_price.id > %s")
+            params.append(after_id)
+        if product is not None:
+            conditions.append("site.product = %s")
+            params.append(product)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        # a named cursor lives on the server, its name must be unique per connection
+        with self.cursor(name=f"get_prices_{next(self._cursors)}") as cursor:
+            cursor.itersize = itersize
+            query = f"""
+                SELECT url_price.id, site.url, url_price.price, url_price.timestamp
+                FROM url_price
+                JOIN site ON site.id = url_price.site_id
+                {where}
+                ORDER BY url_price.id;
             """
-            cursor.execute(query)
-            for row in cursor.fetchall():
+            cursor.execute(query, params)
+            for row in cursor:
                 yield row
 
 
-    def get_difference(self) -> float:
+    def get_daily(self, since:date|None=None, until:date|None=None, per_site:bool=False, product:str|None=None) -> Generator[tuple,None,None]:
         """
-        Return the price difference between the minimum prices of today and yesterday.
+        Retrieve the daily rollup, ordered by day.
 
-        If the result is negative this means the price is lower today than it was yesterday.
+        Args:
+            since (date | None): If given, only days at or after since are returned.
+            until (date | None): If given, only days before until are returned.
+            per_site (bool): Return a row per site per day instead of a row per day.
+            product (str | None): If given, only sites selling this product are included.
+
+        Yields:
+            tuple[date, str, float, float, float, int]: If per_site is True, rows with day, url, minimum, maximum, average and count.
+            tuple[date, float, float, float, int, str]: Otherwise, rows with day, minimum, maximum, average, count and the url of the cheapest site.
 
         Returns:
-            float: The price difference between today and yesterday.
+            Generator[tuple, None, None]
         """
+
         if not self.table_created: self.create_table()
 
-        with self.connection.cursor() as cursor:
-            n = now()
-            query = """
-                SELECT price FROM url_price
-                WHERE DATE(timestamp) = %s
-                ORDER BY price ASC
-                LIMIT 1;
+        conditions = []
+        params = []
+        if since is not None:
+            conditions.append("d.day >= %s")
+            params.append(since)
+        if until is not None:
+            conditions.append("d.day < %s")
+            params.append(until)
+        if product is not None:
+            conditions.append("site.product = %s")
+            params.append(product)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        cheapest = "AND s.product = %s" if product is not None else ""
+        if per_site:
+            query = f"""
+                SELECT d.day, site.url, d.min_price, d.max_price, d.sum_price / d.count, d.count
+                FROM price_daily d
+                JOIN site ON site.id = d.site_id
+                {where}
+                ORDER BY d.day, site.url;
             """
-            cursor.execute(query,(n,))
-            min_today = cursor.fetchone()
-            query = """
-                SELECT price FROM url_price
-                WHERE DATE(timestamp) = %s - INTERVAL '1 day'
-                ORDER BY price ASC
-                LIMIT 1;
+        else:
+            query = f"""
+                SELECT d.day, MIN(d.min_price), MAX(d.max_price), SUM(d.sum_price) / SUM(d.count), SUM(d.count),
+                    (SELECT s.url FROM price_daily c
+                     JOIN site s ON s.id = c.site_id
+                     WHERE c.day = d.day {cheapest}
+                     ORDER BY c.min_price, s.url
+                     LIMIT 1)
+                FROM price_daily d
+                JOIN site ON site.id = d.site_id
+                {where}
+                GROUP BY d.day
+                ORDER BY d.day;
             """
-            cursor.execute(query,(n,))
-            min_yesterday = cursor.fetchone()
-            if min_today is None or min_yesterday is None:
-                return 0.0
-            return min_today[0] - min_yesterday[0]
+            # the subquery comes first in the statement, so does its parameter
+            if product is not None:
+                params.insert(0, product)
+        def daily(cursor):
+            cursor.execute(query, params)
+            return cursor.fetchall()
+
+        for row in self._run(daily):
+            yield row
+
+
+    def _difference(self, today:date, yesterday:date, product:str|None) -> float|None:
+        minimum = "SELECT MIN(d.min_price) FROM price_daily d JOIN site ON site.id = d.site_id WHERE d.day = %s"
+        if product is not None:
+            minimum += " AND site.product = %s"
+        query = f"SELECT ({minimum}) - ({minimum});"
+        params = (today, product, yesterday, product) if product is not None else (today, yesterday)
+
+        def difference(cursor):
+            cursor.execute(query, params)
+            return cursor.fetchone()[0]
+
+        return self._run(difference)
 
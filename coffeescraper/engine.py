@@ -0,0 +1,338 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Module for running a collection of scrapers concurrently.
+
+Every scraper in the collection is called in a worker thread, so the total time of a run
+is roughly the time of the slowest site instead of the sum of all sites.
+Each site gets its own deadline, counted from the moment its scraper actually starts.
+The threads are fed by a PoliteScheduler, which keeps the requests to each host within its limits.
+Transient failures can be retried with a RetryPolicy, and sites that keep failing run after run
+can be skipped with a CircuitBreaker.
+
+Classes:
+    ScrapeReport:
+        The structured outcome of a run: prices found, prices not found and other errors.
+
+Functions:
+    scrape_all(sites, max_workers=8, timeout=60.0, scheduler=None, retry=None, breaker=None) -> ScrapeReport:
+        Call all scrapers concurrently and collect the outcome in a ScrapeReport.
+    scrape_all_async(sites, limit=100, limit_per_host=4, timeout=60.0, retry=None, breaker=None) -> ScrapeReport:
+        Await all asynchronous scrapers on a shared session and collect the outcome in a ScrapeReport.
+"""
+
+import asyncio
+import logging
+import threading
+from itertools import count
+from time import monotonic, sleep
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+
+from .resilience import RetryPolicy, CircuitBreaker, CircuitOpenError
+from .scheduler import PoliteScheduler
+from .scraper import PriceNotFoundException, create_session
+
+
+class ScrapeReport:
+    """
+    The outcome of calling a collection of scrapers.
+
+    Attributes:
+        results (list[tuple[str, float]]): The (url, price) tuples that were retrieved, in the order of the sites.
+        not_found (dict[str, PriceNotFoundException]): Sites where the page was retrieved but no price was found.
+        errors (dict[str, Exception]): Sites that failed for any other reason, including missed deadlines.
+        durations (dict[str, float]): The wall clock time in seconds spent on each site that finished.
+    """
+
+    def __init__(self) -> None:
+        self.results = []
+        self.not_found = {}
+        self.errors = {}
+        self.durations = {}
+
+    @property
+    def cheapest(self) -> tuple[str, float] | None:
+        """
+        The (url, price) tuple with the lowest price, or None if no price was retrieved at all.
+        """
+        return min(self.results, key=lambda result: result[1], default=None)
+
+    def cheapest_per_product(self, products: dict[str, str]) -> dict[str, tuple[str, float]]:
+        """
+        Return the (url, price) tuple with the lowest price for every product.
+
+        Args:
+            products (dict[str, str]): The product of each site, keyed by url.
+
+        Returns:
+            dict[str, tuple[str, float]]: The cheapest result keyed by product, products without any result are left out.
+        """
+        cheapest = {}
+        for url, price in self.results:
+            product = products.get(url)
+            if product not in cheapest or price < cheapest[product][1]:
+                cheapest[product] = (url, price)
+        return cheapest
+
+    def __len__(self) -> int:
+        return len(self.results) + len(self.not_found) + len(self.errors)
+
+    def add_failure(self, url: str, exception: Exception) -> None:
+        """
+        Record a site that did not produce a price.
+
+        Args:
+            url (str): The url of the site.
+            exception (Exception): The exception raised while scraping the site.
+        """
+        logging.warning(f"error retrieving price from {url} {exception}")
+        if isinstance(exception, PriceNotFoundException):
+            self.not_found[url] = exception
+        else:
+            self.errors[url] = exception
+
+
+def scrape_all(
+    sites,
+    max_workers: int = 8,
+    timeout: float = 60.0,
+    scheduler: PoliteScheduler | None = None,
+    retry: RetryPolicy | None = None,
+    breaker: CircuitBreaker | None = None,
+) -> ScrapeReport:
+    """
+    Call all scrapers concurrently and collect the outcome in a ScrapeReport.
+
+    A scraper is any callable with a url attribute that returns a (url, price) tuple,
+    like CoffeeScraper and ChromiumCoffeeScraper.
+
+    The scrapers are handed to the worker threads by a PoliteScheduler. A scraper is only
+    submitted when a worker is free and the rate and concurrency limits of its host allow it
+    to start, so workers never wait for a rate limit and sites on other hosts never wait
+    behind a host that is being throttled.
+
+    A site that does not produce a result within timeout seconds after it started
+    is reported as an error with a TimeoutError. Its worker thread is abandoned,
+    so a hanging site does not delay the rest of the run. The workers are daemon threads,
+    so an abandoned thread does not keep the process alive either, it is killed at exit. The thread keeps its connection
+    to the host until it finishes, so the concurrency limit of the host still holds. Sites that
+    cannot start because abandoned threads do not finish within another timeout are reported
+    as an error with a TimeoutError as well.
+
+    A failed attempt that the retry policy allows to be retried, including an attempt that
+    missed its deadline, is put back into the scheduler, to start after the backoff delay. Every attempt gets its own deadline.
+    Sites with an open circuit are not called at all and reported as an error with a CircuitOpenError.
+
+    Args:
+        sites (Iterable): The scrapers to call.
+        max_workers (int): The maximum number of scrapers that run at the same time.
+        timeout (float): The deadline in seconds for each attempt of an individual site.
+        scheduler (PoliteScheduler | None): The scheduler with the limits per host, by default one without limits.
+        retry (RetryPolicy | None): The policy for retrying failed attempts, None to never retry.
+        breaker (CircuitBreaker | None): The circuit breaker that skips failing sites and records the outcome of this run.
+
+    Returns:
+        ScrapeReport: The results and failures of all sites.
+    """
+
+    sites = list(sites)
+    report = ScrapeReport()
+    results = {}
+    started = {}
+    attempts = {}
+    scheduler = scheduler if scheduler is not None else PoliteScheduler()
+    for index, site in enumerate(sites):
+        if _skip(site.url, breaker, report):
+            continue
+        attempts[index] = 0
+        scheduler.add(site.url, index)
+
+    def run(index, site):
+        started[index] = monotonic()
+        return site()
+
+    def failed(index, e):
+        url = sites[index].url
+        if retry is not None and retry.retry(e, attempts[index]):
+            delay = retry.delay(attempts[index])
+            logging.info(f"retrying {url} in {delay:.1f}s after attempt {attempts[index]} failed {e}")
+            started.pop(index, None)
+            scheduler.add(url, index, not_before=monotonic() + delay)
+        else:
+            report.add_failure(url, e)
+
+    futures = {}
+    pending = set()
+    # abandoned threads of sites that missed their deadline still occupy a worker and a connection to their host
+    abandoned = set()
+    while pending or len(scheduler):
+        wait_scheduler = float("inf")
+        while len(pending) + len(abandoned) < max_workers and len(scheduler):
+            index, wait_scheduler = scheduler.next()
+            if index is None:
+                break
+            attempts[index] += 1
+            future = _start(run, index, sites[index])
+            futures[future] = index
+            pending.add(future)
+
+        # a job that starts after this point has a deadline of at least now + timeout
+        # so we never sleep past a deadline, even for jobs that are still queued
+        now = monotonic()
+        deadlines = [started[futures[f]] + timeout for f in pending if futures[f] in started]
+        remaining = max(0.0, min(deadlines, default=now + timeout) - now)
+        if pending or abandoned:
+            done, _ = wait(pending | abandoned, timeout=min(remaining, wait_scheduler), return_when=FIRST_COMPLETED)
+        else:
+            # wait() returns at once for an empty set, so sleep until the scheduler has a job ready
+            sleep(min(remaining, wait_scheduler))
+            done = set()
+
+        finished = done & abandoned
+        for future in finished:
+            # only now the request to the host is really over
+            abandoned.discard(future)
+            scheduler.done(sites[futures[future]].url)
+
+        for future in done - finished:
+            pending.discard(future)
+            index = futures[future]
+            url = sites[index].url
+            scheduler.done(url)
+            report.durations[url] = monotonic() - started.get(index, now)
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                failed(index, e)
+
+        if not done and not pending and abandoned and wait_scheduler == float("inf"):
+            # the queued sites can only start when an abandoned thread finishes, and none did within timeout
+            for index in scheduler.clear():
+                url = sites[index].url
+                report.add_failure(url, TimeoutError(f"{url} not started, earlier requests still hanging after {timeout}s"))
+
+        now = monotonic()
+        for future in list(pending):
+            index = futures[future]
+            if index in started and now - started[index] >= timeout:
+                pending.discard(future)
+                abandoned.add(future)
+                failed(index, TimeoutError(f"no result from {sites[index].url} within {timeout}s"))
+
+    report.results = [results[index] for index in sorted(results)]
+    _record_outcome(report, sites, breaker)
+    _log_summary(report, len(sites))
+    return report
+
+
+async def scrape_all_async(
+    sites,
+    limit: int = 100,
+    limit_per_host: int = 4,
+    timeout: float = 60.0,
+    retry: RetryPolicy | None = None,
+    breaker: CircuitBreaker | None = None,
+) -> ScrapeReport:
+    """
+    Await all asynchronous scrapers on a shared session and collect the outcome in a ScrapeReport.
+
+    An asynchronous scraper is any callable with a url attribute that takes an aiohttp session
+    and returns a coroutine producing a (url, price) tuple, like AsyncCoffeeScraper.
+    All scrapers share one connection pool, so no thread per request is needed.
+
+    Args:
+        sites (Iterable): The asynchronous scrapers to await.
+        limit (int): The maximum number of simultaneous connections in total.
+        limit_per_host (int): The maximum number of simultaneous connections to a single host.
+        timeout (float): The deadline in seconds for each attempt of an individual site, including the time spent waiting for a free connection.
+        retry (RetryPolicy | None): The policy for retrying failed attempts, None to never retry.
+        breaker (CircuitBreaker | None): The circuit breaker that skips failing sites and records the outcome of this run.
+
+    Returns:
+        ScrapeReport: The results and failures of all sites.
+    """
+
+    sites = list(sites)
+    report = ScrapeReport()
+    allowed = [site for site in sites if not _skip(site.url, breaker, report)]
+
+    async with create_session(limit=limit, limit_per_host=limit_per_host) as session:
+
+        async def attempt(site):
+            start = monotonic()
+            try:
+                return await asyncio.wait_for(site(session), timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"no result from {site.url} within {timeout}s")
+            finally:
+                report.durations[site.url] = monotonic() - start
+
+        async def run(site):
+            n = 1
+            while True:
+                try:
+                    return await attempt(site)
+                except Exception as e:
+                    if retry is None or not retry.retry(e, n):
+                        raise
+                    delay = retry.delay(n)
+                    logging.info(f"retrying {site.url} in {delay:.1f}s after attempt {n} failed {e}")
+                    await asyncio.sleep(delay)
+                    n += 1
+
+        outcomes = await asyncio.gather(*(run(site) for site in allowed), return_exceptions=True)
+
+    for site, outcome in zip(allowed, outcomes):
+        if isinstance(outcome, Exception):
+            report.add_failure(site.url, outcome)
+        else:
+            report.results.append(outcome)
+    _record_outcome(report, sites, breaker)
+    _log_summary(report, len(sites))
+    return report
+
+
+_threads = count(1)
+
+
+def _start(function, *args) -> Future:
+    # a ThreadPoolExecutor joins its threads at interpreter exit, so a scraper that hangs
+    # forever would keep the process from exiting. A daemon thread per attempt does not,
+    # the dispatch loop of scrape_all limits how many run at the same time.
+    future = Future()
+
+    def target():
+        try:
+            result = function(*args)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    threading.Thread(target=target, name=f"scraper_{next(_threads)}", daemon=True).start()
+    return future
+
+
+def _skip(url: str, breaker: CircuitBreaker | None, report: ScrapeReport) -> bool:
+    if breaker is None or breaker.allow(url):
+        return False
+    report.add_failure(url, CircuitOpenError(f"{url} skipped, circuit open after {breaker.failures(url)} failed runs"))
+    return True
+
+
+def _record_outcome(report: ScrapeReport, sites, breaker: CircuitBreaker | None) -> None:
+    if breaker is None:
+        return
+    for site in sites:
+        error = report.errors.get(site.url)
+        if error is None:
+            # a page without a price is a problem with the pattern, not with the shop
+            breaker.success(site.url)
+        elif not isinstance(error, CircuitOpenError):
+            breaker.failure(site.url)
+
+
+def _log_summary(report: ScrapeReport, nsites: int) -> None:
+    logging.info(
+        f"{len(report.results)} prices retrieved from {nsites} sites ({len(report.not_found)} not found, {len(report.errors)} errors)"
+    )
@@ -0,0 +1,144 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Module for exporting the price history to Parquet files.
+
+The prices are written to a directory with a subdirectory per month, in the hive
+partitioning layout that pandas, pyarrow and DuckDB understand:
+
+    prices/month=2023-08/part-000000000001.parquet
+    prices/month=2023-09/part-000000000001.parquet
+    prices/month=2023-09/part-000000004711.parquet
+
+Rows without a timestamp, which old databases may hold, go to a month=unknown partition.
+
+The id of the last exported row is kept in a watermark file in the same directory.
+Every run only reads the rows added since the previous run from the database and
+writes them to new part files, existing files are never rewritten.
+
+Functions:
+    read_watermark(directory) -> int | None:
+        Return the id of the last exported row, or None if nothing was exported yet.
+    write_watermark(directory, id) -> None:
+        Atomically replace the watermark file.
+    export_parquet(db, directory, batch_size=10000) -> int:
+        Append the rows added since the previous export to a partitioned Parquet dataset.
+"""
+
+import json
+import logging
+import os
+import pathlib
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .database import BasePriceDatabase
+from .utils import dump_json
+
+schema = pa.schema([
+    ("id", pa.int64()),
+    ("url", pa.string()),
+    ("price", pa.float64()),
+    ("timestamp", pa.timestamp("us")),
+])
+
+WATERMARK = "_watermark.json"
+
+
+def read_watermark(directory:pathlib.Path) -> int|None:
+    """
+    Return the id of the last exported row, or None if nothing was exported yet.
+
+    Args:
+        directory (pathlib.Path): The directory of the dataset.
+
+    Returns:
+        int | None: The id of the last exported row.
+    """
+    try:
+        with open(directory / WATERMARK) as f:
+            return json.load(f)["id"]
+    except FileNotFoundError:
+        return None
+
+
+def write_watermark(directory:pathlib.Path, id:int) -> None:
+    """
+    Atomically replace the watermark file.
+
+    Args:
+        directory (pathlib.Path): The directory of the dataset.
+        id (int): The id of the last exported row.
+    """
+    dump_json(directory / WATERMARK, {"id": id})
+
+
+def export_parquet(db:BasePriceDatabase, directory:str, batch_size:int=10000) -> int:
+    """
+    Append the rows added since the previous export to a partitioned Parquet dataset.
+
+    The rows are streamed from the database and written in batches of batch_size rows,
+    so memory use does not depend on the size of the history. The part files are written
+    under a hidden temporary name and only renamed, and the watermark only moved, once all rows
+    have been written, so an interrupted export is simply redone by the next run.
+
+    Args:
+        db (BasePriceDatabase): The price database.
+        directory (str): The directory of the dataset. It is created if it does not exist.
+        batch_size (int): The number of rows buffered per month before they are written.
+
+    Returns:
+        int: The number of rows exported.
+    """
+    directory = pathlib.Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    watermark = read_watermark(directory)
+    part = f"part-{(watermark or 0) + 1:012d}.parquet"
+
+    writers = {}
+    batches = {}
+    last_id = watermark
+    count = 0
+    unknown = 0
+
+    def flush(month):
+        rows, batches[month] = batches[month], []
+        if rows:
+            columns = zip(*rows)
+            arrays = [pa.array(column, type=field.type) for column, field in zip(columns, schema)]
+            writers[month].write_table(pa.Table.from_arrays(arrays, schema=schema))
+
+    try:
+        for row in db.get_prices(itersize=batch_size, after_id=watermark):
+            if row[3] is None:
+                month = "unknown"
+                unknown += 1
+            else:
+                month = row[3].strftime("%Y-%m")
+            if month not in writers:
+                partition = directory / f"month={month}"
+                partition.mkdir(exist_ok=True)
+                writers[month] = pq.ParquetWriter(partition / f".{part}", schema)
+                batches[month] = []
+            batches[month].append(row)
+            if len(batches[month]) >= batch_size:
+                flush(month)
+            last_id = row[0]
+            count += 1
+        for month in batches:
+            flush(month)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    for month in writers:
+        partition = directory / f"month={month}"
+        os.replace(partition / f".{part}", partition / part)
+    if last_id is not None and last_id != watermark:
+        write_watermark(directory, last_id)
+
+    if unknown:
+        logging.warning(f"{unknown} rows without a timestamp exported to {directory / 'month=unknown'}")
+    logging.info(f"{count} rows exported to {directory} in {len(writers)} partitions")
+    return count
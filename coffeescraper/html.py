@@ -1,130 +1,156 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import logging
-from datetime import datetime
-from jinja2 import Template
-import json
+import os
+from functools import lru_cache
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+import numpy as np
+import orjson
 
+from .database import DEFAULT_PRODUCT
+from .utils import write_atomic
 
-class DateTimeEncoder(json.JSONEncoder):
-    def default(self, z):
-        if isinstance(z, datetime):
-            return z.isoformat()
-        else:
-            return super().default(z)
+templates = os.path.join(os.path.dirname(__file__), "templates")
 
 
-def generate_graph_html(data_tuples, cheapest_site="unkown", lowest_price_today="unknown", filename="/tmp/graph.html"):
+@lru_cache(maxsize=None)
+def environment():
+    """
+    Return the Jinja2 environment for the html templates.
+
+    The environment is created once per process. It keeps the compiled templates in memory,
+    and in a bytecode cache on disk, so later processes do not compile them again. The cache is
+    the default directory of Jinja2, private to the user.
+
+    Returns:
+        Environment: The Jinja2 environment.
+    """
+    return Environment(
+        loader=FileSystemLoader(templates),
+        bytecode_cache=FileSystemBytecodeCache(),
+        auto_reload=False,
+    )
+
+
+def dumps(data):
+    """
+    Serialize data to JSON, datetimes are serialized natively in ISO 8601 format.
+
+    Args:
+        data: The data to serialize.
+
+    Returns:
+        str: The JSON string.
+    """
+    return orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+
+def lttb(x, y, threshold):
+    """
+    Select the points of a series to keep with the largest triangle three buckets algorithm.
+
+    The first and last point are always kept. The points in between are divided into
+    threshold - 2 buckets, and from each bucket the point is kept that forms the largest
+    triangle with the point kept from the previous bucket and the average of the next bucket.
+    This preserves the peaks and dips that a plain average would smooth away.
+
+    Args:
+        x (np.ndarray): The x values, in ascending order.
+        y (np.ndarray): The y values.
+        threshold (int): The maximum number of points to keep.
+
+    Returns:
+        np.ndarray: The indices of the points to keep, in ascending order.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    # the average of every bucket, the last point acts as the bucket after the last bucket
+    starts = np.append(edges[:-1], n - 1)
+    counts = np.diff(np.append(starts, n))
+    avg_x = np.add.reduceat(x, starts) / counts
+    avg_y = np.add.reduceat(y, starts) / counts
+
+    selected = np.empty(threshold, dtype=int)
+    selected[0] = a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        area = np.abs((x[a] - avg_x[i + 1]) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y[i + 1] - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    selected[-1] = n - 1
+    return selected
+
+
+def generate_graph_html(data_tuples, cheapest_site="unkown", lowest_price_today="unknown", filename="/tmp/graph.html", max_points=500, product=DEFAULT_PRODUCT, index=None, data_file=None):
     # Organize data by key for the graph
+    series = {}
+    for _, key, value, timestamp in data_tuples:
+        series.setdefault(key, []).append((timestamp, value))
+
+    # keep the page small, a series never has more than max_points points
     data_by_key = {}
     labels = set()
     colors = ["#ff0000", "#00ff00", "#0000ff", "#aaaa00", "#00aaaa", "#aa00aa"]
-    color_index = 0
-    for _, key, value, timestamp in data_tuples:
-        if key not in data_by_key:
-            data_by_key[key] = {
-                "values": [],
-                "color": colors[color_index],
-            }
-            color_index = (color_index + 1) % len(colors)
-        data_by_key[key]["values"].append({"x": timestamp, "y": value})
-        labels.add(timestamp)
+    for color_index, (key, points) in enumerate(series.items()):
+        points.sort(key=lambda point: point[0])
+        x = np.fromiter((timestamp.timestamp() for timestamp, _ in points), dtype=float, count=len(points))
+        y = np.fromiter((value for _, value in points), dtype=float, count=len(points))
+        values = [{"x": points[i][0], "y": points[i][1]} for i in lttb(x, y, max_points)]
+        data_by_key[key] = {
+            "values": values,
+            "color": colors[color_index % len(colors)],
+        }
+        labels.update(value["x"] for value in values)
     labels = sorted(labels)
 
     if type(lowest_price_today) == float:
         lowest_price_today = f"{lowest_price_today:.2f}"
-        
-    # Create a Jinja2 template
-    template_str = """
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Graph Example</title>
-    <script src="https://cdn.jsdelivr.net/npm/jquery@3.6.0/dist/jquery.min.js"
-        integrity="sha256-/xUj+3OJU5yExlq6GSYGSHk7tPXikynS7ogEvDej/m4=" crossorigin="anonymous"></script>
-    <script src="https://cdn.jsdelivr.net/npm/chart.js@3.9.1/dist/chart.min.js"
-        integrity="sha256-+8RZJua0aEWg+QVVKg4LEzEEm/8RFez5Tb4JBNiV5xA=" crossorigin="anonymous"></script>
-    <script src="https://cdn.jsdelivr.net/npm/chartjs-adapter-date-fns@2.0.0/dist/chartjs-adapter-date-fns.bundle.min.js"
-        integrity="sha256-xlxh4PaMDyZ72hWQ7f/37oYI0E2PrBbtzi1yhvnG+/E=" crossorigin="anonymous"></script>
-    <meta charset="UTF-8">
-    </head>
-    <body>
-        <style>
-        .site {
-            background-color: #eeeeee;
-            width: 40em;
-            list-style: none;
-            margin-top: 3px;
-        }
-        .lowest {
-            font-weight: bold;
+
+    # with a data file the page only holds the code that fetches and draws the data,
+    # so the page stays the same from day to day and only the compact data file changes
+    data_url = None
+    if data_file is not None:
+        chart = {
+            "labels": labels,
+            "series": [
+                {"site": key, "color": data["color"], "points": [(value["x"], value["y"]) for value in data["values"]]}
+                for key, data in data_by_key.items()
+            ],
+            "cheapest_site": cheapest_site,
+            "lowest_price_today": lowest_price_today,
         }
-        </style>
-        <h2>Prijzen Dolce Gusto Lungo XL (30 cups)</h2>
-        <p>We houden op dit moment de volgende sites in de gaten:</p>
-        <ul>
-        {% for key in data_by_key.keys() %}
-        <li class="site"><a href="{{key}}">{{key}}</a></li>
-        {% endfor %}
-        </ul><br>
-        <p>De laagste prijs op dit moment is <span class="lowest">{{lowest_price_today}} €</span> bij <a href="{{cheapest_site}}">{{cheapest_site}}</a></p>
-        <canvas id="myChart"></canvas>
-        <script>
-            $(document).ready(function() {
-                var ctx = document.getElementById('myChart').getContext('2d');
-                var datasets = [];
-                {% for key, data in data_by_key.items() %}
-                    datasets.push({
-                        label: '{{ key }}',
-                        data: {{ json(data['values']) }},
-                        borderColor: '{{ data.color }}',
-                        backgroundColor: 'rgba(0, 0, 0, 0)',  // Transparent background
-                        borderWidth: 2
-                    });
-                {% endfor %}
-                var myChart = new Chart(ctx, {
-                    type: 'line',
-                    data: {
-                        labels: {{ json(labels) }},
-                        datasets: datasets
-                    },
-                    options: {
-                    scales: {
-                        x: {
-                            type: 'time',
-                            time: {
-                                unit: 'day'
-                            }
-                        },
-                        y: {
-                            beginAtZero: true,
-                            title: {
-                                text: 'prijs in €',
-                                display: true
-                            },
-                            ticks: {
-                                callback: (val) => {
-                                    return val.toFixed(2);
-                                }
-                            }
-                        }
-                    }
-                    }
-                });
-            });
-        </script>
-    </body>
-    </html>
-    """
-    template = Template(template_str)
-    html_content = template.render(
+        # the page may be uploaded or served while it is rendered again, it must never see half a data file
+        write_atomic(data_file, orjson.dumps(chart, option=orjson.OPT_SERIALIZE_NUMPY))
+        data_url = os.path.basename(str(data_file))
+        data_by_key, labels = {}, []
+        logging.info(f"chart data file generated ({data_file})")
+
+    template = environment().get_template("graph.html")
+    template.stream(
         data_by_key=data_by_key,
         labels=labels,
         cheapest_site=cheapest_site,
         lowest_price_today=lowest_price_today,
-        json=lambda x: json.dumps(x, cls=DateTimeEncoder),
-    )
-    with open(filename, "w") as f:
-        f.write(html_content)
-        logging.info(f"html file generated ({filename})")
+        product=product,
+        index=index,
+        data_url=data_url,
+        json=dumps,
+    ).dump(str(filename), encoding="utf-8")
+    logging.info(f"html file generated ({filename})")
+
+
+def generate_index_html(pages, filename="/tmp/index.html"):
+    """
+    Write an index page that links to the page of every product.
+
+    Args:
+        pages (Iterable[tuple[str, str, str, float | str]]): Tuples of product, link to the product page,
+            cheapest site and lowest price today. The price is left out if it is not a number.
+        filename (str): The name of the html file.
+    """
+    environment().get_template("index.html").stream(pages=pages).dump(str(filename), encoding="utf-8")
+    logging.info(f"html index generated ({filename})")
 
@@ -0,0 +1,216 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Module for measuring where a run spends its time.
+
+The scrapers, the browser pool and the main program record their measurements in the
+shared Metrics instance `metrics`. At the end of a run the measurements are written
+as a Prometheus text format file, to be picked up by the textfile collector of the
+node exporter, and as a JSON summary of the run.
+
+Every measurement has a name and optionally labels, like the url of a site:
+
+    with metrics.timer("fetch_seconds", url=url):
+        ...
+    metrics.observe("downloaded_bytes", len(content), url=url)
+    metrics.set("prices", len(results))
+
+Observations are accumulated into a count, a sum and a maximum per name and labels,
+and exported as a Prometheus summary. Values that are set are exported as a gauge.
+
+Classes:
+    Metrics:
+        A thread safe collection of the measurements of a run.
+
+Functions:
+    downloaded(response) -> int | None:
+        Return the number of bytes received for a requests response.
+"""
+
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from time import perf_counter, time
+
+from .utils import write_atomic
+
+descriptions = {
+    "fetch_seconds": "Time spent downloading a page, per site.",
+    "downloaded_bytes": "Bytes received for a page, per site.",
+    "parse_seconds": "Time spent extracting the price from a page, per site.",
+    "site_seconds": "Wall clock time spent on a site including waiting for a browser, per site.",
+    "browser_start_seconds": "Time spent starting a Chromium browser.",
+    "db_seconds": "Time spent in database calls, per operation.",
+    "stage_seconds": "Time spent in a stage of the run.",
+    "sites": "Number of sites, per outcome of the last run.",
+    "run_seconds": "Duration of the last run.",
+    "last_run_timestamp_seconds": "Time the last run finished, in seconds since the epoch.",
+}
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+class Metrics:
+    """
+    A thread safe collection of the measurements of a run.
+
+    Args:
+        prefix (str): The prefix of the metric names in the Prometheus export.
+
+    Methods:
+        observe(self, name, value, **labels) -> None:
+            Add an observation, for example a duration or a size.
+        set(self, name, value, **labels) -> None:
+            Set the value of a gauge.
+        timer(self, name, **labels):
+            Context manager that observes the number of seconds spent inside it.
+        prometheus(self) -> str:
+            Return the measurements in the Prometheus text format.
+        summary(self) -> dict:
+            Return the measurements as a dict that can be serialized to JSON.
+        write_prometheus(self, filename) -> None:
+            Atomically write the measurements in the Prometheus text format.
+        write_json(self, filename) -> None:
+            Atomically write the JSON summary of the run.
+    """
+
+    def __init__(self, prefix: str = "coffeescraper") -> None:
+        self.prefix = prefix
+        self.started = time()
+        self._lock = threading.Lock()
+        self._observations = {}
+        self._gauges = {}
+
+    def observe(self, name: str, value: float | None, **labels) -> None:
+        if value is None:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            entry = self._observations.get(key)
+            if entry is None:
+                self._observations[key] = [1, value, value]
+            else:
+                entry[0] += 1
+                entry[1] += value
+                entry[2] = max(entry[2], value)
+
+    def set(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """
+        Observe the number of seconds spent inside the context, also if it is left by an exception.
+
+        Args:
+            name (str): The name of the measurement.
+            **labels: The labels of the measurement.
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - start, **labels)
+
+    def prometheus(self) -> str:
+        """
+        Return the measurements in the Prometheus text format.
+
+        Observations become a summary with a _sum and a _count series, gauges a single series.
+
+        Returns:
+            str: The exposition text, ending in a newline.
+        """
+        with self._lock:
+            observations = sorted(self._observations.items())
+            gauges = sorted(self._gauges.items())
+
+        lines = []
+        typed = set()
+
+        def header(name, kind):
+            if name not in typed:
+                typed.add(name)
+                full = f"{self.prefix}_{name}"
+                lines.append(f"# HELP {full} {descriptions.get(name, name.replace('_', ' '))}")
+                lines.append(f"# TYPE {full} {kind}")
+
+        for (name, labels), (count, total, _) in observations:
+            header(name, "summary")
+            lines.append(f"{self.prefix}_{name}_sum{_labels(labels)} {total!r}")
+            lines.append(f"{self.prefix}_{name}_count{_labels(labels)} {count}")
+        for (name, labels), value in gauges:
+            header(name, "gauge")
+            lines.append(f"{self.prefix}_{name}{_labels(labels)} {value!r}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> dict:
+        """
+        Return the measurements as a dict that can be serialized to JSON.
+
+        Returns:
+            dict: The start time of the run, and per name a list of the labels with the count, sum, maximum and mean of the observations or the value of the gauge.
+        """
+        with self._lock:
+            observations = sorted(self._observations.items())
+            gauges = sorted(self._gauges.items())
+        summary = {"started": self.started, "metrics": {}}
+        for (name, labels), (count, total, maximum) in observations:
+            summary["metrics"].setdefault(name, []).append(
+                {"labels": dict(labels), "count": count, "sum": total, "max": maximum, "mean": total / count}
+            )
+        for (name, labels), value in gauges:
+            summary["metrics"].setdefault(name, []).append({"labels": dict(labels), "value": value})
+        return summary
+
+    def write_prometheus(self, filename: str) -> None:
+        """
+        Atomically write the measurements in the Prometheus text format.
+
+        The node exporter may read the file at any moment, so it is written under a temporary name first.
+
+        Args:
+            filename (str): The name of the file, it should end in .prom for the textfile collector.
+        """
+        write_atomic(filename, self.prometheus())
+        logging.info(f"metrics written to {filename}")
+
+    def write_json(self, filename: str) -> None:
+        """
+        Atomically write the JSON summary of the run.
+
+        Args:
+            filename (str): The name of the file.
+        """
+        write_atomic(filename, json.dumps(self.summary(), indent=1))
+        logging.info(f"run summary written to {filename}")
+
+
+def downloaded(response) -> int | None:
+    """
+    Return the number of bytes received for a requests response.
+
+    This counts the bytes read from the connection, before decompression, and for a
+    streamed response only the part of the body that was actually read.
+
+    Args:
+        response (requests.Response): The response.
+
+    Returns:
+        int | None: The number of bytes, or None if it is not known.
+    """
+    n = getattr(getattr(response, "raw", None), "tell", lambda: None)()
+    return n if isinstance(n, int) else None
+
+
+metrics = Metrics()
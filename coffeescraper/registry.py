@@ -0,0 +1,313 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Module for loading the site definitions from a TOML file.
+
+Every site is a [[site]] table with the url of the page, the method used to extract
+the price and how to convert the extracted text to a number:
+
+    [defaults]
+    product = "Dolce Gusto Lungo XL (30 cups)"
+
+    [[site]]
+    url = "https://www.example.org/lungo-xl"
+    method = "regex"
+    pattern = '<meta property="product:price:amount" content="(?P<price>\\d+,\\d+)"/>'
+    stream = true
+    format = { locale = "nl_NL" }
+
+    [[site]]
+    url = "https://www.example.com/lungo-xl"
+    method = "css"
+    selector = ".current-price"
+    format = { strip = '\\s', divisor = 100 }
+
+Values in the [defaults] table apply to every site that does not set them itself.
+
+The methods are:
+
+    regex:  download the page and search it with the regular expression in pattern,
+            which should have a group named price.
+    css:    load the page in a browser and read the text of the element matching selector.
+    jsonld: download the page and read the price from its schema.org JSON-LD data or
+            its price meta tags, no pattern or selector is needed.
+
+With structured = true a regex or css site tries the JSON-LD data and meta tags first
+and only falls back to its pattern or selector if they hold no price. For a css site
+this avoids starting a browser whenever the page has structured data.
+
+With stream = true a regex or jsonld site stops downloading as soon as the price is found.
+A site that sets a pattern, selector or stream that its method does not use is invalid.
+
+A format table can have a locale (nl_NL, de_DE, fr_FR, en_US or en_GB) and can set
+the decimal separator, the thousands separator, a regular expression matching the text
+to strip before conversion, and a divisor, for example 100 for prices in cents.
+
+All definitions are validated when they are loaded. The file can also be checked with:
+
+    python -m coffeescraper.registry sites.toml
+
+Classes:
+    SiteConfigError:
+        Raised when a site definition is not valid.
+    NumberFormat:
+        Converts the text of a price to a float.
+
+Functions:
+    compile_pattern(pattern) -> re.Pattern:
+        Compile a regular expression once and return the cached result afterwards.
+    validate(config) -> list[str]:
+        Check the site definitions and return a description of every problem found.
+    load_sites(filename, cache=None) -> tuple[CoffeeScraper, ...]:
+        Load, validate and create the scrapers defined in a TOML file.
+"""
+
+import logging
+import re
+import sys
+import tomllib
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+from selenium.webdriver.common.by import By
+
+from .cache import HttpCache
+from .database import DEFAULT_PRODUCT
+from .scraper import CoffeeScraper, ChromiumCoffeeScraper, PricePattern
+
+
+class SiteConfigError(Exception):
+    pass
+
+
+# decimal and thousands separators
+locales = {
+    "nl_NL": (",", "."),
+    "de_DE": (",", "."),
+    "fr_FR": (",", " "),
+    "en_US": (".", ","),
+    "en_GB": (".", ","),
+}
+
+methods = {
+    "regex": {"pattern"},
+    "css": {"selector"},
+    "jsonld": set(),
+}
+
+site_keys = {"url", "method", "pattern", "selector", "stream", "structured", "product", "format"}
+# keys that only have an effect for some methods
+method_keys = {
+    "pattern": {"regex"},
+    "selector": {"css"},
+    "stream": {"regex", "jsonld"},
+}
+format_keys = {"locale", "decimal", "thousands", "strip", "divisor"}
+
+
+@lru_cache(maxsize=None)
+def compile_pattern(pattern: str) -> re.Pattern:
+    """
+    Compile a regular expression once and return the cached result afterwards.
+
+    Many sites run the same shop software and share a pattern, they all share one compiled pattern.
+
+    Args:
+        pattern (str): The regular expression.
+
+    Returns:
+        re.Pattern: The compiled regular expression.
+    """
+    return re.compile(pattern)
+
+
+class NumberFormat:
+    """
+    Converts the text of a price to a float.
+
+    Args:
+        locale (str | None): The locale that determines the default separators, or None for a decimal point and no thousands separator.
+        decimal (str | None): The decimal separator, overrides the one of the locale.
+        thousands (str | None): The thousands separator, overrides the one of the locale.
+        strip (str | None): A regular expression matching text that is removed before conversion, like currency symbols or markup.
+        divisor (float): The converted number is divided by this, for example 100 for prices in cents.
+
+    Methods:
+        __call__(self, text: str) -> float:
+            Convert text to a float. Raises ValueError if that is not possible.
+    """
+
+    def __init__(
+        self,
+        locale: str | None = None,
+        decimal: str | None = None,
+        thousands: str | None = None,
+        strip: str | None = None,
+        divisor: float = 1,
+    ) -> None:
+        default_decimal, default_thousands = locales[locale] if locale is not None else (".", None)
+        self.decimal = decimal if decimal is not None else default_decimal
+        self.thousands = thousands if thousands is not None else default_thousands
+        self.strip = compile_pattern(strip) if strip is not None else None
+        self.divisor = divisor
+
+    def __call__(self, text: str) -> float:
+        if self.strip is not None:
+            text = self.strip.sub("", text)
+        text = text.strip()
+        if self.thousands:
+            text = text.replace(self.thousands, "")
+        if self.decimal != ".":
+            text = text.replace(self.decimal, ".")
+        return float(text) / self.divisor
+
+
+def validate(config: dict) -> list[str]:
+    """
+    Check the site definitions and return a description of every problem found.
+
+    Args:
+        config (dict): The parsed TOML file.
+
+    Returns:
+        list[str]: The problems found, an empty list if all definitions are valid.
+    """
+    problems = []
+    defaults = config.get("defaults", {})
+    if not isinstance(defaults, dict):
+        return ["defaults should be a table"]
+    sites = config.get("site", [])
+    if not isinstance(sites, list) or not sites:
+        return ["no [[site]] tables found"]
+
+    urls = set()
+    for n, own in enumerate(sites, start=1):
+        site = {**defaults, **own}
+        url = site.get("url")
+        name = f"site {n} ({url})" if url else f"site {n}"
+
+        for key in sorted(site.keys() - site_keys):
+            problems.append(f"{name}: unknown key {key}")
+        if not isinstance(url, str) or urlsplit(url).scheme not in ("http", "https") or not urlsplit(url).netloc:
+            problems.append(f"{name}: url should be an http or https url")
+        elif url in urls:
+            problems.append(f"{name}: duplicate url")
+        else:
+            urls.add(url)
+
+        method = site.get("method")
+        if method not in methods:
+            problems.append(f"{name}: method should be one of {', '.join(methods)}")
+        else:
+            for key in sorted(methods[method]):
+                if not isinstance(site.get(key), str) or not site[key]:
+                    problems.append(f"{name}: method {method} needs a {key}")
+            # a default may be meant for other methods, a key in the site itself is a mistake
+            for key in sorted(own.keys() & method_keys.keys()):
+                if method not in method_keys[key]:
+                    problems.append(f"{name}: {key} only applies to {' and '.join(sorted(method_keys[key]))} sites")
+        if method == "regex" and isinstance(site.get("pattern"), str):
+            try:
+                if "price" not in compile_pattern(site["pattern"]).groupindex:
+                    problems.append(f"{name}: pattern has no group named price")
+            except re.error as e:
+                problems.append(f"{name}: pattern is not a valid regular expression: {e}")
+
+        for key in ("stream", "structured"):
+            if key in site and not isinstance(site[key], bool):
+                problems.append(f"{name}: {key} should be true or false")
+        if "product" in site and (not isinstance(site["product"], str) or not site["product"]):
+            problems.append(f"{name}: product should be a non empty string")
+
+        number_format = site.get("format", {})
+        if not isinstance(number_format, dict):
+            problems.append(f"{name}: format should be a table")
+            continue
+        for key in sorted(number_format.keys() - format_keys):
+            problems.append(f"{name}: unknown format key {key}")
+        if "locale" in number_format and number_format["locale"] not in locales:
+            problems.append(f"{name}: locale should be one of {', '.join(locales)}")
+        for key in ("decimal", "thousands"):
+            if key in number_format and not isinstance(number_format[key], str):
+                problems.append(f"{name}: {key} should be a string")
+        if "strip" in number_format:
+            try:
+                compile_pattern(number_format["strip"])
+            except (re.error, TypeError) as e:
+                problems.append(f"{name}: strip is not a valid regular expression: {e}")
+        divisor = number_format.get("divisor", 1)
+        if isinstance(divisor, bool) or not isinstance(divisor, (int, float)) or divisor <= 0:
+            problems.append(f"{name}: divisor should be a positive number")
+
+    return problems
+
+
+def load_sites(filename: str, cache: HttpCache | None = None) -> tuple[CoffeeScraper, ...]:
+    """
+    Load, validate and create the scrapers defined in a TOML file.
+
+    Args:
+        filename (str): The path of the TOML file.
+        cache (HttpCache | None): The cache for the scrapers that download pages themselves.
+
+    Returns:
+        tuple[CoffeeScraper, ...]: The scrapers, in the order of the file.
+
+    Raises:
+        SiteConfigError: If the file cannot be parsed or contains invalid definitions.
+    """
+    try:
+        with open(filename, "rb") as f:
+            config = tomllib.load(f)
+    except (OSError, tomllib.TOMLDecodeError) as e:
+        raise SiteConfigError(f"cannot read {filename}: {e}")
+
+    problems = validate(config)
+    if problems:
+        raise SiteConfigError(f"invalid site definitions in {filename}:\n" + "\n".join(problems))
+
+    defaults = config.get("defaults", {})
+    sites = []
+    for site in config["site"]:
+        site = {**defaults, **site}
+        number_format = NumberFormat(**site.get("format", {}))
+        product = site.get("product", DEFAULT_PRODUCT)
+        if site["method"] == "regex":
+            sites.append(CoffeeScraper(
+                url=site["url"],
+                pricepattern=compile_pattern(site["pattern"]),
+                format=number_format,
+                cache=cache,
+                stream=site.get("stream", False),
+                product=product,
+                structured=site.get("structured", False),
+            ))
+        elif site["method"] == "jsonld":
+            sites.append(CoffeeScraper(
+                url=site["url"],
+                pricepattern=None,
+                format=number_format,
+                cache=cache,
+                stream=site.get("stream", True),
+                product=product,
+                structured=True,
+            ))
+        else:
+            sites.append(ChromiumCoffeeScraper(
+                url=site["url"],
+                pricepattern=PricePattern(by=By.CSS_SELECTOR, value=site["selector"]),
+                format=number_format,
+                product=product,
+                structured=site.get("structured", False),
+            ))
+    logging.info(f"{len(sites)} sites loaded from {filename}")
+    return tuple(sites)
+
+
+if __name__ == "__main__":
+    try:
+        sites = load_sites(sys.argv[1] if len(sys.argv) > 1 else "sites.toml")
+    except SiteConfigError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    print(f"{len(sites)} valid site definitions")
@@ -0,0 +1,293 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Module for keeping the state of the reports between runs.
+
+Building the reports from the full price history makes every run slower than the one
+before. A ReportState remembers the id of the last row that went into the reports,
+together with the daily aggregates per site computed from all rows up to that id.
+A run only reads the rows added since then from the database and folds them into
+the aggregates, so the work done per run is proportional to the new rows only.
+
+The state records which database it belongs to. It is rebuilt from scratch when it is
+used with another database, or with a database whose ids stop below the watermark, like
+a database that was reset or restored from a backup.
+
+Ids are handed out in insert order, but concurrent transactions can commit out of order,
+so a row with an id below the watermark can show up after the watermark passed it. Every
+refresh therefore reads the rows in a window below the watermark again, and skips the ones
+it already processed.
+
+Classes:
+    ReportState:
+        A JSON file backed watermark and daily aggregates per site.
+
+Functions:
+    slug(product) -> str:
+        Return a file name friendly version of a product name.
+    render_reports(state, sites, directory, cheapest=None, max_points=500, index="index.html", max_workers=None, split_data=False, compress=()) -> list[str]:
+        Render a page per product in a pool of processes, and an index page linking to them.
+"""
+
+import logging
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, date, time
+from typing import Generator, Iterable
+
+from .compress import precompress
+from .database import BasePriceDatabase
+from .html import generate_graph_html, generate_index_html
+from .utils import load_json, dump_json
+
+
+class ReportState:
+    """
+    A JSON file backed watermark and daily aggregates per site.
+
+    The state is read when it is created and written by save(), or when used as a context manager, on exit.
+    If the file does not exist or is corrupt, the state is empty and the next refresh reads the full history.
+
+    Args:
+        filename (str): The path of the JSON file that holds the state. It does not need to exist yet.
+        overlap (int): The number of ids below the watermark that are read again by every refresh.
+
+    Attributes:
+        watermark (int | None): The highest id processed, or None if no rows were processed yet.
+        database (str | None): The identity of the database the rows were read from.
+
+    Methods:
+        update(self, rows) -> int:
+            Fold rows into the daily aggregates.
+        refresh(self, db, itersize) -> int:
+            Fold the rows added to db since the last refresh into the daily aggregates.
+        daily(self, urls) -> Generator[tuple[date, str, float, float, float, int], None, None]:
+            Return the daily aggregates per site.
+        series(self, urls) -> Generator[tuple[None, str, float, datetime], None, None]:
+            Return the lowest price per site per day, in the shape of rows from get_prices().
+        save(self) -> None:
+            Write the state to disk.
+    """
+
+    version = 2
+
+    def __init__(self, filename:str, overlap:int=1000) -> None:
+        self.filename = filename
+        self.overlap = overlap
+        self._reset()
+        state = load_json(filename)
+        if state is None:
+            return
+        try:
+            if state.get("version") == self.version:
+                self.database = state["database"]
+                self.watermark = state["watermark"]
+                self._recent = set(state["recent"])
+                self._sites = state["sites"]
+                logging.debug(f"report state loaded from {filename} (watermark {self.watermark})")
+            else:
+                logging.warning(f"report state {filename} has an unknown version, rebuilding the reports")
+        except (AttributeError, KeyError):
+            logging.warning(f"report state {filename} is corrupt, rebuilding the reports")
+
+    def _reset(self) -> None:
+        self.database = None
+        self.watermark = None
+        # the ids processed in the overlap window below the watermark
+        self._recent = set()
+        self._sites = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.save()
+
+    def __len__(self) -> int:
+        return len(self._sites)
+
+    def update(self, rows:Iterable[tuple[int,str,float,datetime]]) -> int:
+        """
+        Fold rows into the daily aggregates, rows in the overlap window that were processed before are skipped.
+
+        Args:
+            rows (Iterable[tuple[int, str, float, datetime]]): Rows with id, url, price and timestamp.
+
+        Returns:
+            int: The number of rows processed.
+        """
+        n = 0
+        for id, url, price, timestamp in rows:
+            if id in self._recent or (self.watermark is not None and id <= self.watermark - self.overlap):
+                continue
+            n += 1
+            self._recent.add(id)
+            self.watermark = id if self.watermark is None else max(self.watermark, id)
+            if price is None or timestamp is None:
+                continue
+            day = timestamp.date().isoformat()
+            days = self._sites.setdefault(url, {})
+            aggregate = days.get(day)
+            if aggregate is None:
+                days[day] = [price, price, price, 1]
+            else:
+                aggregate[0] = min(aggregate[0], price)
+                aggregate[1] = max(aggregate[1], price)
+                aggregate[2] += price
+                aggregate[3] += 1
+        if self.watermark is not None:
+            self._recent = {id for id in self._recent if id > self.watermark - self.overlap}
+        return n
+
+    def refresh(self, db:BasePriceDatabase, itersize:int=2000) -> int:
+        """
+        Fold the rows added to db since the last refresh into the daily aggregates.
+
+        The state is rebuilt from the full history if it was built from another database, or if
+        the ids in db stop below the watermark.
+
+        Args:
+            db (BasePriceDatabase): The price database.
+            itersize (int): The number of rows fetched from the database at a time.
+
+        Returns:
+            int: The number of new rows.
+        """
+        if self.watermark is not None:
+            max_id = db.max_id()
+            if self.database != db.identity or max_id is None or max_id < self.watermark:
+                logging.warning(
+                    f"report state {self.filename} does not match {db.identity} "
+                    f"(watermark {self.watermark}, highest id {max_id}), rebuilding the reports"
+                )
+                self._reset()
+        self.database = db.identity
+        after_id = self.watermark - self.overlap if self.watermark is not None and self.watermark > self.overlap else None
+        n = self.update(db.get_prices(itersize=itersize, after_id=after_id))
+        logging.info(f"{n} new rows for the reports (watermark {self.watermark})")
+        return n
+
+    def daily(self, urls:Iterable[str]|None=None) -> Generator[tuple[date,str,float,float,float,int],None,None]:
+        """
+        Return the daily aggregates per site, ordered by url and day.
+
+        Args:
+            urls (Iterable[str] | None): If given, only the aggregates of these sites are returned.
+
+        Yields:
+            tuple[date, str, float, float, float, int]: Rows with day, url, minimum, maximum, average and count.
+        """
+        for url in sorted(self._sites if urls is None else set(urls) & self._sites.keys()):
+            for day, (low, high, total, count) in sorted(self._sites[url].items()):
+                yield date.fromisoformat(day), url, low, high, total / count, count
+
+    def series(self, urls:Iterable[str]|None=None) -> Generator[tuple[None,str,float,datetime],None,None]:
+        """
+        Return the lowest price per site per day, in the shape of rows from get_prices().
+
+        Args:
+            urls (Iterable[str] | None): If given, only the prices of these sites are returned.
+
+        Yields:
+            tuple[None, str, float, datetime]: Rows without id, with url, lowest price and the start of the day.
+        """
+        for day, url, low, *_ in self.daily(urls):
+            yield None, url, low, datetime.combine(day, time())
+
+    def save(self) -> None:
+        """
+        Write the state to disk, atomically.
+        """
+        dump_json(self.filename, {
+            "version": self.version,
+            "database": self.database,
+            "watermark": self.watermark,
+            "recent": sorted(self._recent),
+            "sites": self._sites,
+        })
+        logging.debug(f"report state saved to {self.filename} (watermark {self.watermark})")
+
+
+def slug(product:str) -> str:
+    """
+    Return a file name friendly version of a product name.
+
+    Args:
+        product (str): The name of the product.
+
+    Returns:
+        str: The lowercase name with every run of other characters than letters and digits replaced by a dash.
+    """
+    return re.sub(r"[^a-z0-9]+", "-", product.lower()).strip("-") or "product"
+
+
+def _render_page(data:list, filename:str, data_file:str|None, compress:tuple[str,...], **kwargs) -> list[str]:
+    generate_graph_html(data, filename=filename, data_file=data_file, **kwargs)
+    paths = [filename] if data_file is None else [filename, data_file]
+    return paths + [compressed for path in paths for compressed in precompress(path, compress)]
+
+
+def render_reports(state:ReportState, sites:dict[str,str], directory:str, cheapest:dict[str,tuple[str,float]]|None=None, max_points:int=500, index:str="index.html", max_workers:int|None=None, split_data:bool=False, compress:Iterable[str]=()) -> list[str]:
+    """
+    Render a page per product in a pool of processes, and an index page linking to them.
+
+    Rendering a page is mostly CPU bound work, downsampling the series and encoding them,
+    so the pages are rendered in separate processes to use all cores.
+
+    With split_data the chart data of a product is written to a JSON file next to its page,
+    which the page fetches. The page itself then only changes when the product or the index
+    does, so it can be cached, and only the data file changes when prices are added.
+
+    Args:
+        state (ReportState): The report state with the aggregates of all sites.
+        sites (dict[str, str]): The product of each site, keyed by url.
+        directory (str): The directory the pages are written to. It is created if it does not exist.
+        cheapest (dict[str, tuple[str, float]] | None): The cheapest (url, price) tuple today, keyed by product.
+        max_points (int): The maximum number of points per site in a graph.
+        index (str): The file name of the index page.
+        max_workers (int | None): The maximum number of processes, or None for the number of processors.
+        split_data (bool): Write the chart data of every product to a separate JSON file.
+        compress (Iterable[str]): Also write compressed versions of all files, gz and/or br, see precompress().
+
+    Returns:
+        list[str]: The paths of all files written, the index page first and every file before its compressed versions.
+    """
+    compress = tuple(compress)
+    os.makedirs(directory, exist_ok=True)
+    cheapest = cheapest or {}
+    products = {}
+    for url, product in sites.items():
+        products.setdefault(product, []).append(url)
+
+    pages = []
+    used = {index}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = []
+        for product in sorted(products):
+            name = f"{slug(product)}.html"
+            n = 1
+            while name in used:
+                n += 1
+                name = f"{slug(product)}-{n}.html"
+            used.add(name)
+            cheapest_site, lowest_price_today = cheapest.get(product, ("unknown", "unknown"))
+            futures.append(executor.submit(
+                _render_page,
+                list(state.series(products[product])),
+                filename=os.path.join(directory, name),
+                data_file=os.path.join(directory, f"{name[:-len('.html')]}.json") if split_data else None,
+                compress=compress,
+                cheapest_site=cheapest_site,
+                lowest_price_today=lowest_price_today,
+                max_points=max_points,
+                product=product,
+                index=index,
+            ))
+            pages.append((product, name, cheapest_site, lowest_price_today))
+        paths = [path for future in futures for path in future.result()]
+
+    filename = os.path.join(directory, index)
+    generate_index_html(pages, filename=filename)
+    logging.info(f"{len(pages)} product pages rendered to {directory}")
+    return [filename] + precompress(filename, compress) + paths
@@ -0,0 +1,211 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Module for dealing with shops that misbehave.
+
+A one-off timeout or a 503 from a shop should not cost us the data point of the day,
+so transient failures are retried a few times, with exponential backoff and full jitter
+to avoid hammering a shop that is already struggling.
+
+A shop that is down for days should not cost us its full timeout on every run either.
+A circuit breaker counts the consecutive runs in which a site failed, in a file that is
+kept between runs. After threshold failed runs the circuit opens and the site is skipped
+until the cooldown has passed. Then the site is tried once more: a success closes the
+circuit, a failure opens it again for another cooldown.
+
+Classes:
+    CircuitOpenError:
+        Raised in place of scraping a site that is skipped because its circuit is open.
+    RetryPolicy:
+        Decides which failures are retried and how long to wait before the next attempt.
+    CircuitBreaker:
+        A thread safe, JSON file backed record of failing sites keyed by URL.
+
+Functions:
+    is_transient(exception) -> bool:
+        Return True if exception is a failure that may well not happen again.
+"""
+
+import asyncio
+import logging
+import random
+import threading
+from time import time
+
+import aiohttp
+import requests
+from selenium.common.exceptions import TimeoutException, WebDriverException
+
+from .utils import load_json, dump_json
+
+# statuses that tell us to come back later
+transient_statuses = {408, 425, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+def is_transient(exception: Exception) -> bool:
+    """
+    Return True if exception is a failure that may well not happen again.
+
+    Connection problems, timeouts, browser errors and HTTP statuses like 429 and 503 are
+    transient. A page without a price and any other error are not, retrying would give the same result.
+
+    Args:
+        exception (Exception): The exception raised by a scraper.
+
+    Returns:
+        bool: True if the scraper should be retried.
+    """
+    if isinstance(exception, requests.HTTPError):
+        return exception.response is not None and exception.response.status_code in transient_statuses
+    if isinstance(exception, aiohttp.ClientResponseError):
+        return exception.status in transient_statuses
+    return isinstance(
+        exception,
+        (
+            requests.ConnectionError,
+            requests.Timeout,
+            aiohttp.ClientConnectionError,
+            asyncio.TimeoutError,
+            ConnectionError,
+            TimeoutException,
+            WebDriverException,
+        ),
+    )
+
+
+class RetryPolicy:
+    """
+    Decides which failures are retried and how long to wait before the next attempt.
+
+    The delay before retry n (counting from 1) is a random number between 0 and
+    min(cap, base * 2 ** (n - 1)) seconds, the "full jitter" backoff.
+
+    Args:
+        retries (int): The maximum number of retries after the first attempt.
+        base (float): The maximum delay in seconds before the first retry.
+        cap (float): The maximum delay in seconds before any retry.
+
+    Methods:
+        retry(self, exception, attempt) -> bool:
+            Return True if a failed attempt should be retried.
+        delay(self, attempt) -> float:
+            Return the number of seconds to wait before the next attempt.
+    """
+
+    def __init__(self, retries: int = 2, base: float = 1.0, cap: float = 30.0) -> None:
+        self.retries = retries
+        self.base = base
+        self.cap = cap
+
+    def retry(self, exception: Exception, attempt: int) -> bool:
+        """
+        Return True if a failed attempt should be retried.
+
+        Args:
+            exception (Exception): The exception raised by the attempt.
+            attempt (int): The number of the attempt that failed, counting from 1.
+
+        Returns:
+            bool: True if there are retries left and the failure is transient.
+        """
+        return attempt <= self.retries and is_transient(exception)
+
+    def delay(self, attempt: int) -> float:
+        """
+        Return the number of seconds to wait before the next attempt.
+
+        Args:
+            attempt (int): The number of the attempt that failed, counting from 1.
+
+        Returns:
+            float: The delay in seconds.
+        """
+        return random.uniform(0.0, min(self.cap, self.base * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    """
+    A thread safe, JSON file backed record of failing sites keyed by URL.
+
+    The record is read when it is created and written by save(), or when used as a context manager, on exit.
+    Record the outcome of every site once per run, after any retries, with success() or failure().
+
+    Args:
+        filename (str): The path of the JSON file that holds the record. It does not need to exist yet.
+        threshold (int): The number of consecutive failed runs after which the circuit of a site opens.
+        cooldown (float): The number of seconds a site is skipped once its circuit is open.
+
+    Methods:
+        allow(self, url, now) -> bool:
+            Return True if the site at url should be scraped.
+        success(self, url) -> None:
+            Record that the site at url was reachable, closing its circuit.
+        failure(self, url, now) -> None:
+            Record that the site at url failed, opening its circuit when the threshold is reached.
+        failures(self, url) -> int:
+            Return the number of consecutive failed runs of the site at url.
+        save(self) -> None:
+            Write the record to disk.
+    """
+
+    def __init__(self, filename: str, threshold: int = 3, cooldown: float = 24 * 3600.0) -> None:
+        self.filename = filename
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._sites = load_json(filename, {})
+        logging.debug(f"circuit breaker state loaded from {filename} ({len(self._sites)} failing sites)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.save()
+
+    def allow(self, url: str, now: float | None = None) -> bool:
+        """
+        Return True if the site at url should be scraped.
+
+        Args:
+            url (str): The url of the site.
+            now (float | None): The current time in seconds since the epoch, by default time.time().
+
+        Returns:
+            bool: False if the circuit of the site is open and its cooldown has not passed yet.
+        """
+        now = time() if now is None else now
+        with self._lock:
+            entry = self._sites.get(url)
+        if entry is None or entry.get("opened") is None:
+            return True
+        return now - entry["opened"] >= self.cooldown
+
+    def success(self, url: str) -> None:
+        with self._lock:
+            if self._sites.pop(url, None) is not None:
+                logging.info(f"circuit of {url} closed")
+
+    def failure(self, url: str, now: float | None = None) -> None:
+        now = time() if now is None else now
+        with self._lock:
+            entry = self._sites.setdefault(url, {"failures": 0, "opened": None})
+            entry["failures"] += 1
+            if entry["failures"] >= self.threshold:
+                entry["opened"] = now
+                logging.warning(f"circuit of {url} opened after {entry['failures']} failed runs, skipped for {self.cooldown}s")
+
+    def failures(self, url: str) -> int:
+        with self._lock:
+            return self._sites.get(url, {}).get("failures", 0)
+
+    def save(self) -> None:
+        """
+        Write the record to disk, atomically.
+        """
+        with self._lock:
+            dump_json(self.filename, self._sites)
+        logging.debug(f"circuit breaker state saved to {self.filename}")
@@ -0,0 +1,294 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Module for scheduling requests politely over a collection of hosts.
+
+Scraping many pages of the same shop at once would hit its server in bursts and
+could get us blocked. The scheduler groups the jobs by host and only hands out a job
+for a host when that host has a free connection and its token bucket has a token,
+so every host gets at most `rate` requests per second, with bursts of at most `burst`
+requests, and at most `concurrency` requests at the same time.
+
+Hosts are served round robin and a job is only dispatched when it can start right
+away, so a job never waits behind jobs for another host and a worker never sleeps
+on a rate limit.
+
+A Crawl-delay in the robots.txt of a host lowers its rate to one request per delay.
+
+A job can be added with a time before which it should not start, for example a retry
+after a backoff. Such a job waits in the scheduler, not in a worker.
+
+Classes:
+    TokenBucket:
+        A token bucket that refills at a fixed rate up to a maximum number of tokens.
+    PoliteScheduler:
+        Hands out jobs round robin over hosts within the rate and concurrency limits of each host.
+
+Functions:
+    host(url) -> str:
+        Return the host a url is scheduled under.
+    crawl_delay(url, user_agent, timeout=10.0) -> float | None:
+        Return the Crawl-delay in the robots.txt of the host of url.
+    crawl_delays(urls, user_agent, timeout=10.0, max_workers=8) -> dict[str, float]:
+        Return the Crawl-delay of every host with one in its robots.txt, fetched concurrently.
+"""
+
+import heapq
+import logging
+from collections import deque
+from itertools import count
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+from typing import Any, Iterable
+from urllib.parse import urlsplit
+from urllib.robotparser import RobotFileParser
+
+import requests
+
+
+def host(url: str) -> str:
+    """
+    Return the host a url is scheduled under.
+
+    Args:
+        url (str): The url.
+
+    Returns:
+        str: The lowercase network location of url, including the port if any.
+    """
+    return urlsplit(url).netloc.lower()
+
+
+class TokenBucket:
+    """
+    A token bucket that refills at a fixed rate up to a maximum number of tokens.
+
+    The bucket starts full, its clock starts at the first call. Time is passed in explicitly,
+    so the bucket itself never sleeps.
+
+    Args:
+        rate (float | None): The number of tokens added per second, None for a bucket that is never empty.
+        burst (int): The maximum number of tokens in the bucket.
+        now (float | None): The time the clock starts at, by default the time of the first call.
+
+    Methods:
+        delay(self, now) -> float:
+            Return the number of seconds until a token is available, 0.0 if one is available now.
+        take(self, now) -> None:
+            Remove a token from the bucket.
+    """
+
+    def __init__(self, rate: float | None = None, burst: int = 1, now: float | None = None) -> None:
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._time = now
+
+    def _refill(self, now: float) -> None:
+        if self._time is None:
+            self._time = now
+        elif now > self._time:
+            self._tokens = min(self.burst, self._tokens + (now - self._time) * self.rate)
+            self._time = now
+
+    def delay(self, now: float) -> float:
+        if self.rate is None:
+            return 0.0
+        self._refill(now)
+        return 0.0 if self._tokens >= 1.0 else (1.0 - self._tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        if self.rate is None:
+            return
+        self._refill(now)
+        self._tokens -= 1.0
+
+
+class PoliteScheduler:
+    """
+    Hands out jobs round robin over hosts within the rate and concurrency limits of each host.
+
+    The scheduler is not thread safe, it is meant to be used by the single thread that dispatches jobs to workers.
+
+    Args:
+        rate (float | None): The maximum number of requests per second per host, None for no limit.
+        burst (int): The maximum number of requests to a host in a burst.
+        concurrency (int | None): The maximum number of simultaneous requests per host, None for no limit.
+        delays (dict[str, float] | None): The Crawl-delay in seconds per host, see crawl_delays().
+
+    Methods:
+        add(self, url, job, not_before) -> None:
+            Queue a job for the host of url, optionally not to start before a given time.
+        next(self, now) -> tuple[Any, float]:
+            Return a job that can start now, or None and the number of seconds until one can.
+        done(self, url) -> None:
+            Release the connection of a finished job for the host of url.
+        clear(self) -> list[Any]:
+            Remove all queued jobs and return them.
+    """
+
+    def __init__(
+        self,
+        rate: float | None = None,
+        burst: int = 1,
+        concurrency: int | None = None,
+        delays: dict[str, float] | None = None,
+    ) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.delays = delays or {}
+        self._jobs = {}
+        self._buckets = {}
+        self._active = {}
+        self._hosts = deque()
+        self._delayed = []
+        self._sequence = count()
+
+    def __len__(self) -> int:
+        return sum(len(jobs) for jobs in self._jobs.values()) + len(self._delayed)
+
+    def _bucket(self, name: str) -> TokenBucket:
+        if name not in self._buckets:
+            rate, burst = self.rate, self.burst
+            delay = self.delays.get(name)
+            if delay:
+                # a crawl delay means one request at a time, spaced by the delay
+                rate, burst = min(rate or 1 / delay, 1 / delay), 1
+            self._buckets[name] = TokenBucket(rate, burst)
+        return self._buckets[name]
+
+    def add(self, url: str, job: Any, not_before: float | None = None) -> None:
+        """
+        Queue a job for the host of url.
+
+        Args:
+            url (str): The url the job requests.
+            job (Any): The job, returned by next() when it can start.
+            not_before (float | None): The monotonic time before which the job should not start, None to queue it right away.
+        """
+        if not_before is not None:
+            heapq.heappush(self._delayed, (not_before, next(self._sequence), url, job))
+            return
+        name = host(url)
+        if name not in self._jobs:
+            self._jobs[name] = deque()
+            self._active.setdefault(name, 0)
+            self._bucket(name)
+        if not self._jobs[name]:
+            self._hosts.append(name)
+        self._jobs[name].append(job)
+
+    def next(self, now: float | None = None) -> tuple[Any, float]:
+        """
+        Return a job that can start now, or None and the number of seconds until one can.
+
+        The host of the returned job moves to the back of the round robin.
+
+        Args:
+            now (float | None): The current monotonic time, by default time.monotonic().
+
+        Returns:
+            tuple[Any, float]: The job and 0.0, or None and the time to wait. The time is
+                infinite if no job can start before a running job is done, or if there are no jobs left.
+        """
+        now = monotonic() if now is None else now
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, url, job = heapq.heappop(self._delayed)
+            self.add(url, job)
+        wait = self._delayed[0][0] - now if self._delayed else float("inf")
+        for _ in range(len(self._hosts)):
+            name = self._hosts[0]
+            self._hosts.rotate(-1)
+            if self.concurrency is not None and self._active[name] >= self.concurrency:
+                continue
+            delay = self._buckets[name].delay(now)
+            if delay > 0.0:
+                wait = min(wait, delay)
+                continue
+            self._buckets[name].take(now)
+            self._active[name] += 1
+            job = self._jobs[name].popleft()
+            if not self._jobs[name]:
+                self._hosts.remove(name)
+            return job, 0.0
+        return None, wait
+
+    def done(self, url: str) -> None:
+        name = host(url)
+        self._active[name] = max(0, self._active.get(name, 0) - 1)
+
+    def clear(self) -> list[Any]:
+        """
+        Remove all queued jobs, including the jobs that should not start yet, and return them.
+
+        Returns:
+            list[Any]: The jobs in the order they were queued per host, followed by the delayed jobs.
+        """
+        jobs = [job for name in self._hosts for job in self._jobs[name]]
+        jobs += [job for _, _, _, job in sorted(self._delayed)]
+        for queue in self._jobs.values():
+            queue.clear()
+        self._hosts.clear()
+        self._delayed.clear()
+        return jobs
+
+
+def crawl_delay(url: str, user_agent: str, timeout: float = 10.0) -> float | None:
+    """
+    Return the Crawl-delay in the robots.txt of the host of url.
+
+    A Request-rate is converted to the equivalent delay. A robots.txt that cannot be retrieved counts as no delay.
+
+    Args:
+        url (str): Any url on the host.
+        user_agent (str): The User-Agent the rules are looked up for.
+        timeout (float): The timeout in seconds for retrieving robots.txt.
+
+    Returns:
+        float | None: The delay in seconds between requests, or None if there is none.
+    """
+    parts = urlsplit(url)
+    robots = f"{parts.scheme}://{parts.netloc}/robots.txt"
+    try:
+        response = requests.get(robots, headers={"User-Agent": user_agent}, timeout=timeout)
+    except requests.RequestException as e:
+        logging.debug(f"cannot retrieve {robots} {e}")
+        return None
+    if response.status_code != 200:
+        return None
+
+    parser = RobotFileParser(robots)
+    parser.parse(response.text.splitlines())
+    delays = []
+    if (delay := parser.crawl_delay(user_agent)) is not None:
+        delays.append(float(delay))
+    if (rate := parser.request_rate(user_agent)) is not None and rate.requests > 0:
+        delays.append(rate.seconds / rate.requests)
+    return max(delays, default=None)
+
+
+def crawl_delays(urls: Iterable[str], user_agent: str, timeout: float = 10.0, max_workers: int = 8) -> dict[str, float]:
+    """
+    Return the Crawl-delay of every host with one in its robots.txt, fetched concurrently.
+
+    Args:
+        urls (Iterable[str]): The urls, robots.txt is retrieved once per host.
+        user_agent (str): The User-Agent the rules are looked up for.
+        timeout (float): The timeout in seconds for retrieving a robots.txt.
+        max_workers (int): The maximum number of robots.txt files retrieved at the same time.
+
+    Returns:
+        dict[str, float]: The delay in seconds keyed by host, hosts without a delay are left out.
+    """
+    hosts = {}
+    for url in urls:
+        hosts.setdefault(host(url), url)
+    if not hosts:
+        return {}
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="robots") as executor:
+        delays = executor.map(lambda url: crawl_delay(url, user_agent, timeout), hosts.values())
+        result = {name: delay for name, delay in zip(hosts, delays) if delay}
+    for name, delay in result.items():
+        logging.info(f"crawl delay of {delay}s for {name}")
+    return result
@@ -1,20 +1,47 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import logging
-from typing import Tuple
+from itertools import chain
+from time import perf_counter
+from typing import Tuple, Iterable
 from collections import namedtuple
 import requests
+import aiohttp
 import re
 from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
+
+from .browser import BrowserPool, chromium_options, new_driver
+from .cache import HttpCache
+from .database import DEFAULT_PRODUCT
+from .metrics import metrics, downloaded
+from .structured import find_price
 
 
 class PriceNotFoundException(Exception):
     pass
 
 
+def timed(chunks: Iterable[str], waiting: list[float]) -> Iterable[str]:
+    """
+    Pass chunks through and add the time spent waiting for each chunk to waiting[0].
+
+    Args:
+        chunks (Iterable[str]): The chunks, for example from Response.iter_content().
+        waiting (list[float]): A single element list the waiting time in seconds is added to.
+
+    Yields:
+        str: The chunks.
+    """
+    chunks = iter(chunks)
+    while True:
+        start = perf_counter()
+        chunk = next(chunks, None)
+        waiting[0] += perf_counter() - start
+        if chunk is None:
+            return
+        yield chunk
+
+
 # a PricePattern tuple should be passed as an argument to a
 # ChromiumCoffeeScraper constructor.
 # It is used to locate the element inside a page that contains
@@ -34,28 +61,61 @@ class CoffeeScraper:
     custom headers to the given URL and attempts to extract the coffee price using the provided
     price pattern.
 
+    If an HttpCache is provided, the request is a conditional GET and when the server
+    reports that the page is not modified, the cached price is returned instead.
+
+    In streaming mode the page is read in chunks and scanned as it arrives. The connection
+    is closed as soon as the price is found, so the rest of a large page is never downloaded.
+    To find a match that is split across chunks, each chunk is scanned together with the
+    last overlap characters of the previous one. The price pattern should therefore match
+    fewer than overlap characters and should not end in an open ended repetition.
+
+    With structured set, the schema.org JSON-LD blocks and price meta tags of the page are
+    searched first, see the structured module. The price pattern is only used if the page
+    has no structured price, and can be None if the structured data should always be there.
+
     Attributes:
         headers (dict): Default User-Agent headers for the HTTP request.
+        chunk_size (int): The number of bytes read at a time in streaming mode.
+        overlap (int): The number of characters of the previous chunk that are scanned again in streaming mode.
 
     Args:
         url (str): The URL from which to scrape the coffee-related information.
         pricepattern (str): A regular expression pattern used to extract the coffee price.
         format (function, optional): A function to format the extracted price (default is identity function).
+        cache (HttpCache | None, optional): The cache of validators and prices (default is None).
+        stream (bool, optional): Read and scan the page in chunks (default is False).
+        product (str, optional): The name of the product sold on the page (default is DEFAULT_PRODUCT).
+        structured (bool, optional): Search the structured data of the page before using the price pattern (default is False).
 
     Methods:
-        __init__(self, url: str, pricepattern: str, format=lambda x: x) -> None:
-            Initializes a CoffeeScraper instance with the provided URL, price pattern, and format function.
+        __init__(self, url: str, pricepattern: str, format=lambda x: x, cache=None, stream=False, product=DEFAULT_PRODUCT, structured=False) -> None:
+            Initializes a CoffeeScraper instance with the provided URL, price pattern, format function, cache, mode, product and strategy.
 
         __call__(self) -> Tuple[str, float] | None:
             Calls the instance and performs the scraping. Returns a tuple containing the URL and the extracted
             coffee price if successful, or raises PriceNotFoundException if no price is found.
     """
 
+    # statuses that mean the shop cannot serve the page right now, rather than a page without a price
+    unavailable = {429, 500, 502, 503, 504}
+
     headers = {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/111.0.0.0 Safari/537.36"
     }
+    chunk_size = 16384
+    overlap = 1024
 
-    def __init__(self, url: str, pricepattern: str, format=lambda x: x) -> None:
+    def __init__(
+        self,
+        url: str,
+        pricepattern: str,
+        format=lambda x: x,
+        cache: HttpCache | None = None,
+        stream: bool = False,
+        product: str = DEFAULT_PRODUCT,
+        structured: bool = False,
+    ) -> None:
         """
         Initialize a CoffeeScraper instance.
 
@@ -63,12 +123,20 @@ class CoffeeScraper:
             url (str): The URL from which to scrape the coffee-related information.
             pricepattern (str): A regular expression pattern used to extract the coffee price.
             format (function, optional): A function to format the extracted price (default is identity function).
+            cache (HttpCache | None, optional): The cache of validators and prices (default is None).
+            stream (bool, optional): Read and scan the page in chunks (default is False).
+            product (str, optional): The name of the product sold on the page (default is DEFAULT_PRODUCT).
+            structured (bool, optional): Search the structured data of the page before using the price pattern (default is False).
         """
         self.url = url
+        self.product = product
+        self.structured = structured
         self.pricepattern = (
             re.compile(pricepattern) if pricepattern is not None else None
         )
         self.format = format
+        self.cache = cache
+        self.stream = stream
 
     def __call__(self) -> Tuple[str, float] | None:
         """
@@ -81,20 +149,162 @@ class CoffeeScraper:
         Raises:
             PriceNotFoundException: If no price is found in the scraped content.
         """
-        response = requests.get(self.url, headers=self.headers, timeout=15.0)
-        logging.debug(f"{self.url} {response.status_code}:{response.reason}")
-        if match := re.search(self.pricepattern, response.text):
+        start = perf_counter()
+        # the time spent waiting for the network, the rest is spent extracting the price
+        waiting = [0.0]
+        with requests.get(
+            self.url, headers=self.request_headers(), timeout=15.0, stream=self.stream
+        ) as response:
+            waiting[0] = perf_counter() - start
+            logging.debug(f"{self.url} {response.status_code}:{response.reason}")
             try:
-                price = match.group("price")
-                price = float(self.format(price))
-                logging.info(f"price from {self.url} = {price}")
-            except ValueError:
-                raise PriceNotFoundException(
-                    f"could not convert {price} to float in {self.url}"
-                )
-            return self.url, price
+                if (result := self.cached_result(response.status_code)) is not None:
+                    return result
+                if response.status_code in self.unavailable:
+                    response.raise_for_status()
+                fetched, parse_start = waiting[0], perf_counter()
+                if self.stream:
+                    if response.encoding is None:
+                        response.encoding = "utf-8"
+                    result = self.extract_price_stream(
+                        timed(response.iter_content(self.chunk_size, decode_unicode=True), waiting)
+                    )
+                else:
+                    result = self.extract_price(response.text)
+                metrics.observe("parse_seconds", perf_counter() - parse_start - (waiting[0] - fetched), url=self.url)
+            finally:
+                metrics.observe("fetch_seconds", waiting[0], url=self.url)
+                metrics.observe("downloaded_bytes", downloaded(response), url=self.url)
+        if self.cache is not None:
+            self.cache.store(self.url, response.headers, result[1])
+        return result
+
+    def request_headers(self) -> dict[str, str]:
+        """
+        Return the headers for the HTTP request, including conditional headers if a cache is used.
+
+        Returns:
+            dict[str, str]: The request headers.
+        """
+        if self.cache is None:
+            return self.headers
+        return {**self.headers, **self.cache.conditional_headers(self.url)}
+
+    def cached_result(self, status: int) -> Tuple[str, float] | None:
+        """
+        Return the cached result if the server reported that the page is not modified.
+
+        Args:
+            status (int): The HTTP status code of the response.
+
+        Returns:
+            Tuple[str, float] | None: A tuple containing the URL and the cached price, or None if the page has to be scanned.
+        """
+        if status != 304 or self.cache is None:
+            return None
+        if (price := self.cache.price(self.url)) is None:
+            return None
+        logging.info(f"price from {self.url} = {price} (not modified)")
+        return self.url, price
+
+    def extract_price(self, text: str) -> Tuple[str, float]:
+        """
+        Extract the coffee price from the content of a page.
+
+        Args:
+            text (str): The content of the page.
+
+        Returns:
+            Tuple[str, float]: A tuple containing the URL and the extracted coffee price.
+
+        Raises:
+            PriceNotFoundException: If no price is found in the content or it cannot be converted to a float.
+        """
+        if self.structured and (result := self.structured_result((text,))) is not None:
+            return result
+        if self.pricepattern is not None and (match := re.search(self.pricepattern, text)):
+            return self.convert_match(match)
         raise PriceNotFoundException(f"No price found in {self.url}")
 
+    def extract_price_stream(self, chunks: Iterable[str]) -> Tuple[str, float]:
+        """
+        Extract the coffee price from the content of a page that arrives in chunks.
+
+        Scanning stops at the first chunk that completes a match, so the remaining
+        chunks are never consumed.
+
+        Args:
+            chunks (Iterable[str]): The content of the page in consecutive chunks.
+
+        Returns:
+            Tuple[str, float]: A tuple containing the URL and the extracted coffee price.
+
+        Raises:
+            PriceNotFoundException: If no price is found in the content or it cannot be converted to a float.
+        """
+        if self.structured:
+            chunks = iter(chunks)
+            seen = []
+
+            def record():
+                for chunk in chunks:
+                    seen.append(chunk)
+                    yield chunk
+
+            if (result := self.structured_result(record())) is not None:
+                return result
+            # scan the chunks the structured data extractor consumed again
+            chunks = chain(seen, chunks)
+        if self.pricepattern is None:
+            raise PriceNotFoundException(f"No price found in {self.url}")
+        window = ""
+        for chunk in chunks:
+            window = window[-self.overlap :] + chunk
+            if match := self.pricepattern.search(window):
+                return self.convert_match(match)
+        raise PriceNotFoundException(f"No price found in {self.url}")
+
+    def structured_result(self, chunks: Iterable[str]) -> Tuple[str, float] | None:
+        """
+        Extract the coffee price from the structured data of a page.
+
+        The price in structured data is a plain number, so the format function is not applied.
+
+        Args:
+            chunks (Iterable[str]): The content of the page in consecutive chunks.
+
+        Returns:
+            Tuple[str, float] | None: A tuple containing the URL and the price, or None if the page has no structured price.
+        """
+        if (price := find_price(chunks)) is None:
+            logging.debug(f"no structured price found in {self.url}")
+            return None
+        logging.info(f"price from {self.url} = {price} (structured data)")
+        return self.url, price
+
+    def convert_match(self, match: re.Match) -> Tuple[str, float]:
+        """
+        Convert the price group of a match to a float.
+
+        Args:
+            match (re.Match): A match of the price pattern.
+
+        Returns:
+            Tuple[str, float]: A tuple containing the URL and the extracted coffee price.
+
+        Raises:
+            PriceNotFoundException: If the price cannot be converted to a float.
+        """
+        try:
+            price = match.group("price")
+            price = float(self.format(price))
+            logging.info(f"price from {self.url} = {price}")
+        except ValueError:
+            raise PriceNotFoundException(
+                f"could not convert {price} to float in {self.url}"
+            )
+        return self.url, price
+
 
 class ChromiumCoffeeScraper(CoffeeScraper):
     """
@@ -104,14 +314,23 @@ class ChromiumCoffeeScraper(CoffeeScraper):
     to perform the scraping. It sends an HTTP GET request to the given URL using the headless Chromium browser,
     then attempts to locate and extract the coffee price from the loaded page.
 
+    If a BrowserPool is provided, a warm browser is checked out of the pool for each call,
+    otherwise a new browser is started and quit again for every call.
+
+    With structured set, the page is first downloaded without a browser and its structured
+    data is searched. The browser is only started if no price is found that way.
+
     Args:
         url (str): The URL from which to scrape the coffee-related information.
         pricepattern (PricePattern): A PricePattern object used to extract the coffee price.
         format (function, optional): A function to format the extracted price (default is identity function).
+        pool (BrowserPool | None, optional): The pool to check out browsers from (default is None).
+        product (str, optional): The name of the product sold on the page (default is DEFAULT_PRODUCT).
+        structured (bool, optional): Search the structured data of the page before starting a browser (default is False).
 
     Methods:
-        __init__(self, url: str, pricepattern: PricePattern, format=lambda x: x) -> None:
-            Initializes a ChromiumCoffeeScraper instance with the provided URL, PricePattern, and format function.
+        __init__(self, url: str, pricepattern: PricePattern, format=lambda x: x, pool=None, product=DEFAULT_PRODUCT, structured=False) -> None:
+            Initializes a ChromiumCoffeeScraper instance with the provided URL, PricePattern, format function, pool, product and strategy.
 
         __call__(self) -> Tuple[str, float] | None:
             Calls the instance and performs the scraping using Chromium WebDriver.
@@ -120,7 +339,13 @@ class ChromiumCoffeeScraper(CoffeeScraper):
     """
 
     def __init__(
-        self, url: str, pricepattern: PricePattern, format=lambda x: x
+        self,
+        url: str,
+        pricepattern: PricePattern,
+        format=lambda x: x,
+        pool: BrowserPool | None = None,
+        product: str = DEFAULT_PRODUCT,
+        structured: bool = False,
     ) -> None:
         """
         Initialize a ChromiumCoffeeScraper instance.
@@ -129,15 +354,15 @@ class ChromiumCoffeeScraper(CoffeeScraper):
             url (str): The URL from which to scrape the coffee-related information.
             pricepattern (PricePattern): A PricePattern object used to extract the coffee price.
             format (function, optional): A function to format the extracted price (default is identity function).
+            pool (BrowserPool | None, optional): The pool to check out browsers from (default is None).
+            product (str, optional): The name of the product sold on the page (default is DEFAULT_PRODUCT).
+            structured (bool, optional): Search the structured data of the page before starting a browser (default is False).
         """
 
-        super().__init__(url, None, format)
+        super().__init__(url, None, format, product=product, structured=structured)
         self.pricepattern = pricepattern
-        self.options = Options()
-        self.options.add_argument("--headless")
-        self.options.add_argument("--no-sandbox")
-        self.options.add_argument("--disable-dev-shm-usage")
-        self.options.add_argument(f"--user-agent={self.headers['User-Agent']}")
+        self.pool = pool
+        self.options = chromium_options(self.headers["User-Agent"])
 
     def __call__(self) -> Tuple[str, float] | None:
         """
@@ -148,21 +373,63 @@ class ChromiumCoffeeScraper(CoffeeScraper):
                                      Returns None if no price is found.
         """
 
-        driver = webdriver.Chrome(
-            service=Service(
-                service_args=["--verbose", "--log-path=/tmp/webdriver.log"]
-            ),
-            options=self.options,
-        )
+        if self.structured and (result := self.fetch_structured()) is not None:
+            return result
 
-        driver.implicitly_wait(15)
+        if self.pool is not None:
+            with self.pool.driver() as driver:
+                return self.extract_element(driver)
 
-        driver.get(self.url)
+        driver = new_driver(self.options)
+        try:
+            return self.extract_element(driver)
+        finally:
+            driver.quit()
 
+    def fetch_structured(self) -> Tuple[str, float] | None:
+        """
+        Download the page without a browser and extract the coffee price from its structured data.
+
+        Returns:
+            Tuple[str, float] | None: A tuple containing the URL and the price, or None if the page could not be
+                                      downloaded or has no structured price.
+        """
         try:
-            price = driver.find_element(self.pricepattern.by, self.pricepattern.value)
-            formattedprice = float(self.format(price.text))
-            price = self.url, formattedprice
+            with metrics.timer("fetch_seconds", url=self.url), requests.get(
+                self.url, headers=self.headers, timeout=15.0, stream=True
+            ) as response:
+                try:
+                    response.raise_for_status()
+                    if response.encoding is None:
+                        response.encoding = "utf-8"
+                    return self.structured_result(response.iter_content(self.chunk_size, decode_unicode=True))
+                finally:
+                    metrics.observe("downloaded_bytes", downloaded(response), url=self.url)
+        except requests.RequestException as e:
+            logging.debug(f"{self.url} structured data not available {e}")
+            return None
+
+    def extract_element(self, driver: webdriver.Chrome) -> Tuple[str, float]:
+        """
+        Load the page in a browser and extract the coffee price from it.
+
+        Args:
+            driver (webdriver.Chrome): The browser to load the page in.
+
+        Returns:
+            Tuple[str, float]: A tuple containing the URL and the extracted coffee price.
+
+        Raises:
+            PriceNotFoundException: If the element is not found or its text cannot be converted to a float.
+        """
+
+        with metrics.timer("fetch_seconds", url=self.url):
+            driver.get(self.url)
+
+        try:
+            with metrics.timer("parse_seconds", url=self.url):
+                price = driver.find_element(self.pricepattern.by, self.pricepattern.value)
+                formattedprice = float(self.format(price.text))
             logging.info(f"price from {self.url} = {formattedprice}")
         except:
             logging.warning(
@@ -172,56 +439,85 @@ class ChromiumCoffeeScraper(CoffeeScraper):
                 f"{self.url} no element with {self.pricepattern.by} = {self.pricepattern.value} found"
             )
 
-        driver.close()
-
-        driver.quit()
-        return price
+        return self.url, formattedprice
 
 
-koffiehenk = CoffeeScraper(
-    url="https://www.koffiehenk.nl/dolce-gusto-lungo-xl",
-    pricepattern=r'<meta property="product:price:amount" content="(?P<price>\d+\.\d+)"/>',
-)
+def create_session(
+    limit: int = 100, limit_per_host: int = 4, timeout: float = 15.0
+) -> aiohttp.ClientSession:
+    """
+    Create an aiohttp session that can be shared by many AsyncCoffeeScraper instances.
 
+    The session keeps connections alive and reuses them for requests to the same host,
+    so only the first request to a shop pays for the TCP and TLS handshake.
 
-coffeepoddeals = CoffeeScraper(
-    url="https://www.coffeepoddeals.com/capsules-dolce-gusto-lungo-xl",
-    pricepattern=r'<meta property="product:price:amount" content="(?P<price>\d+\.\d+)"/>',
-)
+    Args:
+        limit (int): The maximum number of simultaneous connections in total.
+        limit_per_host (int): The maximum number of simultaneous connections to a single host.
+        timeout (float): The total timeout in seconds for a single request.
 
+    Returns:
+        aiohttp.ClientSession: A session that should be closed by the caller, for example by using it as an async context manager.
+    """
+    connector = aiohttp.TCPConnector(limit=limit, limit_per_host=limit_per_host)
+    return aiohttp.ClientSession(
+        connector=connector,
+        headers=CoffeeScraper.headers,
+        timeout=aiohttp.ClientTimeout(total=timeout),
+    )
 
-deprijshamer = CoffeeScraper(
-    url="https://www.deprijshamer.nl/koffie/cups/dolce-gusto-lungo-xl",
-    pricepattern=r'<div class="productprice-label labellarge">\s*<span class="symbol">€&nbsp;</span>(?P<price>\d+,<span class="cents">\d+)</span>\s*</div>',
-    format=lambda x: float(x.replace(',<span class="cents">', "")) / 100,
-)
 
+class AsyncCoffeeScraper(CoffeeScraper):
+    """
+    A derived class for scraping coffee-related information from a given URL with asyncio.
 
-dolce_gusto = CoffeeScraper(
-    url="https://www.dolce-gusto.nl/koffiesmaken/lungo-xl",
-    pricepattern=r'<meta property="product:price:amount" content="(?P<price>\d+\.\d+)"/>',
-)
+    This class inherits from CoffeeScraper and has the same constructor arguments, but calling an
+    instance returns a coroutine. Many instances can share a single session created with create_session(),
+    so thousands of URLs can be fetched from one event loop over a pool of keep-alive connections.
 
+    Args:
+        url (str): The URL from which to scrape the coffee-related information.
+        pricepattern (str): A regular expression pattern used to extract the coffee price.
+        format (function, optional): A function to format the extracted price (default is identity function).
 
-koffievoordeel = CoffeeScraper(
-    url="https://www.koffievoordeel.nl/dolce-gusto-capsules-cafe-lungo-xl",
-    pricepattern=r'<meta property="bc:current_price" content="(?P<price>\d+\,\d+)"/>',
-    format=lambda x: x.replace(",", "."),
-)
+    Methods:
+        __call__(self, session: aiohttp.ClientSession | None = None) -> Tuple[str, float]:
+            Coroutine that performs the scraping. Returns a tuple containing the URL and the extracted
+            coffee price if successful, or raises PriceNotFoundException if no price is found.
+    """
 
+    async def __call__(
+        self, session: aiohttp.ClientSession | None = None
+    ) -> Tuple[str, float]:
+        """
+        Perform the scraping and extraction of coffee-related information.
 
-jumbo = ChromiumCoffeeScraper(
-    url="https://www.jumbo.com/producten/nescafe-dolce-gusto-lungo-capsules-30-koffiecups-352850DS",
-    pricepattern=PricePattern(by=By.CLASS_NAME, value="current-price"),
-    format=lambda x: float(re.sub(r"\s", "", x)) / 100,
-)
+        Args:
+            session (aiohttp.ClientSession | None): The session to use for the request.
+                                                    If None, a session is created for this request only.
 
+        Returns:
+            Tuple[str, float]: A tuple containing the URL and the extracted coffee price if successful.
 
-sites = (
-    koffiehenk,
-    coffeepoddeals,
-    deprijshamer,
-    dolce_gusto,
-    koffievoordeel,
-    jumbo,
-)
+        Raises:
+            PriceNotFoundException: If no price is found in the scraped content.
+        """
+        if session is None:
+            async with create_session() as session:
+                return await self(session)
+
+        start = perf_counter()
+        async with session.get(self.url, headers=self.request_headers()) as response:
+            logging.debug(f"{self.url} {response.status}:{response.reason}")
+            if (result := self.cached_result(response.status)) is not None:
+                return result
+            if response.status in self.unavailable:
+                response.raise_for_status()
+            text = await response.text()
+        metrics.observe("fetch_seconds", perf_counter() - start, url=self.url)
+        metrics.observe("downloaded_bytes", response.content.total_bytes, url=self.url)
+        with metrics.timer("parse_seconds", url=self.url):
+            result = self.extract_price(text)
+        if self.cache is not None:
+            self.cache.store(self.url, response.headers, result[1])
+        return result
@@ -7,10 +7,21 @@ This module provides a function to upload files to a remote server using the SFT
 with the help of the Paramiko library. The function reads necessary connection information
 from secret files and performs the upload operation.
 
+When several files are uploaded, an SFTPUploader is more efficient: it opens a single
+SSH session for all files and uploads them over parallel SFTP channels. It can keep the
+SHA-256 digest and size of every uploaded file in a local manifest, and skips files whose
+digest matches and whose remote copy still has the same size, so only changed files are
+transferred and nothing but the reports ends up on the server. Every file is written under
+a temporary name first and then renamed, so a reader never sees a partial file.
+
 Dependencies:
     - paramiko
     - .utils (from the same package)
 
+Classes:
+    SFTPUploader:
+        Uploads files over one SSH session, in parallel, skipping files that did not change.
+
 Functions:
     upload_file_via_sftp(
         hostfile: str,
@@ -24,10 +35,18 @@ Functions:
 
     Note: Ensure the necessary dependencies are installed before using this module.
 """
+import hashlib
 import logging
+import os
+import posixpath
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable
+
 import paramiko
 
-from .utils import get_secret, get_env
+from .utils import get_secret, get_env, load_json, dump_json
 
 
 def upload_file_via_sftp(
@@ -75,3 +94,188 @@ def upload_file_via_sftp(
     logging.info(
         f"File '{local_file_path}' uploaded to '{host}/{remote_file_path}' successfully"
     )
+
+
+class SFTPUploader:
+    """
+    Uploads files over one SSH session, in parallel, skipping files that did not change.
+
+    The connection details are read from the secret files once. The session is opened by
+    the first upload and should be closed when done, preferably by using the uploader as a context manager.
+    Nothing is uploaded if the DRYRUN environment variable is set.
+
+    Args:
+        hostfile (str): Path to the secret file containing the host information.
+        usernamefile (str): Path to the secret file containing the username.
+        passwordfile (str): Path to the secret file containing the password.
+        channels (int): The maximum number of files uploaded at the same time, each over its own SFTP channel.
+        manifest (str | None): The local file with the digest of every uploaded file, used to skip
+            files that did not change. None to upload every file.
+
+    Methods:
+        upload(self, local_file_path, remote_file_path) -> bool:
+            Upload a file, unless the remote copy has the same content.
+        upload_many(self, files) -> list[bool]:
+            Upload (local, remote) pairs of files in parallel.
+        close(self) -> None:
+            Close all channels and the session, and save the manifest.
+    """
+
+    def __init__(
+        self,
+        hostfile: str,
+        usernamefile: str,
+        passwordfile: str,
+        channels: int = 4,
+        manifest: str | None = None,
+    ) -> None:
+        self.host = get_secret(hostfile)
+        self._username = get_secret(usernamefile)
+        self._password = get_secret(passwordfile)
+        self.channels = channels
+        self.manifest = manifest
+        self.dryrun = get_env("DRYRUN") is not None
+        self._digests = load_json(manifest, {}) if manifest is not None else {}
+        self._changed = False
+        self._transport = None
+        self._clients = []
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _client(self) -> paramiko.SFTPClient:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._transport is None:
+                self._transport = paramiko.Transport((self.host, 22))
+                self._transport.connect(username=self._username, password=self._password)
+                logging.debug(f"sftp session to {self.host} opened")
+            client = paramiko.SFTPClient.from_transport(self._transport)
+            self._clients.append(client)
+        return client
+
+    def upload(self, local_file_path: str, remote_file_path: str) -> bool:
+        """
+        Upload a file, unless the remote copy has the same content.
+
+        The file is written to a hidden temporary file in the remote directory and then
+        renamed over the remote file. The temporary file is removed if the upload fails.
+
+        Args:
+            local_file_path (str): Path to the local file to be uploaded.
+            remote_file_path (str): Path where the file should be uploaded on the remote server.
+
+        Returns:
+            bool: True if the file was uploaded, False if it was skipped.
+        """
+        if self.dryrun:
+            logging.info(f"sftp upload of {local_file_path} skipped")
+            return False
+
+        remote_file_path = str(remote_file_path)
+        key = f"{self.host}:{remote_file_path}"
+        entry = None
+        if self.manifest is not None:
+            with open(local_file_path, "rb") as f:
+                entry = {"sha256": hashlib.file_digest(f, "sha256").hexdigest(), "size": os.fstat(f.fileno()).st_size}
+
+        client = self._client()
+        try:
+            if entry is not None and self._digests.get(key) == entry and self._remote_size(client, remote_file_path) == entry["size"]:
+                logging.info(f"File '{local_file_path}' unchanged on '{self.host}/{remote_file_path}', upload skipped")
+                self._idle.put(client)
+                return False
+
+            directory, name = posixpath.split(remote_file_path)
+            tmpfile = posixpath.join(directory, f".{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            try:
+                client.put(local_file_path, tmpfile)
+                self._rename(client, tmpfile, remote_file_path)
+            except BaseException:
+                try:
+                    client.remove(tmpfile)
+                except (IOError, OSError, paramiko.SSHException):
+                    pass
+                raise
+        except BaseException:
+            # the channel may be broken, the next upload opens a new one
+            self._discard(client)
+            raise
+        self._idle.put(client)
+
+        if entry is not None:
+            with self._lock:
+                self._digests[key] = entry
+                self._changed = True
+        logging.info(
+            f"File '{local_file_path}' uploaded to '{self.host}/{remote_file_path}' successfully"
+        )
+        return True
+
+    def _rename(self, client: paramiko.SFTPClient, tmpfile: str, remote_file_path: str) -> None:
+        try:
+            client.posix_rename(tmpfile, remote_file_path)
+        except IOError:
+            # servers without the posix-rename extension do not rename over an existing file,
+            # so the old file is removed first and the file is missing until the rename is done
+            logging.warning(f"posix-rename not supported by {self.host}, '{remote_file_path}' is replaced non atomically")
+            try:
+                client.remove(remote_file_path)
+            except IOError:
+                pass
+            client.rename(tmpfile, remote_file_path)
+
+    def _remote_size(self, client: paramiko.SFTPClient, remote_file_path: str) -> int | None:
+        try:
+            return client.stat(remote_file_path).st_size
+        except IOError:
+            return None
+
+    def _discard(self, client: paramiko.SFTPClient) -> None:
+        with self._lock:
+            if client in self._clients:
+                self._clients.remove(client)
+        try:
+            client.close()
+        except Exception as e:
+            logging.debug(f"closing a broken sftp channel failed {e}")
+
+    def upload_many(self, files: Iterable[tuple[str, str]]) -> list[bool]:
+        """
+        Upload (local, remote) pairs of files in parallel.
+
+        Args:
+            files (Iterable[tuple[str, str]]): Pairs of the local path and the remote path of every file.
+
+        Returns:
+            list[bool]: For every file True if it was uploaded, False if it was skipped.
+        """
+        files = list(files)
+        if not files:
+            return []
+        with ThreadPoolExecutor(max_workers=max(1, min(self.channels, len(files))), thread_name_prefix="sftp") as executor:
+            uploaded = list(executor.map(lambda pair: self.upload(*pair), files))
+        logging.info(f"{sum(uploaded)} of {len(files)} files uploaded to {self.host}")
+        return uploaded
+
+    def close(self) -> None:
+        with self._lock:
+            if self._changed:
+                dump_json(self.manifest, self._digests)
+                self._changed = False
+            for client in self._clients:
+                client.close()
+            self._clients = []
+            self._idle = queue.Queue()
+            if self._transport is not None:
+                self._transport.close()
+                self._transport = None
+                logging.debug(f"sftp session to {self.host} closed")
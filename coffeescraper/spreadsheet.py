@@ -1,13 +1,82 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import logging
+import re
+from urllib.parse import urlsplit
+
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+
+headers = ("id", "url", "price", "timestamp")
+widths = {"A": 10, "B": 60, "C": 10, "D": 20}
+
+
+def sheet_title(url, used):
+    """
+    Return a unique, valid worksheet title for the site at url.
+
+    Excel limits titles to 31 characters and does not allow some characters, so the host name is used.
+
+    Args:
+        url (str): The url of the site.
+        used (set[str]): The titles already in use, the new title is added to it.
+
+    Returns:
+        str: The title.
+    """
+    base = re.sub(r"[\\/*?:\[\]]", "_", urlsplit(url).netloc or url)[:28] or "site"
+    title, n = base, 1
+    while title.lower() in used:
+        n += 1
+        title = f"{base[:28 - len(str(n))]}({n})"
+    used.add(title.lower())
+    return title
+
+
+def write_sheet(data, filename="/tmp/coffeescraper.xlsx", per_site=False):
+    """
+    Write rows of id, url, price and timestamp to an Excel workbook.
+
+    The workbook is created in write-only mode, every row is written to disk as it
+    arrives from data, so memory use does not depend on the number of rows.
+    Each sheet gets a bold header row and the timestamps are formatted as dates.
+
+    Args:
+        data (Iterable[tuple[int, str, float, datetime]]): The rows, for example from PriceDatabase.get_prices().
+        filename (str): The name of the workbook file.
+        per_site (bool): Add a sheet per site besides the sheet with all prices.
+    """
+    wb = Workbook(write_only=True)
+    bold = Font(bold=True)
+
+    def new_sheet(title):
+        ws = wb.create_sheet(title)
+        for column, width in widths.items():
+            ws.column_dimensions[column].width = width
+        ws.freeze_panes = "A2"
+        header = []
+        for name in headers:
+            cell = WriteOnlyCell(ws, value=name)
+            cell.font = bold
+            header.append(cell)
+        ws.append(header)
+        return ws
 
+    def timestamp(ws, value):
+        cell = WriteOnlyCell(ws, value=value)
+        cell.number_format = "yyyy-mm-dd hh:mm:ss"
+        return cell
 
-def write_sheet(data, filename="/tmp/coffeescraper.xlsx"):
-    wb = Workbook()
-    ws = wb.active
+    ws = new_sheet("prices")
+    sites = {}
+    used = {"prices"}
     for row in data:
-        ws.append(row)
+        ws.append((row[0], row[1], row[2], timestamp(ws, row[3])))
+        if per_site:
+            if row[1] not in sites:
+                sites[row[1]] = new_sheet(sheet_title(row[1], used))
+            site = sites[row[1]]
+            site.append((row[0], row[1], row[2], timestamp(site, row[3])))
     wb.save(filename)
     logging.info(f"spreadsheet saved to {filename}")
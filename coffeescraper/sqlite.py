@@ -0,0 +1,408 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Module for storing coffee prices in an SQLite database.
+
+SQLite needs no server, which makes it a good fit for running the scraper on a single
+machine, or for development and tests. The schema is the same as the PostgreSQL schema
+of PriceDatabase, so both backends can be used interchangeably.
+
+Classes:
+    SQLitePriceDatabase:
+        A class for managing an SQLite database of coffee prices.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Generator, Iterable, Mapping
+from datetime import datetime, date
+
+from .database import BasePriceDatabase, DEFAULT_PRODUCT
+
+
+# timestamps and dates are stored as ISO 8601 text. They are converted here and not with
+# sqlite3.register_adapter() and register_converter(), which would change every sqlite3
+# connection in the process.
+def _iso(value:datetime|date|None) -> str|None:
+    return None if value is None else value.isoformat()
+
+
+def _datetime(value:str|None) -> datetime|None:
+    return None if value is None else datetime.fromisoformat(value)
+
+
+def _date(value:str|None) -> date|None:
+    return None if value is None else date.fromisoformat(value)
+
+
+class SQLitePriceDatabase(BasePriceDatabase):
+    """
+    A class for managing an SQLite database of coffee prices.
+
+    Every thread gets its own connection, which is opened on first use. The database
+    is opened in WAL mode, so readers don't block the writer.
+
+    Args:
+        filename (str): The path of the database file. It is created if it does not exist.
+
+    Attributes:
+        filename (str): The path of the database file.
+        table_created (bool): Flag indicating if the tables have been created.
+        identity (str): The absolute path of the database file.
+
+    Methods:
+        __init__(self, filename):
+            Initializes the SQLitePriceDatabase instance, no connection is made yet.
+        close(self) -> None:
+            Closes all connections.
+        cursor(self):
+            Context manager that yields a cursor and commits afterwards.
+        create_table(self) -> None:
+            Creates the tables and their indexes if they don't exist.
+        set_products(self, products) -> None:
+            Stores the product of each site.
+        get_sites(self) -> dict[str, str]:
+            Retrieves the product of each site.
+        max_id(self) -> int | None:
+            Retrieves the highest id in the 'url_price' table.
+        get_prices(self, itersize, since, until, urls, after_id, product) -> Generator[tuple[int, str, float, datetime], None, None]:
+            Streams rows from the 'url_price' table, optionally filtered, as a generator of tuples.
+        get_daily(self, since, until, per_site, product) -> Generator[tuple, None, None]:
+            Retrieves the daily rollup, either per site or over all sites.
+    """
+
+    def __init__(self, filename:str):
+        self.filename = filename
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._table_lock = threading.Lock()
+        self.table_created = False
+
+
+    @property
+    def identity(self) -> str:
+        return f"sqlite://{os.path.abspath(self.filename)}"
+
+
+    def close(self) -> None:
+        """
+        Close all connections.
+
+        The database can still be used afterwards, new connections are opened when needed.
+        """
+        with self._lock:
+            connections, self._connections = self._connections, []
+            self._local = threading.local()
+        for connection in connections:
+            connection.close()
+        logging.debug(f"sqlite database {self.filename} closed")
+
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.filename, timeout=30.0, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL;")
+            connection.execute("PRAGMA synchronous=NORMAL;")
+            connection.execute("PRAGMA foreign_keys=ON;")
+            with self._lock:
+                self._connections.append(connection)
+                self._local.connection = connection
+            logging.debug(f"sqlite database {self.filename} opened")
+        return connection
+
+
+    @contextmanager
+    def cursor(self):
+        """
+        Yield a cursor on the connection of the current thread.
+
+        The transaction is committed when the block exits, or rolled back on an exception.
+
+        Yields:
+            sqlite3.Cursor: The cursor.
+        """
+        connection = self._connection()
+        cursor = connection.cursor()
+        try:
+            yield cursor
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+
+    def create_table(self) -> None:
+        """
+        Create the tables 'site', 'url_price' and 'price_daily' and their indexes if they don't exist.
+
+        Sites stored before the 'product' column was added get DEFAULT_PRODUCT as their product.
+
+        Returns:
+            None
+        """
+
+        create_table_query = """
+            CREATE TABLE IF NOT EXISTS site (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL UNIQUE,
+                product TEXT NOT NULL DEFAULT {product}
+            );
+            CREATE TABLE IF NOT EXISTS url_price (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                site_id INTEGER REFERENCES site (id),
+                price FLOAT,
+                timestamp TIMESTAMP
+            );
+            CREATE INDEX IF NOT EXISTS url_price_site_timestamp ON url_price (site_id, timestamp);
+            CREATE INDEX IF NOT EXISTS url_price_timestamp ON url_price (timestamp);
+            CREATE INDEX IF NOT EXISTS site_product ON site (product);
+            CREATE TABLE IF NOT EXISTS price_daily (
+                day DATE NOT NULL,
+                site_id INTEGER NOT NULL REFERENCES site (id),
+                min_price FLOAT NOT NULL,
+                max_price FLOAT NOT NULL,
+                sum_price FLOAT NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (day, site_id)
+            );
+        """
+
+        with self._table_lock:
+            if self.table_created:
+                return
+            # sqlite does not allow parameters in a column default
+            product = "'" + DEFAULT_PRODUCT.replace("'", "''") + "'"
+            connection = self._connection()
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(site);")]
+            if columns and "product" not in columns:
+                connection.execute(f"ALTER TABLE site ADD COLUMN product TEXT NOT NULL DEFAULT {product};")
+            connection.executescript(create_table_query.format(product=product))
+            self.table_created = True
+            logging.info(f"new tables site, url_price and price_daily created if they did not exist")
+
+
+    def _insert_values(self, values:list[tuple[str,float,datetime]]) -> None:
+        daily = defaultdict(lambda: [float("inf"), float("-inf"), 0.0, 0])
+        for url, price, timestamp in values:
+            if price is None or timestamp is None:
+                continue
+            aggregate = daily[(timestamp.date(), url)]
+            aggregate[0] = min(aggregate[0], price)
+            aggregate[1] = max(aggregate[1], price)
+            aggregate[2] += price
+            aggregate[3] += 1
+
+        with self.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO site (url) VALUES (?) ON CONFLICT (url) DO NOTHING;",
+                [(url,) for url in {value[0] for value in values}],
+            )
+            cursor.executemany(
+                "INSERT INTO url_price (site_id, price, timestamp) SELECT id, ?, ? FROM site WHERE url = ?;",
+                [(price, _iso(timestamp), url) for url, price, timestamp in values],
+            )
+            cursor.executemany(
+                """
+                INSERT INTO price_daily (day, site_id, min_price, max_price, sum_price, count)
+                SELECT ?, id, ?, ?, ?, ? FROM site WHERE url = ?
+                ON CONFLICT (day, site_id) DO UPDATE SET
+                    min_price = MIN(min_price, excluded.min_price),
+                    max_price = MAX(max_price, excluded.max_price),
+                    sum_price = sum_price + excluded.sum_price,
+                    count = count + excluded.count;
+                """,
+                [(_iso(day), *aggregate, url) for (day, url), aggregate in daily.items()],
+            )
+
+
+    def set_products(self, products:Mapping[str,str]) -> None:
+        """
+        Store the product of each site, sites that are not in the database yet are added.
+
+        Args:
+            products (Mapping[str, str]): The product of each site, keyed by url.
+
+        Returns:
+            None
+        """
+
+        if not self.table_created: self.create_table()
+
+        with self.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO site (url, product) VALUES (?, ?) ON CONFLICT (url) DO UPDATE SET product = excluded.product;",
+                list(products.items()),
+            )
+
+
+    def get_sites(self) -> dict[str,str]:
+        """
+        Retrieve the product of each site.
+
+        Returns:
+            dict[str, str]: The product of each site, keyed by url.
+        """
+
+        if not self.table_created: self.create_table()
+
+        with self.cursor() as cursor:
+            cursor.execute("SELECT url, product FROM site ORDER BY url;")
+            return dict(cursor.fetchall())
+
+
+    def max_id(self) -> int|None:
+        """
+        Retrieve the highest id in the 'url_price' table.
+
+        Returns:
+            int | None: The highest id, or None if the table is empty.
+        """
+
+        if not self.table_created: self.create_table()
+
+        with self.cursor() as cursor:
+            cursor.execute("SELECT MAX(id) FROM url_price;")
+            return cursor.fetchone()[0]
+
+
+    def get_prices(self, itersize:int=2000, since:datetime|None=None, until:datetime|None=None, urls:Iterable[str]|None=None, after_id:int|None=None, product:str|None=None) -> Generator[tuple[int,str,float,datetime],None,None]:
+        """
+        Retrieve rows from the 'url_price' table as a generator of tuples, ordered by id.
+
+        The rows are fetched itersize rows at a time, so memory use does not depend on the size of the table.
+
+        Args:
+            itersize (int): The number of rows fetched at a time.
+            since (datetime | None): If given, only rows with a timestamp at or after since are returned.
+            until (datetime | None): If given, only rows with a timestamp before until are returned.
+            urls (Iterable[str] | None): If given, only rows for these urls are returned.
+            after_id (int | None): If given, only rows with an id greater than after_id are returned.
+            product (str | None): If given, only rows for sites selling this product are returned.
+
+        Yields:
+            tuple[int, str, float, datetime]: Generator yielding rows with id, url, price, and timestamp.
+
+        Returns:
+            Generator[tuple[int, str, float, datetime], None, None]
+        """
+
+        if not self.table_created: self.create_table()
+
+        conditions = []
+        params = []
+        if since is not None:
+            conditions.append("url_price.timestamp >= ?")
+            params.append(_iso(since))
+        if until is not None:
+            conditions.append("url_price.timestamp < ?")
+            params.append(_iso(until))
+        if urls is not None:
+            urls = list(urls)
+            conditions.append(f"site.url IN ({', '.join('?' * len(urls))})")
+            params.extend(urls)
+        if after_id is not None:
+            conditions.append("url_price.id > ?")
+            params.append(after_id)
+        if product is not None:
+            conditions.append("site.product = ?")
+            params.append(product)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        query = f"""
+            SELECT url_price.id, site.url, url_price.price, url_price.timestamp
+            FROM url_price
+            JOIN site ON site.id = url_price.site_id
+            {where}
+            ORDER BY url_price.id;
+        """
+        with self.cursor() as cursor:
+            cursor.arraysize = itersize
+            cursor.execute(query, params)
+            while rows := cursor.fetchmany():
+                for id, url, price, timestamp in rows:
+                    yield id, url, price, _datetime(timestamp)
+
+
+    def get_daily(self, since:date|None=None, until:date|None=None, per_site:bool=False, product:str|None=None) -> Generator[tuple,None,None]:
+        """
+        Retrieve the daily rollup, ordered by day.
+
+        Args:
+            since (date | None): If given, only days at or after since are returned.
+            until (date | None): If given, only days before until are returned.
+            per_site (bool): Return a row per site per day instead of a row per day.
+            product (str | None): If given, only sites selling this product are included.
+
+        Yields:
+            tuple[date, str, float, float, float, int]: If per_site is True, rows with day, url, minimum, maximum, average and count.
+            tuple[date, float, float, float, int, str]: Otherwise, rows with day, minimum, maximum, average, count and the url of the cheapest site.
+
+        Returns:
+            Generator[tuple, None, None]
+        """
+
+        if not self.table_created: self.create_table()
+
+        conditions = []
+        params = []
+        if since is not None:
+            conditions.append("d.day >= ?")
+            params.append(_iso(since))
+        if until is not None:
+            conditions.append("d.day < ?")
+            params.append(_iso(until))
+        if product is not None:
+            conditions.append("site.product = ?")
+            params.append(product)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        cheapest = "AND s.product = ?" if product is not None else ""
+        if per_site:
+            query = f"""
+                SELECT d.day, site.url, d.min_price, d.max_price, d.sum_price / d.count, d.count
+                FROM price_daily d
+                JOIN site ON site.id = d.site_id
+                {where}
+                ORDER BY d.day, site.url;
+            """
+        else:
+            query = f"""
+                SELECT d.day, MIN(d.min_price), MAX(d.max_price), SUM(d.sum_price) / SUM(d.count), SUM(d.count),
+                    (SELECT s.url FROM price_daily c
+                     JOIN site s ON s.id = c.site_id
+                     WHERE c.day = d.day {cheapest}
+                     ORDER BY c.min_price, s.url
+                     LIMIT 1)
+                FROM price_daily d
+                JOIN site ON site.id = d.site_id
+                {where}
+                GROUP BY d.day
+                ORDER BY d.day;
+            """
+            # the subquery comes first in the statement, so does its parameter
+            if product is not None:
+                params.insert(0, product)
+        with self.cursor() as cursor:
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+        for day, *columns in rows:
+            yield _date(day), *columns
+
+
+    def _difference(self, today:date, yesterday:date, product:str|None) -> float|None:
+        minimum = "SELECT MIN(d.min_price) FROM price_daily d JOIN site ON site.id = d.site_id WHERE d.day = ?"
+        if product is not None:
+            minimum += " AND site.product = ?"
+        query = f"SELECT ({minimum}) - ({minimum});"
+        params = (_iso(today), product, _iso(yesterday), product) if product is not None else (_iso(today), _iso(yesterday))
+        with self.cursor() as cursor:
+            cursor.execute(query, params)
+            return cursor.fetchone()[0]
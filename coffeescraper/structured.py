@@ -0,0 +1,221 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Module for extracting prices from the structured data in a page.
+
+Many shops describe their products with schema.org JSON-LD blocks, for search engines,
+or with OpenGraph style meta tags, for social media. Reading the price from there
+needs no site specific regular expression and no browser, and is robust against
+changes to the layout of the page.
+
+The page is processed incrementally, chunk by chunk, and only the parts that can
+contain structured data are parsed: the <head> with an HTML parser, and in the body
+only the <script type="application/ld+json"> blocks, which are found with a simple scan.
+Processing stops as soon as a price is found.
+
+Classes:
+    StructuredDataExtractor:
+        Incrementally extracts a price from JSON-LD blocks and meta tags.
+
+Functions:
+    offer_price(data) -> float | None:
+        Return the price of the first schema.org Offer in decoded JSON-LD data.
+    find_price(chunks) -> float | None:
+        Return the price in the structured data of a page that arrives in chunks.
+"""
+
+import json
+import logging
+import re
+from html.parser import HTMLParser
+from typing import Iterable
+
+meta_properties = {"product:price:amount", "og:price:amount"}
+offer_types = {"Offer", "AggregateOffer", "PriceSpecification", "UnitPriceSpecification"}
+
+body_start = re.compile(r"<body[\s>]|</head\s*>", re.IGNORECASE)
+ldjson_start = re.compile(r"""<script\b[^>]*\btype\s*=\s*["']?application/ld\+json["']?[^>]*>""", re.IGNORECASE)
+
+
+def _to_price(value) -> float | None:
+    if isinstance(value, bool):
+        return None
+    try:
+        price = float(value)
+    except (TypeError, ValueError):
+        return None
+    return price if price > 0 else None
+
+
+def offer_price(data, parent: str | None = None) -> float | None:
+    """
+    Return the price of the first schema.org Offer in decoded JSON-LD data.
+
+    Objects with an Offer like @type, or without a type below an offers or
+    priceSpecification key, are searched for a price or lowPrice.
+    A @graph, a list of items and nested products are searched depth first.
+
+    Args:
+        data: The decoded JSON-LD data.
+        parent (str | None): The key data was found under.
+
+    Returns:
+        float | None: The price, or None if no offer with a valid price is found.
+    """
+    if isinstance(data, list):
+        for item in data:
+            if (price := offer_price(item, parent)) is not None:
+                return price
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    types = data.get("@type", [])
+    types = {types} if isinstance(types, str) else set(types) if isinstance(types, list) else set()
+    if types & offer_types or (not types and parent in ("offers", "priceSpecification")):
+        for key in ("price", "lowPrice"):
+            if (price := _to_price(data.get(key))) is not None:
+                return price
+
+    for key, value in data.items():
+        if isinstance(value, (dict, list)) and (price := offer_price(value, key)) is not None:
+            return price
+    return None
+
+
+class _HeadParser(HTMLParser):
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.meta_price = None
+        self.ldjson_price = None
+        self._script = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "meta" and self.meta_price is None:
+            if attrs.get("property") in meta_properties or attrs.get("name") in meta_properties or attrs.get("itemprop") == "price":
+                self.meta_price = _to_price(attrs.get("content"))
+        elif tag == "script" and (attrs.get("type") or "").lower() == "application/ld+json":
+            self._script = []
+
+    def handle_data(self, data):
+        if self._script is not None:
+            self._script.append(data)
+
+    def handle_endtag(self, tag):
+        if tag == "script" and self._script is not None:
+            if self.ldjson_price is None:
+                self.ldjson_price = _decode(''.join(self._script))
+            self._script = None
+
+
+def _decode(text: str) -> float | None:
+    try:
+        return offer_price(json.loads(text))
+    except ValueError as e:
+        logging.debug(f"invalid JSON-LD block ignored {e}")
+        return None
+
+
+class StructuredDataExtractor:
+    """
+    Incrementally extracts a price from JSON-LD blocks and meta tags.
+
+    Feed the chunks of a page one by one until feed() returns True, then read price.
+    A price from a JSON-LD block is preferred. A price from a meta tag is only used if
+    there is no JSON-LD price in the <head>, but then the body is not searched.
+
+    Attributes:
+        price (float | None): The price found so far.
+        max_script (int): The maximum number of characters of a JSON-LD block in the body.
+
+    Methods:
+        feed(self, chunk: str) -> bool:
+            Process the next chunk, return True when no more chunks are needed.
+        close(self) -> float | None:
+            Process any remaining text and return the price.
+    """
+
+    overlap = 512
+    max_script = 1000000
+
+    def __init__(self) -> None:
+        self.price = None
+        self._head = _HeadParser()
+        self._pending = ""
+        self._in_body = False
+        self._script = None
+
+    def feed(self, chunk: str) -> bool:
+        if self.price is not None:
+            return True
+        if not self._in_body:
+            self._pending += chunk
+            if match := body_start.search(self._pending):
+                self._head.feed(self._pending[: match.start()])
+                self._head.close()
+                chunk = self._pending[match.start() :]
+                self._pending = ""
+                self._in_body = True
+                self.price = self._head.ldjson_price or self._head.meta_price
+                if self.price is not None:
+                    return True
+            else:
+                # keep a tail that may hold the start of a <body tag
+                self._head.feed(self._pending[: -7])
+                self._pending = self._pending[-7:]
+                if self._head.ldjson_price is not None:
+                    self.price = self._head.ldjson_price
+                    return True
+                return False
+        return self._scan_body(chunk)
+
+    def _scan_body(self, chunk: str) -> bool:
+        self._pending += chunk
+        while True:
+            if self._script is None:
+                match = ldjson_start.search(self._pending)
+                if match is None:
+                    self._pending = self._pending[-self.overlap :]
+                    return False
+                self._pending = self._pending[match.end() :]
+                self._script = 0
+            end = self._pending.find("</script", self._script)
+            if end < 0:
+                if len(self._pending) > self.max_script:
+                    logging.debug("JSON-LD block too large, ignored")
+                    self._pending, self._script = "", None
+                    return False
+                # a partial end tag may be split over chunks, continue searching a few characters back
+                self._script = max(0, len(self._pending) - 8)
+                return False
+            self.price = _decode(self._pending[:end])
+            self._pending, self._script = self._pending[end:], None
+            if self.price is not None:
+                return True
+
+    def close(self) -> float | None:
+        if self.price is None and not self._in_body:
+            self._head.feed(self._pending)
+            self._head.close()
+            self.price = self._head.ldjson_price or self._head.meta_price
+        return self.price
+
+
+def find_price(chunks: Iterable[str]) -> float | None:
+    """
+    Return the price in the structured data of a page that arrives in chunks.
+
+    Chunks are consumed only until a price is found.
+
+    Args:
+        chunks (Iterable[str]): The content of the page in consecutive chunks.
+
+    Returns:
+        float | None: The price, or None if the page has no structured price.
+    """
+    extractor = StructuredDataExtractor()
+    for chunk in chunks:
+        if extractor.feed(chunk):
+            return extractor.price
+    return extractor.close()
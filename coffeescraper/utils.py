@@ -1,11 +1,16 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 """
-This module provides utility functions for retrieving environment variables and secrets.
+This module provides utility functions for retrieving environment variables and secrets,
+and for keeping state in files.
 
 These functions assist in accessing environment variables and secret files, providing default
 values or handling missing values appropriately.
 
+State files are replaced atomically through a uniquely named temporary file in the same
+directory, so an interrupted run never leaves a truncated file behind and two runs at the
+same time never write into each other's temporary file.
+
 Functions:
     get_env(name, default=None) -> str|list|None:
         Retrieve the value of an environment variable.
@@ -13,10 +18,20 @@ Functions:
         Retrieve the content of a secret file.
     get_secret_file(filename) -> str:
         Retrieve the content of a secret file as a single string.
+    write_atomic(filename, text) -> None:
+        Atomically replace a file with text or bytes.
+    load_json(filename, default=None) -> Any:
+        Return the content of a JSON file, or default if it is missing or corrupt.
+    dump_json(filename, data) -> None:
+        Atomically replace a file with data serialized to JSON.
 
 """
 
+import json
+import logging
 import os
+import tempfile
+from typing import Any
 
 def get_env(name:str, default=None) -> str|list[str]|None:
     """
@@ -75,4 +90,69 @@ def get_secret_file(filename: str) -> str|None:
         with open(filename) as f:
             return "".join(f.readlines())
     except FileNotFoundError:
-        return None
\ No newline at end of file
+        return None
+
+
+def write_atomic(filename:str, text:str|bytes) -> None:
+    """
+    Atomically replace a file with text or bytes.
+
+    The text is written to a uniquely named temporary file in the same directory, which then
+    replaces the file. The file keeps its permissions, a new file gets mode 0644.
+
+    Args:
+        filename (str): The path of the file.
+        text (str | bytes): The new content of the file, bytes are written as they are.
+    """
+
+    filename = os.fspath(filename)
+    try:
+        mode = os.stat(filename).st_mode & 0o777
+    except FileNotFoundError:
+        mode = 0o644
+    directory, name = os.path.split(filename)
+    f = tempfile.NamedTemporaryFile("wb" if isinstance(text, bytes) else "w", dir=directory or ".", prefix=f".{name}.", suffix=".tmp", delete=False)
+    try:
+        with f:
+            f.write(text)
+        os.chmod(f.name, mode)
+        os.replace(f.name, filename)
+    except BaseException:
+        os.remove(f.name)
+        raise
+
+
+def load_json(filename:str, default=None) -> Any:
+    """
+    Return the content of a JSON file.
+
+    A corrupt file is logged as a warning and treated like a missing file.
+
+    Args:
+        filename (str): The path of the file.
+        default: The value to return if the file does not exist or is corrupt.
+
+    Returns:
+        Any: The deserialized content of the file, or default.
+    """
+
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+    except ValueError:
+        logging.warning(f"{filename} is corrupt, ignoring it")
+        return default
+
+
+def dump_json(filename:str, data) -> None:
+    """
+    Atomically replace a file with data serialized to JSON.
+
+    Args:
+        filename (str): The path of the file.
+        data: The data to serialize.
+    """
+
+    write_atomic(filename, json.dumps(data))
@@ -0,0 +1,73 @@
+import pytest
+from unittest.mock import patch, MagicMock, PropertyMock
+
+from selenium.common.exceptions import WebDriverException, NoSuchElementException
+from selenium.webdriver.common.by import By
+
+from coffeescraper.browser import BrowserPool
+from coffeescraper.scraper import ChromiumCoffeeScraper, PricePattern, PriceNotFoundException
+
+
+class TestBrowserPool:
+    @patch("selenium.webdriver.Chrome")
+    def test_reuse(self, mockchrome):
+        with BrowserPool(size=2) as pool:
+            with pool.driver() as driver1:
+                pass
+            with pool.driver() as driver2:
+                pass
+            assert driver1 is driver2
+            mockchrome.assert_called_once()
+        driver1.quit.assert_called_once()
+
+    @patch("selenium.webdriver.Chrome")
+    def test_size(self, mockchrome):
+        mockchrome.side_effect = lambda **kwargs: MagicMock()
+        pool = BrowserPool(size=1)
+        with pool.driver():
+            with pytest.raises(TimeoutError):
+                with pool.driver(timeout=0.1):
+                    pass
+        pool.close()
+
+    @patch("selenium.webdriver.Chrome")
+    def test_recycle(self, mockchrome):
+        mockchrome.side_effect = lambda **kwargs: MagicMock()
+        with BrowserPool(size=1) as pool:
+            with pool.driver() as driver1:
+                type(driver1).current_url = PropertyMock(side_effect=WebDriverException("crashed"))
+            with pool.driver() as driver2:
+                pass
+            assert driver1 is not driver2
+            driver1.quit.assert_called_once()
+            assert mockchrome.call_count == 2
+
+    @patch("selenium.webdriver.Chrome")
+    def test_closed(self, mockchrome):
+        pool = BrowserPool()
+        pool.close()
+        with pytest.raises(RuntimeError):
+            with pool.driver():
+                pass
+        mockchrome.assert_not_called()
+
+
+class TestPooledChromiumCoffeeScraper:
+    @patch("selenium.webdriver.Chrome")
+    def test_pool(self, mockchrome):
+        mockchrome.return_value.find_element.return_value.text = "3.66"
+        with BrowserPool() as pool:
+            cd = ChromiumCoffeeScraper("http://webserver", PricePattern(By.CLASS_NAME, "price"), pool=pool)
+            assert cd() == ("http://webserver", 3.66)
+            assert cd() == ("http://webserver", 3.66)
+            mockchrome.assert_called_once()
+            mockchrome.return_value.quit.assert_not_called()
+        mockchrome.return_value.quit.assert_called_once()
+
+    @patch("selenium.webdriver.Chrome")
+    def test_no_leak(self, mockchrome):
+        mockchrome.return_value.find_element.side_effect = NoSuchElementException("no such element")
+        cd = ChromiumCoffeeScraper("http://webserver", PricePattern(By.CLASS_NAME, "price"))
+        with pytest.raises(PriceNotFoundException):
+            cd()
+        mockchrome.return_value.quit.assert_called_once()
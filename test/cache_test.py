@@ -0,0 +1,76 @@
+from unittest.mock import patch, MagicMock
+import pathlib
+
+from coffeescraper.cache import HttpCache
+from coffeescraper.scraper import CoffeeScraper
+
+p = pathlib.Path("/tmp/httpcache.json")
+url = "http://webserver"
+pattern = r'<span\s+class="price">(?P<price>.*)</span>'
+
+
+def response(status_code, text="", headers={}):
+    r = MagicMock()
+    r.status_code = status_code
+    r.text = text
+    r.headers = headers
+    r.__enter__.return_value = r
+    return r
+
+
+class TestHttpCache:
+    def test_store_save_load(self):
+        p.unlink(missing_ok=True)
+        with HttpCache(p) as cache:
+            assert cache.conditional_headers(url) == {}
+            assert cache.price(url) is None
+            cache.store(url, {"ETag": '"abc"', "Last-Modified": "Tue, 15 Aug 2023 08:00:00 GMT"}, 3.66)
+        assert p.exists()
+
+        cache = HttpCache(p)
+        assert len(cache) == 1
+        assert cache.price(url) == 3.66
+        assert cache.conditional_headers(url) == {
+            "If-None-Match": '"abc"',
+            "If-Modified-Since": "Tue, 15 Aug 2023 08:00:00 GMT",
+        }
+
+    def test_no_validators(self):
+        p.unlink(missing_ok=True)
+        cache = HttpCache(p)
+        cache.store(url, {"ETag": '"abc"'}, 3.66)
+        cache.store(url, {}, 3.66)
+        assert cache.price(url) is None
+        assert cache.conditional_headers(url) == {}
+
+    def test_corrupt(self):
+        with open(p, "w") as file:
+            file.write("oink")
+        assert len(HttpCache(p)) == 0
+
+
+class TestCachedCoffeeScraper:
+    @patch("requests.get")
+    def test_not_modified(self, mockget):
+        p.unlink(missing_ok=True)
+        cache = HttpCache(p)
+        cd = CoffeeScraper(url, pattern, cache=cache)
+
+        mockget.return_value = response(200, '<span class="price">3.66</span>', {"ETag": '"abc"'})
+        assert cd() == (url, 3.66)
+        assert "If-None-Match" not in mockget.call_args.kwargs["headers"]
+
+        mockget.return_value = response(304)
+        assert cd() == (url, 3.66)
+        assert mockget.call_args.kwargs["headers"]["If-None-Match"] == '"abc"'
+
+    @patch("requests.get")
+    def test_modified(self, mockget):
+        p.unlink(missing_ok=True)
+        cache = HttpCache(p)
+        cache.store(url, {"ETag": '"abc"'}, 3.66)
+        cd = CoffeeScraper(url, pattern, cache=cache)
+
+        mockget.return_value = response(200, '<span class="price">3.21</span>', {"ETag": '"def"'})
+        assert cd() == (url, 3.21)
+        assert cache.conditional_headers(url) == {"If-None-Match": '"def"'}
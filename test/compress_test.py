@@ -0,0 +1,37 @@
+import gzip
+import pathlib
+
+import brotli
+import pytest
+
+from coffeescraper.compress import precompress
+
+p = pathlib.Path("/tmp/coffeescraper-compress.html")
+
+
+class TestPrecompress:
+    def test_gzip(self):
+        p.write_text("<html>" + "koffie " * 1000 + "</html>")
+        assert precompress(p) == [f"{p}.gz"]
+        compressed = pathlib.Path(f"{p}.gz").read_bytes()
+        assert gzip.decompress(compressed) == p.read_bytes()
+        assert len(compressed) < p.stat().st_size / 10
+
+    def test_deterministic(self):
+        p.write_text("<html>prijzen</html>")
+        precompress(p)
+        first = pathlib.Path(f"{p}.gz").read_bytes()
+        precompress(p)
+        assert pathlib.Path(f"{p}.gz").read_bytes() == first
+
+    def test_brotli(self):
+        p.write_text("<html>" + "koffie " * 1000 + "</html>")
+        assert precompress(p, ["gz", "br"]) == [f"{p}.gz", f"{p}.br"]
+        assert brotli.decompress(pathlib.Path(f"{p}.br").read_bytes()) == p.read_bytes()
+
+    def test_nothing(self):
+        assert precompress(p, []) == []
+
+    def test_unknown(self):
+        with pytest.raises(ValueError):
+            precompress(p, ["zip"])
@@ -1,27 +1,38 @@
 import pytest
 from pytest_mock import MockerFixture
+from unittest.mock import patch, MagicMock
 
-from datetime import datetime
+from datetime import datetime, date
+import sqlite3
 import psycopg2
 
-from coffeescraper.database import PriceDatabase
+from coffeescraper.database import BasePriceDatabase, PriceDatabase, open_database, DEFAULT_PRODUCT
+from coffeescraper.sqlite import SQLitePriceDatabase
 
 
-def clean_table(conn):
-    clean_table_query = "DELETE FROM url_price;"
-    with conn.cursor() as cursor:
-        cursor.execute(clean_table_query)
-        conn.commit()
+@pytest.fixture(params=["postgres", "sqlite"])
+def db(request, tmp_path):
+    if request.param == "postgres":
+        database = PriceDatabase()
+    else:
+        database = SQLitePriceDatabase(str(tmp_path / "prices.db"))
+    yield database
+    database.close()
+
+
+def clean_table(db):
+    db.create_table()
+    with db.cursor() as cursor:
+        cursor.execute("DELETE FROM url_price;")
+        cursor.execute("DELETE FROM price_daily;")
 
 
 class TestDatabase:
-    def test_basic(self):
-        db = PriceDatabase()
+    def test_basic(self, db):
         assert db is not None
 
-    def test_insert_retrieve(self, mocker: MockerFixture):
-        db = PriceDatabase()
-        clean_table(db.connection)
+    def test_insert_retrieve(self, db, mocker: MockerFixture):
+        clean_table(db)
 
         mocker.patch("coffeescraper.database.now", return_value=datetime(2011, 8, 8))
 
@@ -35,9 +46,134 @@ class TestDatabase:
             assert type(row[3]) == datetime
         assert seen
 
-    def test_difference(self, mocker: MockerFixture):
-        db = PriceDatabase()
-        clean_table(db.connection)
+    def test_insert_rows(self, db, mocker: MockerFixture):
+        clean_table(db)
+
+        mocker.patch("coffeescraper.database.now", return_value=datetime(2011, 8, 8))
+
+        n = db.insert_rows([("url1", 100.0), ("url2", 90.0, datetime(2011, 8, 7))])
+        assert n == 2
+        assert db.insert_rows([]) == 0
+        rows = sorted(db.get_prices(), key=lambda row: row[1])
+        assert [row[1:] for row in rows] == [
+            ("url1", 100.0, datetime(2011, 8, 8)),
+            ("url2", 90.0, datetime(2011, 8, 7)),
+        ]
+
+    def test_max_id(self, db):
+        clean_table(db)
+        assert db.max_id() is None
+        db.insert_rows([("url1", 100.0), ("url2", 90.0)])
+        assert db.max_id() == max(row[0] for row in db.get_prices())
+        assert db.identity.split("://")[0] in ("postgres", "sqlite")
+
+    def test_get_prices_filtered(self, db, mocker: MockerFixture):
+        clean_table(db)
+
+        db.insert_rows([
+            ("url1", 100.0, datetime(2011, 8, 7)),
+            ("url2", 90.0, datetime(2011, 8, 8)),
+            ("url1", 95.0, datetime(2011, 8, 9)),
+        ])
+        rows = list(db.get_prices(itersize=1))
+        assert len(rows) == 3
+        assert [row[0] for row in rows] == sorted(row[0] for row in rows)
+
+        rows = list(db.get_prices(since=datetime(2011, 8, 8)))
+        assert [row[2] for row in rows] == [90.0, 95.0]
+        rows = list(db.get_prices(until=datetime(2011, 8, 8)))
+        assert [row[2] for row in rows] == [100.0]
+        rows = list(db.get_prices(urls=["url1"]))
+        assert [row[2] for row in rows] == [100.0, 95.0]
+        rows = list(db.get_prices(since=datetime(2011, 8, 8), urls=["url1"]))
+        assert [row[2] for row in rows] == [95.0]
+        first = min(row[0] for row in db.get_prices())
+        rows = list(db.get_prices(after_id=first))
+        assert [row[2] for row in rows] == [90.0, 95.0]
+
+    def test_upgrade(self, db):
+        if not isinstance(db, PriceDatabase):
+            pytest.skip("only the postgres schema has an older version")
+        with db.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS price_daily; DROP TABLE IF EXISTS url_price; DROP TABLE IF EXISTS site;")
+            cursor.execute("CREATE TABLE url_price (id SERIAL PRIMARY KEY, url TEXT, price FLOAT, timestamp TIMESTAMP);")
+            cursor.execute(
+                "INSERT INTO url_price (url, price, timestamp) VALUES (%s, %s, %s), (%s, %s, %s);",
+                ("url1", 100.0, datetime(2011, 8, 8), "url2", 90.0, datetime(2011, 8, 8)),
+            )
+
+        db.insert_rows([("url1", 95.0, datetime(2011, 8, 9))])
+        rows = list(db.get_prices())
+        assert [row[1:] for row in rows] == [
+            ("url1", 100.0, datetime(2011, 8, 8)),
+            ("url2", 90.0, datetime(2011, 8, 8)),
+            ("url1", 95.0, datetime(2011, 8, 9)),
+        ]
+        assert list(db.get_daily()) == [
+            (date(2011, 8, 8), 90.0, 100.0, 95.0, 2, "url2"),
+            (date(2011, 8, 9), 95.0, 95.0, 95.0, 1, "url1"),
+        ]
+
+    def test_daily(self, db):
+        clean_table(db)
+
+        db.insert_rows([
+            ("url1", 100.0, datetime(2011, 8, 8, 6)),
+            ("url2", 90.0, datetime(2011, 8, 8, 7)),
+        ])
+        db.insert_rows([
+            ("url1", 80.0, datetime(2011, 8, 8, 18)),
+            ("url1", 95.0, datetime(2011, 8, 9, 6)),
+        ])
+        assert list(db.get_daily(per_site=True)) == [
+            (date(2011, 8, 8), "url1", 80.0, 100.0, 90.0, 2),
+            (date(2011, 8, 8), "url2", 90.0, 90.0, 90.0, 1),
+            (date(2011, 8, 9), "url1", 95.0, 95.0, 95.0, 1),
+        ]
+        assert list(db.get_daily()) == [
+            (date(2011, 8, 8), 80.0, 100.0, 90.0, 3, "url1"),
+            (date(2011, 8, 9), 95.0, 95.0, 95.0, 1, "url1"),
+        ]
+        assert list(db.get_daily(since=date(2011, 8, 9))) == [
+            (date(2011, 8, 9), 95.0, 95.0, 95.0, 1, "url1"),
+        ]
+        assert list(db.get_daily(until=date(2011, 8, 9))) == [
+            (date(2011, 8, 8), 80.0, 100.0, 90.0, 3, "url1"),
+        ]
+
+    def test_products(self, db):
+        clean_table(db)
+
+        db.set_products({"url1": "lungo", "url2": "espresso", "url3": "lungo"})
+        db.insert_rows([
+            ("url1", 100.0, datetime(2011, 8, 8)),
+            ("url2", 50.0, datetime(2011, 8, 8)),
+            ("url3", 90.0, datetime(2011, 8, 8)),
+            ("url4", 80.0, datetime(2011, 8, 8)),
+        ])
+        sites = db.get_sites()
+        assert {url: sites[url] for url in ("url1", "url2", "url3")} == {"url1": "lungo", "url2": "espresso", "url3": "lungo"}
+        assert sites["url4"] == DEFAULT_PRODUCT
+        assert [row[1] for row in db.get_prices(product="lungo")] == ["url1", "url3"]
+        assert list(db.get_daily(product="lungo")) == [(date(2011, 8, 8), 90.0, 100.0, 95.0, 2, "url3")]
+        assert list(db.get_daily(product="espresso", per_site=True)) == [(date(2011, 8, 8), "url2", 50.0, 50.0, 50.0, 1)]
+
+        db.set_products({"url3": "espresso"})
+        assert list(db.get_daily(product="espresso")) == [(date(2011, 8, 8), 50.0, 90.0, 70.0, 2, "url2")]
+
+    def test_difference_product(self, db, mocker: MockerFixture):
+        clean_table(db)
+
+        db.set_products({"url1": "lungo", "url2": "espresso"})
+        db.insert_rows([("url1", 100.0, datetime(2011, 8, 8)), ("url2", 50.0, datetime(2011, 8, 8))])
+        db.insert_rows([("url1", 90.0, datetime(2011, 8, 9)), ("url2", 55.0, datetime(2011, 8, 9))])
+        mocker.patch("coffeescraper.database.now", return_value=datetime(2011, 8, 9))
+        assert db.get_difference("lungo") == -10.0
+        assert db.get_difference("espresso") == 5.0
+        assert db.get_difference() == 5.0
+
+    def test_difference(self, db, mocker: MockerFixture):
+        clean_table(db)
 
         mocker.patch("coffeescraper.database.now", return_value=datetime(2011, 8, 8))
         db.insert_tuple_into_table("myurl", 100.0)
@@ -48,9 +184,8 @@ class TestDatabase:
         assert result == -10.0
 
     
-    def test_difference_missing(self, mocker: MockerFixture):
-        db = PriceDatabase()
-        clean_table(db.connection)
+    def test_difference_missing(self, db, mocker: MockerFixture):
+        clean_table(db)
 
         mocker.patch("coffeescraper.database.now", return_value=datetime(2011, 8, 8))
         db.insert_tuple_into_table("myurl", 100.0)
@@ -58,3 +193,128 @@ class TestDatabase:
         assert type(result) == float
         assert result == 0.0
 
+
+class TestSQLitePriceDatabase:
+    def test_upgrade(self, tmp_path):
+        filename = str(tmp_path / "prices.db")
+        connection = sqlite3.connect(filename)
+        connection.execute("CREATE TABLE site (id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT NOT NULL UNIQUE);")
+        connection.execute("INSERT INTO site (url) VALUES ('url1');")
+        connection.commit()
+        connection.close()
+
+        with SQLitePriceDatabase(filename) as db:
+            assert db.get_sites() == {"url1": DEFAULT_PRODUCT}
+
+    def test_no_global_adapters(self, tmp_path):
+        with SQLitePriceDatabase(str(tmp_path / "prices.db")) as db:
+            db.insert_rows([("url1", 7.21, datetime(2021, 8, 8, 12))])
+            assert list(db.get_prices()) == [(1, "url1", 7.21, datetime(2021, 8, 8, 12))]
+            assert list(db.get_daily(since=date(2021, 8, 8), per_site=True))[0][:2] == (date(2021, 8, 8), "url1")
+        # other sqlite3 users in the process are not affected
+        adapters = [sqlite3.adapters.get((type, sqlite3.PrepareProtocol)) for type in (datetime, date)]
+        converters = [sqlite3.converters.get(name) for name in ("TIMESTAMP", "DATE")]
+        assert all(function is None or function.__module__ == "sqlite3.dbapi2" for function in adapters + converters)
+
+    def test_incomplete_backend(self):
+        class IncompleteDatabase(BasePriceDatabase):
+            def close(self):
+                pass
+
+        with pytest.raises(TypeError, match="abstract"):
+            IncompleteDatabase()
+
+
+class TestOpenDatabase:
+    def test_default(self, monkeypatch):
+        monkeypatch.delenv("DATABASE", raising=False)
+        assert type(open_database()) == PriceDatabase
+
+    def test_sqlite(self, monkeypatch, tmp_path):
+        monkeypatch.setenv("DATABASE", "sqlite")
+        monkeypatch.setenv("SQLITEDB", str(tmp_path / "prices.db"))
+        with open_database() as db:
+            assert type(db) == SQLitePriceDatabase
+            assert db.filename == str(tmp_path / "prices.db")
+
+    def test_invalid(self, monkeypatch):
+        monkeypatch.setenv("DATABASE", "oracle")
+        with pytest.raises(ValueError):
+            open_database()
+
+
+def mock_connection(result):
+    connection = MagicMock()
+    connection.closed = 0
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.fetchone.return_value = (result,)
+    return connection
+
+
+class TestDatabasePool:
+    @patch("psycopg2.connect")
+    def test_lazy(self, mockconnect):
+        with PriceDatabase(password="postgres") as db:
+            mockconnect.assert_not_called()
+            db.table_created = True
+            mockconnect.return_value = mock_connection(-1.0)
+            assert db.get_difference() == -1.0
+            assert db.get_difference() == -1.0
+            mockconnect.assert_called_once()
+        mockconnect.return_value.close.assert_called_once()
+
+    @patch("psycopg2.connect")
+    def test_retry(self, mockconnect):
+        mockconnect.side_effect = [psycopg2.OperationalError("database is restarting"), mock_connection(-1.0)]
+        db = PriceDatabase(password="postgres", retry_delay=0.0)
+        db.table_created = True
+        assert db.get_difference() == -1.0
+        assert mockconnect.call_count == 2
+
+    @patch("psycopg2.connect")
+    def test_reconnect(self, mockconnect):
+        broken = mock_connection(-1.0)
+        broken.cursor.return_value.__enter__.return_value.execute.side_effect = psycopg2.OperationalError("server closed the connection unexpectedly")
+        mockconnect.side_effect = [broken, mock_connection(-2.0)]
+        db = PriceDatabase(password="postgres", retry_delay=0.0)
+        db.table_created = True
+        assert db.get_difference() == -2.0
+        broken.close.assert_called_once()
+
+    @patch("psycopg2.connect")
+    def test_give_up(self, mockconnect):
+        mockconnect.side_effect = psycopg2.OperationalError("no database")
+        db = PriceDatabase(password="postgres", retries=2, retry_delay=0.0)
+        db.table_created = True
+        with pytest.raises(psycopg2.OperationalError):
+            db.get_difference()
+        assert mockconnect.call_count == 3
+
+    @patch("coffeescraper.database.execute_values")
+    @patch("psycopg2.connect")
+    def test_insert_sites_first(self, mockconnect, mockexecute):
+        mockconnect.return_value = mock_connection(None)
+        db = PriceDatabase(password="postgres")
+        db.table_created = True
+        timestamp = datetime(2021, 8, 8)
+        assert db.insert_rows([("url2", 7.31, timestamp), ("url1", 7.21, timestamp), ("url2", 7.11, timestamp)]) == 3
+        (_, sites, urls), (_, prices, values) = [c.args for c in mockexecute.call_args_list]
+        # the sites are added in a statement of their own, so the prices see sites added concurrently
+        assert "INSERT INTO site" in sites and "DO NOTHING" in sites and "DO UPDATE" not in sites
+        assert urls == [("url1",), ("url2",)]
+        assert "INSERT INTO site" not in prices and "JOIN site ON site.url = v.url" in prices
+        assert values == [("url2", 7.31, timestamp), ("url1", 7.21, timestamp), ("url2", 7.11, timestamp)]
+        mockconnect.return_value.commit.assert_called_once()
+
+    @patch("psycopg2.connect")
+    def test_health_check(self, mockconnect):
+        stale = mock_connection(-1.0)
+        mockconnect.side_effect = [stale, mock_connection(-2.0)]
+        db = PriceDatabase(password="postgres", retry_delay=0.0)
+        db.table_created = True
+        assert db.get_difference() == -1.0
+        stale.cursor.return_value.__enter__.return_value.execute.side_effect = psycopg2.OperationalError("server closed the connection unexpectedly")
+        db.health_check_interval = 0.0
+        assert db.get_difference() == -2.0
+        stale.close.assert_called_once()
+        assert mockconnect.call_count == 2
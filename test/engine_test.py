@@ -0,0 +1,142 @@
+import asyncio
+import subprocess
+import sys
+import threading
+from time import sleep, monotonic
+
+from coffeescraper.engine import scrape_all, scrape_all_async
+from coffeescraper.scraper import PriceNotFoundException
+
+
+class FakeScraper:
+    def __init__(self, url, price=None, delay=0.0, exception=None):
+        self.url = url
+        self.price = price
+        self.delay = delay
+        self.exception = exception
+
+    def __call__(self):
+        sleep(self.delay)
+        if self.exception is not None:
+            raise self.exception
+        return self.url, self.price
+
+
+class FakeAsyncScraper(FakeScraper):
+    async def __call__(self, session):
+        assert session is not None
+        await asyncio.sleep(self.delay)
+        if self.exception is not None:
+            raise self.exception
+        return self.url, self.price
+
+
+class TestEngine:
+    def test_basic(self):
+        sites = [FakeScraper("url1", 7.21), FakeScraper("url2", 7.31)]
+        report = scrape_all(sites)
+        assert report.results == [("url1", 7.21), ("url2", 7.31)]
+        assert report.cheapest == ("url1", 7.21)
+        assert len(report) == 2
+
+    def test_cheapest_per_product(self):
+        sites = [FakeScraper("url1", 7.21), FakeScraper("url2", 7.11), FakeScraper("url3", 4.31)]
+        report = scrape_all(sites)
+        products = {"url1": "lungo", "url2": "lungo", "url3": "espresso"}
+        assert report.cheapest_per_product(products) == {"lungo": ("url2", 7.11), "espresso": ("url3", 4.31)}
+
+    def test_concurrent(self):
+        sites = [FakeScraper(f"url{i}", float(i), delay=0.2) for i in range(10)]
+        start = monotonic()
+        report = scrape_all(sites, max_workers=10)
+        assert monotonic() - start < 1.0
+        assert len(report.results) == 10
+        assert [result[0] for result in report.results] == [site.url for site in sites]
+
+    def test_failures(self):
+        sites = [
+            FakeScraper("url1", 7.21),
+            FakeScraper("url2", exception=PriceNotFoundException("no price")),
+            FakeScraper("url3", exception=ValueError("oops")),
+        ]
+        report = scrape_all(sites)
+        assert report.results == [("url1", 7.21)]
+        assert list(report.not_found) == ["url2"]
+        assert list(report.errors) == ["url3"]
+        assert len(report) == 3
+
+    def test_timeout(self):
+        sites = [FakeScraper("url1", 7.21), FakeScraper("url2", 6.0, delay=2.0)]
+        start = monotonic()
+        report = scrape_all(sites, timeout=0.3)
+        assert monotonic() - start < 1.5
+        assert report.results == [("url1", 7.21)]
+        assert type(report.errors["url2"]) == TimeoutError
+
+    def test_returns_while_site_hangs(self):
+        entered, release = threading.Event(), threading.Event()
+
+        class HangingScraper:
+            url = "url2"
+
+            def __call__(self):
+                entered.set()
+                release.wait()
+
+        try:
+            report = scrape_all([FakeScraper("url1", 7.21), HangingScraper()], timeout=0.1)
+            # the run is over while the hanging scraper is still blocked
+            assert entered.is_set()
+            assert type(report.errors["url2"]) == TimeoutError
+            assert report.results == [("url1", 7.21)]
+            hanging = [thread for thread in threading.enumerate() if thread.name.startswith("scraper")]
+            assert hanging and all(thread.daemon for thread in hanging)
+        finally:
+            release.set()
+
+    def test_hanging_site_does_not_block_exit(self):
+        script = (
+            "import threading\n"
+            "from coffeescraper.engine import scrape_all\n"
+            "class Hanging:\n"
+            "    url = 'url1'\n"
+            "    def __call__(self):\n"
+            "        threading.Event().wait()\n"
+            "report = scrape_all([Hanging()], timeout=0.1)\n"
+            "print(type(report.errors['url1']).__name__)\n"
+        )
+        # without daemon workers the interpreter would wait for the hanging thread forever
+        process = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, timeout=60)
+        assert process.returncode == 0, process.stderr
+        assert process.stdout.strip() == "TimeoutError"
+
+    def test_empty(self):
+        report = scrape_all([])
+        assert report.results == []
+        assert report.cheapest is None
+
+
+class TestAsyncEngine:
+    def test_basic(self):
+        sites = [FakeAsyncScraper("url1", 7.21), FakeAsyncScraper("url2", 7.31)]
+        report = asyncio.run(scrape_all_async(sites))
+        assert report.results == [("url1", 7.21), ("url2", 7.31)]
+        assert report.cheapest == ("url1", 7.21)
+
+    def test_concurrent(self):
+        sites = [FakeAsyncScraper(f"url{i}", float(i), delay=0.2) for i in range(100)]
+        start = monotonic()
+        report = asyncio.run(scrape_all_async(sites))
+        assert monotonic() - start < 1.0
+        assert len(report.results) == 100
+
+    def test_failures(self):
+        sites = [
+            FakeAsyncScraper("url1", 7.21),
+            FakeAsyncScraper("url2", exception=PriceNotFoundException("no price")),
+            FakeAsyncScraper("url3", 6.0, delay=2.0),
+        ]
+        report = asyncio.run(scrape_all_async(sites, timeout=0.3))
+        assert report.results == [("url1", 7.21)]
+        assert list(report.not_found) == ["url2"]
+        assert type(report.errors["url3"]) == TimeoutError
@@ -0,0 +1,44 @@
+from datetime import datetime
+
+import pyarrow.dataset as ds
+
+from coffeescraper.export import export_parquet, read_watermark
+from coffeescraper.sqlite import SQLitePriceDatabase
+
+
+class TestExport:
+    def test_export(self, tmp_path):
+        db = SQLitePriceDatabase(str(tmp_path / "prices.db"))
+        db.insert_rows([
+            ("url1", 100.0, datetime(2011, 7, 31)),
+            ("url2", 90.0, datetime(2011, 8, 1)),
+            ("url1", 95.0, datetime(2011, 8, 2)),
+        ])
+        directory = tmp_path / "prices"
+        assert export_parquet(db, str(directory), batch_size=1) == 3
+        assert read_watermark(directory) == 3
+        assert sorted(p.name for p in directory.iterdir()) == ["_watermark.json", "month=2011-07", "month=2011-08"]
+
+        assert export_parquet(db, str(directory)) == 0
+        db.insert_rows([("url2", 85.0, datetime(2011, 8, 3))])
+        assert export_parquet(db, str(directory)) == 1
+        assert read_watermark(directory) == 4
+        assert sorted(p.name for p in (directory / "month=2011-08").iterdir()) == ["part-000000000001.parquet", "part-000000000004.parquet"]
+
+        table = ds.dataset(directory, format="parquet", partitioning="hive").to_table().sort_by("id")
+        assert table.column("price").to_pylist() == [100.0, 90.0, 95.0, 85.0]
+        assert table.column("url").to_pylist() == ["url1", "url2", "url1", "url2"]
+        assert table.column("timestamp").to_pylist()[0] == datetime(2011, 7, 31)
+        assert table.column("month").to_pylist() == ["2011-07", "2011-08", "2011-08", "2011-08"]
+        db.close()
+
+    def test_no_timestamp(self, tmp_path):
+        db = SQLitePriceDatabase(str(tmp_path / "prices.db"))
+        db.insert_rows([("url1", 100.0, datetime(2011, 7, 31)), ("url2", 90.0, None)])
+        directory = tmp_path / "prices"
+        assert export_parquet(db, str(directory)) == 2
+        assert sorted(p.name for p in directory.iterdir()) == ["_watermark.json", "month=2011-07", "month=unknown"]
+        table = ds.dataset(directory, format="parquet", partitioning="hive").to_table().sort_by("id")
+        assert table.column("timestamp").to_pylist() == [datetime(2011, 7, 31), None]
+        assert table.column("month").to_pylist() == ["2011-07", "unknown"]
+        db.close()
@@ -1,7 +1,13 @@
-from coffeescraper.html import generate_graph_html
-from datetime import datetime
+from coffeescraper.html import generate_graph_html, lttb, dumps, environment
+from datetime import datetime, timedelta
+import numpy as np
 
+import json
+import os
 import pathlib
+from unittest.mock import patch
+
+import pytest
 
 class TestHTML:
     def test_basic(self):
@@ -14,3 +20,65 @@ class TestHTML:
         generate_graph_html(data,"url1",7.21,p)
         assert p.exists()
         
+
+    def test_downsample(self):
+        start = datetime(2011, 8, 8)
+        data = [(i, url, 7.0 + (i % 7) / 10, start + timedelta(days=i)) for i in range(3000) for url in ("url1", "url2")]
+        p = pathlib.Path('/tmp/graph.html')
+        p.unlink(missing_ok=True)
+        generate_graph_html(data, "url1", 7.0, p, max_points=100)
+        html = p.read_text()
+        assert html.count('"x"') == 200
+        assert (start + timedelta(days=2999)).isoformat() in html
+
+    def test_data_file(self, tmp_path):
+        data = [(i, url, 7.0 + i / 100, datetime(2021, 8, 8) + timedelta(days=i)) for i in range(10) for url in ("url1", "url2")]
+        page, data_file = tmp_path / "lungo.html", tmp_path / "lungo.json"
+        generate_graph_html(data, "url1", 7.0, page, data_file=data_file)
+        html = page.read_text()
+        assert "fetch('lungo.json'" in html
+        assert '"x"' not in html and "url1" not in html
+        chart = json.loads(data_file.read_text())
+        assert [series["site"] for series in chart["series"]] == ["url1", "url2"]
+        assert chart["series"][0]["points"][0] == ["2021-08-08T00:00:00", 7.0]
+        assert chart["cheapest_site"] == "url1" and chart["lowest_price_today"] == "7.00"
+        assert len(chart["labels"]) == 10
+
+        # the page does not depend on the data
+        data.append((99, "url3", 6.0, datetime(2021, 9, 8)))
+        generate_graph_html(data, "url3", 6.0, tmp_path / "again.html", data_file=data_file)
+        assert (tmp_path / "again.html").read_text() == html
+
+    def test_data_file_atomic(self, tmp_path):
+        data = [(i, "url1", 7.0, datetime(2021, 8, 8) + timedelta(days=i)) for i in range(3)]
+        data_file = tmp_path / "lungo.json"
+        generate_graph_html(data, "url1", 7.0, tmp_path / "lungo.html", data_file=data_file)
+        before = data_file.read_bytes()
+        with patch("coffeescraper.utils.os.replace", side_effect=OSError("disk full")):
+            with pytest.raises(OSError):
+                generate_graph_html(data + [(9, "url2", 6.0, datetime(2021, 9, 8))], "url2", 6.0, tmp_path / "lungo.html", data_file=data_file)
+        assert data_file.read_bytes() == before
+        assert sorted(os.listdir(tmp_path)) == ["lungo.html", "lungo.json"]
+
+    def test_template_cached(self):
+        assert environment() is environment()
+        assert environment().get_template("graph.html") is environment().get_template("graph.html")
+
+    def test_dumps(self):
+        assert dumps([{"x": datetime(2021, 8, 8, 12), "y": 7.21}]) == '[{"x":"2021-08-08T12:00:00","y":7.21}]'
+
+
+class TestLTTB:
+    def test_short(self):
+        x = np.arange(5.0)
+        assert list(lttb(x, x, 10)) == [0, 1, 2, 3, 4]
+
+    def test_peaks(self):
+        x = np.arange(1000.0)
+        y = np.zeros(1000)
+        y[[100, 500, 900]] = [5.0, -5.0, 5.0]
+        selected = lttb(x, y, 20)
+        assert len(selected) == 20
+        assert selected[0] == 0 and selected[-1] == 999
+        assert list(selected) == sorted(selected)
+        assert {100, 500, 900} <= set(selected)
@@ -0,0 +1,103 @@
+import json
+import pathlib
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+from coffeescraper.metrics import Metrics, downloaded
+from coffeescraper.scraper import CoffeeScraper
+
+prom = pathlib.Path("/tmp/coffeescraper-test.prom")
+summary = pathlib.Path("/tmp/coffeescraper-test.json")
+
+
+def response(chunks, status_code=200):
+    r = MagicMock()
+    r.status_code = status_code
+    r.encoding = "utf-8"
+    r.text = "".join(chunks)
+    r.iter_content.return_value = iter(chunks)
+    r.raw.tell.return_value = 4711
+    r.__enter__.return_value = r
+    return r
+
+
+class TestMetrics:
+    def test_observe(self):
+        metrics = Metrics()
+        metrics.observe("fetch_seconds", 1.5, url="a")
+        metrics.observe("fetch_seconds", 0.5, url="a")
+        metrics.observe("fetch_seconds", 2.0, url="b")
+        metrics.observe("fetch_seconds", None, url="c")
+        result = metrics.summary()["metrics"]["fetch_seconds"]
+        assert result == [
+            {"labels": {"url": "a"}, "count": 2, "sum": 2.0, "max": 1.5, "mean": 1.0},
+            {"labels": {"url": "b"}, "count": 1, "sum": 2.0, "max": 2.0, "mean": 2.0},
+        ]
+
+    def test_timer(self):
+        metrics = Metrics()
+        with pytest.raises(ValueError):
+            with metrics.timer("stage_seconds", stage="scrape"):
+                raise ValueError("oops")
+        (entry,) = metrics.summary()["metrics"]["stage_seconds"]
+        assert entry["count"] == 1
+        assert entry["sum"] >= 0.0
+
+    def test_prometheus(self):
+        metrics = Metrics()
+        metrics.observe("fetch_seconds", 0.25, url='http://a/"x"')
+        metrics.set("sites", 3, outcome="price")
+        metrics.set("run_seconds", 12.5)
+        text = metrics.prometheus()
+        lines = text.splitlines()
+        assert "# HELP coffeescraper_fetch_seconds Time spent downloading a page, per site." in lines
+        assert "# TYPE coffeescraper_fetch_seconds summary" in lines
+        assert 'coffeescraper_fetch_seconds_sum{url="http://a/\\"x\\""} 0.25' in lines
+        assert 'coffeescraper_fetch_seconds_count{url="http://a/\\"x\\""} 1' in lines
+        assert "# TYPE coffeescraper_sites gauge" in lines
+        assert 'coffeescraper_sites{outcome="price"} 3' in lines
+        assert "coffeescraper_run_seconds 12.5" in lines
+        assert text.endswith("\n")
+
+    def test_write(self):
+        metrics = Metrics()
+        metrics.set("run_seconds", 1.0)
+        metrics.write_prometheus(prom)
+        metrics.write_json(summary)
+        assert "coffeescraper_run_seconds 1.0" in prom.read_text()
+        assert json.loads(summary.read_text())["metrics"]["run_seconds"] == [{"labels": {}, "value": 1.0}]
+        assert not list(prom.parent.glob(f".{prom.name}.*.tmp"))
+
+    def test_downloaded(self):
+        assert downloaded(response([])) == 4711
+        assert downloaded(MagicMock()) is None
+        assert downloaded(object()) is None
+
+
+class TestScraperMetrics:
+    @pytest.mark.parametrize("stream", [False, True])
+    def test_instrumented(self, stream):
+        metrics = Metrics()
+        chunks = ["<html>", '<span class="price">3.21</span>', "</html>"]
+        scraper = CoffeeScraper("http://webserver/a", r'<span class="price">(?P<price>[\d.]+)</span>', stream=stream)
+        with patch("coffeescraper.scraper.metrics", metrics), patch(
+            "coffeescraper.scraper.requests.get", return_value=response(chunks)
+        ):
+            assert scraper() == ("http://webserver/a", 3.21)
+        result = metrics.summary()["metrics"]
+        assert result["fetch_seconds"][0]["labels"] == {"url": "http://webserver/a"}
+        assert result["parse_seconds"][0]["count"] == 1
+        assert result["downloaded_bytes"][0]["sum"] == 4711
+
+    def test_failure_still_measured(self):
+        metrics = Metrics()
+        scraper = CoffeeScraper("http://webserver/a", r"(?P<price>\d+\.\d+)", stream=True)
+        with patch("coffeescraper.scraper.metrics", metrics), patch(
+            "coffeescraper.scraper.requests.get", return_value=response(["no price here"])
+        ):
+            with pytest.raises(Exception):
+                scraper()
+        result = metrics.summary()["metrics"]
+        assert result["fetch_seconds"][0]["count"] == 1
+        assert "parse_seconds" not in result
@@ -0,0 +1,107 @@
+import pytest
+import pathlib
+
+from selenium.webdriver.common.by import By
+
+from coffeescraper.registry import load_sites, validate, compile_pattern, NumberFormat, SiteConfigError
+from coffeescraper.scraper import CoffeeScraper, ChromiumCoffeeScraper
+
+sites_toml = pathlib.Path(__file__).parent.parent / "coffeescraper" / "sites.toml"
+
+
+class TestNumberFormat:
+    def test_default(self):
+        assert NumberFormat()("3.66") == 3.66
+
+    def test_locale(self):
+        assert NumberFormat(locale="nl_NL")("1.003,66") == 1003.66
+        assert NumberFormat(locale="en_US")("1,003.66") == 1003.66
+
+    def test_strip_divisor(self):
+        assert NumberFormat(strip=r"\D", divisor=100)('3,<span class="cents">66') == 3.66
+        assert NumberFormat(strip=r"\s", divisor=100)("3 66") == 3.66
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            NumberFormat()("n/a")
+
+
+class TestRegistry:
+    def test_shipped_sites(self):
+        sites = load_sites(sites_toml)
+        assert len(sites) == 6
+        assert len({site.url for site in sites}) == 6
+        chromium = [site for site in sites if isinstance(site, ChromiumCoffeeScraper)]
+        assert len(chromium) == 1
+        assert chromium[0].pricepattern.by == By.CSS_SELECTOR
+        assert chromium[0].structured
+
+    def test_load(self, tmp_path):
+        p = tmp_path / "sites.toml"
+        p.write_text('''
+[defaults]
+product = "Lungo"
+
+[[site]]
+url = "http://webserver/1"
+method = "regex"
+pattern = '<span class="price">(?P<price>.*)</span>'
+format = { locale = "nl_NL" }
+
+[[site]]
+url = "http://webserver/2"
+method = "regex"
+pattern = '<span class="price">(?P<price>.*)</span>'
+product = "Espresso"
+stream = true
+
+[[site]]
+url = "http://webserver/3"
+method = "jsonld"
+''')
+        sites = load_sites(p, cache="cache")
+        assert [type(site) for site in sites] == [CoffeeScraper, CoffeeScraper, CoffeeScraper]
+        assert [site.product for site in sites] == ["Lungo", "Espresso", "Lungo"]
+        assert [site.structured for site in sites] == [False, False, True]
+        assert sites[2].pricepattern is None
+        assert sites[0].pricepattern is sites[1].pricepattern
+        assert sites[0].cache == "cache"
+        assert sites[1].stream
+        assert sites[0].format("3,66") == 3.66
+
+    def test_compile_cached(self):
+        assert compile_pattern(r"(?P<price>\d+)") is compile_pattern(r"(?P<price>\d+)")
+
+    def test_validate(self):
+        config = {"site": [
+            {"url": "ftp://webserver", "method": "regex", "pattern": "(?P<cost>.*)"},
+            {"url": "http://webserver", "method": "xpath", "colour": "red"},
+            {"url": "http://webserver", "method": "css", "stream": True, "pattern": "(?P<price>.*)"},
+            {"url": "http://other", "method": "regex", "pattern": "(", "format": {"locale": "xx_XX", "divisor": 0}},
+        ]}
+        problems = validate(config)
+        assert problems == [
+            "site 1 (ftp://webserver): url should be an http or https url",
+            "site 1 (ftp://webserver): pattern has no group named price",
+            "site 2 (http://webserver): unknown key colour",
+            "site 2 (http://webserver): method should be one of regex, css, jsonld",
+            "site 3 (http://webserver): duplicate url",
+            "site 3 (http://webserver): method css needs a selector",
+            "site 3 (http://webserver): pattern only applies to regex sites",
+            "site 3 (http://webserver): stream only applies to jsonld and regex sites",
+            "site 4 (http://other): pattern is not a valid regular expression: missing ), unterminated subpattern at position 0",
+            "site 4 (http://other): locale should be one of nl_NL, de_DE, fr_FR, en_US, en_GB",
+            "site 4 (http://other): divisor should be a positive number",
+        ]
+        assert validate({}) == ["no [[site]] tables found"]
+
+    def test_invalid_file(self, tmp_path):
+        p = tmp_path / "sites.toml"
+        p.write_text("[[site]]\nurl = 'http://webserver'\n")
+        with pytest.raises(SiteConfigError, match="method should be one of"):
+            load_sites(p)
+        p.write_text("oink")
+        with pytest.raises(SiteConfigError):
+            load_sites(p)
+        with pytest.raises(SiteConfigError):
+            load_sites(tmp_path / "missing.toml")
@@ -0,0 +1,143 @@
+import pathlib
+from datetime import datetime, date
+from unittest.mock import MagicMock
+
+from coffeescraper.report import ReportState, render_reports, slug
+from coffeescraper.sqlite import SQLitePriceDatabase
+
+p = pathlib.Path("/tmp/reportstate.json")
+
+
+class TestReportState:
+    def test_update(self):
+        p.unlink(missing_ok=True)
+        state = ReportState(p)
+        assert state.watermark is None
+        n = state.update([
+            (1, "url1", 100.0, datetime(2011, 8, 8, 6)),
+            (2, "url2", 90.0, datetime(2011, 8, 8, 7)),
+            (3, "url1", 80.0, datetime(2011, 8, 8, 18)),
+        ])
+        assert n == 3
+        assert state.watermark == 3
+        assert list(state.daily()) == [
+            (date(2011, 8, 8), "url1", 80.0, 100.0, 90.0, 2),
+            (date(2011, 8, 8), "url2", 90.0, 90.0, 90.0, 1),
+        ]
+        assert list(state.series()) == [
+            (None, "url1", 80.0, datetime(2011, 8, 8)),
+            (None, "url2", 90.0, datetime(2011, 8, 8)),
+        ]
+
+    def test_save_load(self):
+        p.unlink(missing_ok=True)
+        with ReportState(p) as state:
+            state.update([(1, "url1", 100.0, datetime(2011, 8, 8))])
+        state = ReportState(p)
+        assert state.watermark == 1
+        state.update([(2, "url1", 95.0, datetime(2011, 8, 8))])
+        assert list(state.daily()) == [(date(2011, 8, 8), "url1", 95.0, 100.0, 97.5, 2)]
+
+    def test_refresh(self):
+        p.unlink(missing_ok=True)
+        state = ReportState(p)
+        state = ReportState(p, overlap=10)
+        state.database = "db"
+        state.watermark = 41
+        db = MagicMock()
+        db.identity = "db"
+        db.max_id.return_value = 42
+        db.get_prices.return_value = iter([(42, "url1", 100.0, datetime(2011, 8, 8))])
+        assert state.refresh(db) == 1
+        assert db.get_prices.call_args.kwargs["after_id"] == 31
+        assert state.watermark == 42
+
+    def test_overlap(self):
+        p.unlink(missing_ok=True)
+        state = ReportState(p, overlap=10)
+        assert state.update([(1, "url1", 100.0, datetime(2011, 8, 8)), (3, "url1", 90.0, datetime(2011, 8, 8))]) == 2
+        # id 2 was committed after id 3, the rows already seen are skipped
+        assert state.update([(1, "url1", 100.0, datetime(2011, 8, 8)), (2, "url1", 80.0, datetime(2011, 8, 8)), (3, "url1", 90.0, datetime(2011, 8, 8))]) == 1
+        assert state.watermark == 3
+        assert list(state.daily()) == [(date(2011, 8, 8), "url1", 80.0, 100.0, 90.0, 3)]
+        state.save()
+        assert ReportState(p, overlap=10).update([(2, "url1", 80.0, datetime(2011, 8, 8))]) == 0
+
+    def test_reset_database(self, tmp_path):
+        p.unlink(missing_ok=True)
+        filename = str(tmp_path / "prices.db")
+        with SQLitePriceDatabase(filename) as db:
+            db.insert_rows([(f"url{i}", 100.0, datetime(2011, 8, 8)) for i in range(4)])
+            with ReportState(p) as state:
+                assert state.refresh(db) == 4
+                assert state.watermark == 4
+        pathlib.Path(filename).unlink()
+        with SQLitePriceDatabase(filename) as db:
+            db.insert_rows([(f"url{i}", 90.0, datetime(2011, 8, 9)) for i in range(3)])
+            state = ReportState(p)
+            assert state.refresh(db) == 3
+        assert state.watermark == 3
+        assert list(state.daily()) == [(date(2011, 8, 9), f"url{i}", 90.0, 90.0, 90.0, 1) for i in range(3)]
+
+    def test_other_database(self, tmp_path):
+        p.unlink(missing_ok=True)
+        with SQLitePriceDatabase(str(tmp_path / "one.db")) as db:
+            db.insert_rows([("url1", 100.0, datetime(2011, 8, 8))])
+            with ReportState(p) as state:
+                assert state.refresh(db) == 1
+        with SQLitePriceDatabase(str(tmp_path / "two.db")) as db:
+            db.insert_rows([("url2", 90.0, datetime(2011, 8, 8)), ("url2", 80.0, datetime(2011, 8, 8))])
+            state = ReportState(p)
+            assert state.refresh(db) == 2
+        assert state.database == db.identity
+        assert [row[1] for row in state.daily()] == ["url2"]
+
+    def test_corrupt(self):
+        with open(p, "w") as file:
+            file.write("oink")
+        state = ReportState(p)
+        assert state.watermark is None
+        assert len(state) == 0
+
+
+class TestRenderReports:
+    def test_slug(self):
+        assert slug("Dolce Gusto Lungo XL (30 cups)") == "dolce-gusto-lungo-xl-30-cups"
+        assert slug("???") == "product"
+
+    def test_render(self, tmp_path):
+        state = ReportState(tmp_path / "state.json")
+        state.update([
+            (1, "url1", 7.21, datetime(2011, 8, 8)),
+            (2, "url2", 4.31, datetime(2011, 8, 8)),
+            (3, "url3", 7.11, datetime(2011, 8, 8)),
+        ])
+        sites = {"url1": "Lungo", "url2": "Espresso", "url3": "Lungo"}
+        pages = render_reports(state, sites, str(tmp_path / "html"), cheapest={"Lungo": ("url3", 7.11)}, index="coffee.html", max_workers=2)
+        assert [pathlib.Path(page).name for page in pages] == ["coffee.html", "espresso.html", "lungo.html"]
+
+        index = (tmp_path / "html" / "coffee.html").read_text()
+        assert 'href="lungo.html"' in index and 'href="espresso.html"' in index
+        assert "7.11 €" in index
+
+        lungo = (tmp_path / "html" / "lungo.html").read_text()
+        assert "Prijzen Lungo" in lungo
+        assert 'href="coffee.html"' in lungo
+        assert "url1" in lungo and "url3" in lungo and "url2" not in lungo
+
+    def test_render_split_compressed(self, tmp_path):
+        state = ReportState(tmp_path / "state.json")
+        state.update([
+            (1, "url1", 7.21, datetime(2011, 8, 8)),
+            (2, "url2", 4.31, datetime(2011, 8, 8)),
+        ])
+        sites = {"url1": "Lungo", "url2": "Espresso"}
+        pages = render_reports(state, sites, str(tmp_path / "html"), index="coffee.html", max_workers=2, split_data=True, compress=["gz"])
+        assert [pathlib.Path(page).name for page in pages] == [
+            "coffee.html", "coffee.html.gz",
+            "espresso.html", "espresso.json", "espresso.html.gz", "espresso.json.gz",
+            "lungo.html", "lungo.json", "lungo.html.gz", "lungo.json.gz",
+        ]
+        assert all(pathlib.Path(page).exists() for page in pages)
+        assert "url1" in (tmp_path / "html" / "lungo.json").read_text()
+        assert "url1" not in (tmp_path / "html" / "lungo.html").read_text()
@@ -0,0 +1,192 @@
+import asyncio
+import pathlib
+import threading
+from time import monotonic, process_time
+from unittest.mock import patch, MagicMock
+
+import pytest
+import requests
+
+from coffeescraper.engine import scrape_all, scrape_all_async
+from coffeescraper.resilience import RetryPolicy, CircuitBreaker, CircuitOpenError, is_transient
+from coffeescraper.scraper import CoffeeScraper, PriceNotFoundException
+
+p = pathlib.Path("/tmp/breaker.json")
+
+
+def http_error(status_code):
+    response = MagicMock()
+    response.status_code = status_code
+    return requests.HTTPError(f"{status_code} error", response=response)
+
+
+class FlakyScraper:
+    def __init__(self, url, failures, exception=None):
+        self.url = url
+        self.failures = failures
+        self.exception = exception or requests.ConnectionError("connection reset")
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.exception
+        return self.url, 7.21
+
+
+class FlakyAsyncScraper(FlakyScraper):
+    async def __call__(self, session):
+        return super().__call__()
+
+
+class TestRetryPolicy:
+    @pytest.mark.parametrize(
+        "exception, transient",
+        [
+            (requests.ConnectionError("reset"), True),
+            (requests.Timeout("slow"), True),
+            (TimeoutError("slow"), True),
+            (http_error(503), True),
+            (http_error(429), True),
+            (http_error(404), False),
+            (PriceNotFoundException("no price"), False),
+            (ValueError("oops"), False),
+        ],
+    )
+    def test_is_transient(self, exception, transient):
+        assert is_transient(exception) == transient
+
+    def test_retry(self):
+        policy = RetryPolicy(retries=2)
+        assert policy.retry(requests.Timeout(), 1)
+        assert policy.retry(requests.Timeout(), 2)
+        assert not policy.retry(requests.Timeout(), 3)
+        assert not policy.retry(PriceNotFoundException(), 1)
+
+    def test_delay(self):
+        policy = RetryPolicy(base=1.0, cap=5.0)
+        with patch("coffeescraper.resilience.random.uniform", side_effect=lambda low, high: high) as uniform:
+            assert [policy.delay(attempt) for attempt in range(1, 6)] == [1.0, 2.0, 4.0, 5.0, 5.0]
+        assert all(call.args[0] == 0.0 for call in uniform.call_args_list)
+        for attempt in range(1, 10):
+            assert 0.0 <= policy.delay(attempt) <= 5.0
+
+
+class TestCircuitBreaker:
+    def test_open_and_close(self):
+        p.unlink(missing_ok=True)
+        breaker = CircuitBreaker(p, threshold=2, cooldown=100.0)
+        assert breaker.allow("url1", now=0.0)
+        breaker.failure("url1", now=0.0)
+        assert breaker.allow("url1", now=1.0)
+        breaker.failure("url1", now=1.0)
+        assert breaker.failures("url1") == 2
+        assert not breaker.allow("url1", now=50.0)
+        # after the cooldown one more attempt is allowed
+        assert breaker.allow("url1", now=101.0)
+        breaker.failure("url1", now=101.0)
+        assert not breaker.allow("url1", now=150.0)
+        breaker.success("url1")
+        assert breaker.allow("url1", now=150.0)
+        assert breaker.failures("url1") == 0
+
+    def test_save_load(self):
+        p.unlink(missing_ok=True)
+        with CircuitBreaker(p, threshold=1) as breaker:
+            breaker.failure("url1")
+        assert not CircuitBreaker(p, threshold=1).allow("url1")
+        assert CircuitBreaker(p, threshold=1).allow("url2")
+
+    def test_corrupt(self):
+        p.write_text("{not json")
+        assert CircuitBreaker(p).allow("url1")
+
+
+class TestScrapeAllResilience:
+    def test_retry(self):
+        sites = [FlakyScraper("http://a/1", failures=2), FlakyScraper("http://b/1", failures=5)]
+        policy = RetryPolicy(retries=2, base=0.05)
+        report = scrape_all(sites, retry=policy)
+        assert report.results == [("http://a/1", 7.21)]
+        assert list(report.errors) == ["http://b/1"]
+        assert sites[0].calls == 3
+        assert sites[1].calls == 3
+
+    def test_no_retry_when_not_found(self):
+        site = FlakyScraper("http://a/1", failures=1, exception=PriceNotFoundException("no price"))
+        report = scrape_all([site], retry=RetryPolicy())
+        assert list(report.not_found) == ["http://a/1"]
+        assert site.calls == 1
+
+    def test_backoff_does_not_block_workers(self):
+        sites = [FlakyScraper("http://a/1", failures=1)] + [FlakyScraper(f"http://b/{i}", failures=0) for i in range(5)]
+        policy = RetryPolicy(retries=1, base=0.5)
+        with patch.object(policy, "delay", return_value=0.5):
+            start, cpu = monotonic(), process_time()
+            report = scrape_all(sites, max_workers=1, retry=policy)
+        elapsed = monotonic() - start
+        assert len(report.results) == 6
+        assert elapsed < 1.0
+        # the backoff is slept off, not busy waited
+        assert process_time() - cpu < elapsed / 2
+
+    def test_retry_timeout(self):
+        release = threading.Event()
+
+        class HangingOnce(FlakyScraper):
+            def __call__(self):
+                self.calls += 1
+                if self.calls == 1:
+                    release.wait()
+                return self.url, 7.21
+
+        site = HangingOnce("http://a/1", failures=0)
+        policy = RetryPolicy(retries=1)
+        try:
+            with patch.object(policy, "delay", return_value=0.0):
+                report = scrape_all([site], timeout=0.2, retry=policy)
+        finally:
+            release.set()
+        assert report.results == [("http://a/1", 7.21)]
+        assert report.errors == {}
+        assert site.calls == 2
+
+    def test_breaker(self):
+        p.unlink(missing_ok=True)
+        breaker = CircuitBreaker(p, threshold=2)
+        for run in range(3):
+            sites = [FlakyScraper("http://a/1", failures=1), FlakyScraper("http://b/1", failures=0)]
+            report = scrape_all(sites, breaker=breaker)
+            assert report.results == [("http://b/1", 7.21)]
+        assert type(report.errors["http://a/1"]) == CircuitOpenError
+        assert sites[0].calls == 0
+        assert breaker.failures("http://a/1") == 2
+        assert breaker.failures("http://b/1") == 0
+
+    def test_breaker_not_found_is_no_failure(self):
+        p.unlink(missing_ok=True)
+        breaker = CircuitBreaker(p, threshold=1)
+        site = FlakyScraper("http://a/1", failures=1, exception=PriceNotFoundException("no price"))
+        scrape_all([site], breaker=breaker)
+        assert breaker.allow("http://a/1")
+
+    def test_async(self):
+        p.unlink(missing_ok=True)
+        breaker = CircuitBreaker(p, threshold=1)
+        sites = [FlakyAsyncScraper("http://a/1", failures=1), FlakyAsyncScraper("http://b/1", failures=3)]
+        report = asyncio.run(scrape_all_async(sites, retry=RetryPolicy(retries=1, base=0.05), breaker=breaker))
+        assert report.results == [("http://a/1", 7.21)]
+        assert sites[1].calls == 2
+        assert not breaker.allow("http://b/1")
+
+
+class TestUnavailable:
+    def test_raise_for_status(self):
+        response = MagicMock()
+        response.status_code = 503
+        response.__enter__.return_value = response
+        response.raise_for_status.side_effect = http_error(503)
+        scraper = CoffeeScraper("http://webserver", r"(?P<price>\d+)")
+        with patch("coffeescraper.scraper.requests.get", return_value=response):
+            with pytest.raises(requests.HTTPError):
+                scraper()
@@ -0,0 +1,186 @@
+from time import monotonic, process_time, sleep
+from unittest.mock import patch, MagicMock
+
+import requests
+
+from coffeescraper.engine import scrape_all
+from coffeescraper.scheduler import TokenBucket, PoliteScheduler, host, crawl_delay, crawl_delays
+
+
+class TestTokenBucket:
+    def test_unlimited(self):
+        bucket = TokenBucket(None, now=0.0)
+        for _ in range(100):
+            assert bucket.delay(0.0) == 0.0
+            bucket.take(0.0)
+
+    def test_burst(self):
+        bucket = TokenBucket(2.0, burst=3, now=0.0)
+        for _ in range(3):
+            assert bucket.delay(0.0) == 0.0
+            bucket.take(0.0)
+        assert bucket.delay(0.0) == 0.5
+        assert bucket.delay(0.25) == 0.25
+        assert bucket.delay(0.5) == 0.0
+
+    def test_refill_limited_by_burst(self):
+        bucket = TokenBucket(1.0, burst=2, now=0.0)
+        bucket.take(0.0)
+        bucket.take(0.0)
+        assert bucket.delay(100.0) == 0.0
+        bucket.take(100.0)
+        bucket.take(100.0)
+        assert bucket.delay(100.0) == 1.0
+
+
+class TestPoliteScheduler:
+    def test_host(self):
+        assert host("https://www.Example.org:8080/path?q=1") == "www.example.org:8080"
+
+    def test_round_robin(self):
+        scheduler = PoliteScheduler()
+        for url in ("http://a/1", "http://a/2", "http://a/3", "http://b/1", "http://c/1"):
+            scheduler.add(url, url)
+        assert len(scheduler) == 5
+        order = [scheduler.next(0.0)[0] for _ in range(5)]
+        assert order == ["http://a/1", "http://b/1", "http://c/1", "http://a/2", "http://a/3"]
+        assert scheduler.next(0.0) == (None, float("inf"))
+        assert len(scheduler) == 0
+
+    def test_rate(self):
+        scheduler = PoliteScheduler(rate=1.0, burst=1)
+        for url in ("http://a/1", "http://a/2", "http://b/1"):
+            scheduler.add(url, url)
+        assert scheduler.next(0.0) == ("http://a/1", 0.0)
+        # a is throttled, b is not held up by it
+        assert scheduler.next(0.0) == ("http://b/1", 0.0)
+        assert scheduler.next(0.0) == (None, 1.0)
+        assert scheduler.next(0.4)[1] == 0.6
+        assert scheduler.next(1.0) == ("http://a/2", 0.0)
+
+    def test_concurrency(self):
+        scheduler = PoliteScheduler(concurrency=1)
+        scheduler.add("http://a/1", 1)
+        scheduler.add("http://a/2", 2)
+        assert scheduler.next(0.0) == (1, 0.0)
+        assert scheduler.next(0.0) == (None, float("inf"))
+        scheduler.done("http://a/1")
+        assert scheduler.next(0.0) == (2, 0.0)
+
+    def test_crawl_delay(self):
+        scheduler = PoliteScheduler(rate=10.0, burst=5, delays={"a": 2.0})
+        for url in ("http://a/1", "http://a/2", "http://b/1", "http://b/2"):
+            scheduler.add(url, url)
+        jobs = [scheduler.next(0.0)[0] for _ in range(4)]
+        assert jobs == ["http://a/1", "http://b/1", "http://b/2", None]
+        assert scheduler.next(0.0) == (None, 2.0)
+        assert scheduler.next(2.0) == ("http://a/2", 0.0)
+
+    def test_clear(self):
+        scheduler = PoliteScheduler()
+        scheduler.add("http://a/1", 1)
+        scheduler.add("http://a/2", 2, not_before=5.0)
+        scheduler.add("http://b/1", 3)
+        assert scheduler.clear() == [1, 3, 2]
+        assert len(scheduler) == 0
+        assert scheduler.next(10.0) == (None, float("inf"))
+
+
+class TestRobots:
+    robots = "User-agent: *\nCrawl-delay: 3\nDisallow: /private\n"
+
+    def response(self, status_code=200, text=""):
+        response = MagicMock()
+        response.status_code = status_code
+        response.text = text
+        return response
+
+    def test_crawl_delay(self):
+        with patch("coffeescraper.scheduler.requests.get", return_value=self.response(text=self.robots)) as get:
+            assert crawl_delay("https://shop.example.org/product?id=1", "agent") == 3.0
+        assert get.call_args.args[0] == "https://shop.example.org/robots.txt"
+
+    def test_request_rate(self):
+        robots = "User-agent: *\nRequest-rate: 1/5\n"
+        with patch("coffeescraper.scheduler.requests.get", return_value=self.response(text=robots)):
+            assert crawl_delay("https://shop.example.org/", "agent") == 5.0
+
+    def test_no_delay(self):
+        with patch("coffeescraper.scheduler.requests.get", return_value=self.response(text="User-agent: *\nDisallow:\n")):
+            assert crawl_delay("https://shop.example.org/", "agent") is None
+        with patch("coffeescraper.scheduler.requests.get", return_value=self.response(404)):
+            assert crawl_delay("https://shop.example.org/", "agent") is None
+        with patch("coffeescraper.scheduler.requests.get", side_effect=requests.ConnectionError("down")):
+            assert crawl_delay("https://shop.example.org/", "agent") is None
+
+    def test_crawl_delays(self):
+        def get(url, **kwargs):
+            return self.response(text=self.robots if "slow" in url else "")
+
+        with patch("coffeescraper.scheduler.requests.get", side_effect=get) as mock:
+            delays = crawl_delays(["http://slow/1", "http://slow/2", "http://fast/1"], "agent")
+        assert delays == {"slow": 3.0}
+        assert mock.call_count == 2
+
+
+class FakeScraper:
+    def __init__(self, url, delay=0.0):
+        self.url = url
+        self.delay = delay
+        self.started = None
+
+    def __call__(self):
+        self.started = monotonic()
+        sleep(self.delay)
+        return self.url, 1.0
+
+
+class TestScrapeAllScheduled:
+    def test_rate_limited_host_does_not_block_others(self):
+        slow = [FakeScraper(f"http://slow/{i}") for i in range(3)]
+        fast = [FakeScraper(f"http://fast/{i}", delay=0.05) for i in range(6)]
+        scheduler = PoliteScheduler(delays={"slow": 0.25})
+        start = monotonic()
+        report = scrape_all(slow + fast, max_workers=2, scheduler=scheduler)
+        assert len(report.results) == 9
+        assert [result[0] for result in report.results] == [site.url for site in slow + fast]
+        # the fast host finished while the slow host was still throttled
+        assert max(site.started for site in fast) < slow[2].started
+        starts = sorted(site.started - start for site in slow)
+        assert starts[1] - starts[0] >= 0.2
+        assert starts[2] - starts[1] >= 0.2
+
+    def test_concurrency_per_host(self):
+        sites = [FakeScraper(f"http://a/{i}", delay=0.1) for i in range(4)]
+        start = monotonic()
+        report = scrape_all(sites, max_workers=4, scheduler=PoliteScheduler(concurrency=1))
+        assert len(report.results) == 4
+        assert monotonic() - start >= 0.4
+
+    def test_throttled_host_does_not_spin(self):
+        sites = [FakeScraper(f"http://a/{i}") for i in range(6)]
+        start, cpu = monotonic(), process_time()
+        report = scrape_all(sites, max_workers=2, scheduler=PoliteScheduler(rate=10.0, burst=1, concurrency=2))
+        elapsed = monotonic() - start
+        assert len(report.results) == 6
+        assert elapsed >= 0.45
+        # the loop sleeps while the host is throttled instead of busy waiting
+        assert process_time() - cpu < elapsed / 2
+
+    def test_abandoned_site_keeps_its_connection(self):
+        sites = [FakeScraper("http://a/1", delay=0.35), FakeScraper("http://a/2")]
+        report = scrape_all(sites, max_workers=2, timeout=0.2, scheduler=PoliteScheduler(concurrency=1))
+        assert type(report.errors["http://a/1"]) == TimeoutError
+        assert report.results == [("http://a/2", 1.0)]
+        # the second request only started when the abandoned one was really over
+        assert sites[1].started - sites[0].started >= 0.3
+
+    def test_abandoned_site_hangs(self):
+        sites = [FakeScraper("http://a/1", delay=1.5), FakeScraper("http://a/2"), FakeScraper("http://b/1")]
+        start = monotonic()
+        report = scrape_all(sites, max_workers=2, timeout=0.2, scheduler=PoliteScheduler(concurrency=1))
+        assert monotonic() - start < 1.0
+        assert report.results == [("http://b/1", 1.0)]
+        assert sites[1].started is None
+        assert type(report.errors["http://a/1"]) == TimeoutError
+        assert type(report.errors["http://a/2"]) == TimeoutError
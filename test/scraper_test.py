@@ -1,6 +1,7 @@
 import pytest
+import asyncio
 
-from coffeescraper.scraper import CoffeeScraper,ChromiumCoffeeScraper,PricePattern,PriceNotFoundException
+from coffeescraper.scraper import CoffeeScraper,ChromiumCoffeeScraper,AsyncCoffeeScraper,PricePattern,PriceNotFoundException,create_session
 from selenium.webdriver.common.by import By
 
 class TestCoffeeScraper:
@@ -38,6 +39,64 @@ class TestCoffeeScraper:
         cd()
         assert True
 
+class TestStreamingCoffeeScraper:
+    def test_basic(self):
+        url = "http://webserver"
+        cd = CoffeeScraper(url, r'<span\s+class="price">(?P<price>[^<]*)</span>', stream=True)
+        result = cd()
+        assert result[0] == url
+        assert result[1] == 3.66
+
+    def test_split_chunks(self):
+        cd = CoffeeScraper("url", r'<meta property="product:price:amount" content="(?P<price>\d+\.\d+)"/>')
+        page = "x" * 5000 + '<meta property="product:price:amount" content="3.66"/>' + "y" * 5000
+        for size in (1, 7, 100, 5020, 20000):
+            chunks = (page[i:i + size] for i in range(0, len(page), size))
+            assert cd.extract_price_stream(chunks) == ("url", 3.66)
+
+    def test_early_exit(self):
+        cd = CoffeeScraper("url", r'<span\s+class="price">(?P<price>[^<]*)</span>')
+        consumed = []
+
+        def chunks():
+            for chunk in ('<span class="pr', 'ice">3.66</span>', "never read"):
+                consumed.append(chunk)
+                yield chunk
+
+        assert cd.extract_price_stream(chunks()) == ("url", 3.66)
+        assert len(consumed) == 2
+
+    @pytest.mark.xfail(raises=PriceNotFoundException)
+    def test_notfound_element(self):
+        cd = CoffeeScraper("url", r'<span\s+class="price">(?P<price>[^<]*)</span>')
+        cd.extract_price_stream(iter(["<html>", "</html>"]))
+
+class TestAsyncCoffeeScraper:
+    def test_basic(self):
+        url = "http://webserver"
+        cd = AsyncCoffeeScraper(url, r'<span\s+class="price">(?P<price>.*)</span>')
+        result = asyncio.run(cd())
+        assert result[0] == url
+        assert result[1] == 3.66
+
+    def test_shared_session(self):
+        url = "http://webserver"
+        cd1 = AsyncCoffeeScraper(url, r'<span\s+class="price">(?P<price>.*)</span>')
+        cd2 = AsyncCoffeeScraper(url, r'<span\s+class="comma-price">(?P<price>.*)</span>',lambda x: x.replace(",", "."))
+
+        async def scrape():
+            async with create_session(limit_per_host=1) as session:
+                return await asyncio.gather(cd1(session), cd2(session))
+
+        results = asyncio.run(scrape())
+        assert results == [(url, 3.66), (url, 3.66)]
+
+    @pytest.mark.xfail(raises=PriceNotFoundException)
+    def test_notfound_element(self):
+        url = "http://webserver"
+        cd = AsyncCoffeeScraper(url, r'<span\s+class="notaknownclass">(?P<price>.*)</span>')
+        asyncio.run(cd())
+
 class TestChromiumCoffeeScraper:
     def test_basic(self):
         url = "http://webserver"
@@ -1,8 +1,12 @@
-from unittest.mock import patch
-from coffeescraper.sftp import upload_file_via_sftp
+from unittest.mock import patch, MagicMock
+from coffeescraper.sftp import upload_file_via_sftp, SFTPUploader
+import hashlib
+import json
 import os
 import pathlib
 
+import pytest
+
 h = pathlib.Path("/tmp/hostfile")
 u = pathlib.Path("/tmp/username")
 p = pathlib.Path("/tmp/password")
@@ -51,3 +55,125 @@ class TestSFTP:
         mockclientinstance.close.assert_called_once()
         mocktransportinstance.close.assert_called_once()
 
+
+
+class TestSFTPUploader:
+    def entry(self):
+        return {"sha256": hashlib.sha256(l.read_bytes()).hexdigest(), "size": l.stat().st_size}
+
+    @patch("paramiko.Transport", autospec=True)
+    @patch("paramiko.SFTPClient", autospec=True)
+    def test_upload(self, mockclient, mocktransport, tmp_path):
+        create_files()
+        os.environ.pop("DRYRUN", None)
+        manifest = tmp_path / "manifest.json"
+        client = mockclient.from_transport.return_value
+        with SFTPUploader(h, u, p, manifest=manifest) as uploader:
+            assert uploader.channels == 4
+            assert uploader.upload(l, "/reports/remote-file")
+        mocktransport.assert_called_once_with(("ssh.example.org", 22))
+        mocktransport.return_value.connect.assert_called_once_with(username="exampleuser", password="examplepassword")
+        tmpfile = client.put.call_args.args[1]
+        assert tmpfile.startswith("/reports/.remote-file.") and tmpfile.endswith(".tmp")
+        client.posix_rename.assert_called_once_with(tmpfile, "/reports/remote-file")
+        # nothing but the file itself is written to the server
+        client.open.assert_not_called()
+        assert json.loads(manifest.read_text()) == {"ssh.example.org:/reports/remote-file": self.entry()}
+        client.close.assert_called_once()
+        mocktransport.return_value.close.assert_called_once()
+
+    @patch("paramiko.Transport", autospec=True)
+    @patch("paramiko.SFTPClient", autospec=True)
+    def test_unchanged_skipped(self, mockclient, mocktransport, tmp_path):
+        create_files()
+        os.environ.pop("DRYRUN", None)
+        manifest = tmp_path / "manifest.json"
+        manifest.write_text(json.dumps({"ssh.example.org:/remote-file": self.entry()}))
+        client = mockclient.from_transport.return_value
+        client.stat.return_value.st_size = l.stat().st_size
+        with SFTPUploader(h, u, p, manifest=manifest) as uploader:
+            assert not uploader.upload(l, "/remote-file")
+        client.put.assert_not_called()
+
+    @patch("paramiko.Transport", autospec=True)
+    @patch("paramiko.SFTPClient", autospec=True)
+    def test_changed_uploaded(self, mockclient, mocktransport, tmp_path):
+        create_files()
+        os.environ.pop("DRYRUN", None)
+        manifest = tmp_path / "manifest.json"
+        manifest.write_text(json.dumps({"ssh.example.org:/remote-file": {"sha256": "0123abcd", "size": l.stat().st_size}}))
+        client = mockclient.from_transport.return_value
+        client.stat.return_value.st_size = l.stat().st_size
+        with SFTPUploader(h, u, p, manifest=manifest) as uploader:
+            assert uploader.upload(l, "/remote-file")
+        client.put.assert_called_once()
+        assert json.loads(manifest.read_text())["ssh.example.org:/remote-file"] == self.entry()
+
+    @patch("paramiko.Transport", autospec=True)
+    @patch("paramiko.SFTPClient", autospec=True)
+    def test_missing_remote_uploaded(self, mockclient, mocktransport, tmp_path):
+        create_files()
+        os.environ.pop("DRYRUN", None)
+        manifest = tmp_path / "manifest.json"
+        manifest.write_text(json.dumps({"ssh.example.org:/remote-file": self.entry()}))
+        client = mockclient.from_transport.return_value
+        client.stat.side_effect = IOError("no such file")
+        with SFTPUploader(h, u, p, manifest=manifest) as uploader:
+            assert uploader.upload(l, "/remote-file")
+        client.put.assert_called_once()
+
+    @patch("paramiko.Transport", autospec=True)
+    @patch("paramiko.SFTPClient", autospec=True)
+    def test_rename_fallback(self, mockclient, mocktransport, caplog):
+        create_files()
+        os.environ.pop("DRYRUN", None)
+        client = mockclient.from_transport.return_value
+        client.posix_rename.side_effect = IOError("not supported")
+        with SFTPUploader(h, u, p) as uploader:
+            assert uploader.upload(l, "/remote-file")
+        client.remove.assert_called_once_with("/remote-file")
+        client.rename.assert_called_once_with(client.put.call_args.args[1], "/remote-file")
+        assert "non atomically" in caplog.text
+
+    @patch("paramiko.Transport", autospec=True)
+    @patch("paramiko.SFTPClient", autospec=True)
+    def test_failure(self, mockclient, mocktransport, tmp_path):
+        create_files()
+        os.environ.pop("DRYRUN", None)
+        manifest = tmp_path / "manifest.json"
+        broken, working = MagicMock(), MagicMock()
+        broken.put.side_effect = IOError("connection lost")
+        mockclient.from_transport.side_effect = [broken, working]
+        with SFTPUploader(h, u, p, manifest=manifest) as uploader:
+            with pytest.raises(IOError):
+                uploader.upload(l, "/reports/remote-file")
+            # the partial upload is removed and the channel is not used again
+            broken.remove.assert_called_once_with(broken.put.call_args.args[1])
+            broken.close.assert_called_once()
+            assert uploader.upload(l, "/reports/remote-file")
+        working.put.assert_called_once()
+        assert list(json.loads(manifest.read_text())) == ["ssh.example.org:/reports/remote-file"]
+
+    @patch("paramiko.Transport", autospec=True)
+    @patch("paramiko.SFTPClient", autospec=True)
+    def test_upload_many_one_session(self, mockclient, mocktransport):
+        create_files()
+        os.environ.pop("DRYRUN", None)
+        mockclient.from_transport.side_effect = lambda transport: MagicMock()
+        with SFTPUploader(h, u, p, channels=3) as uploader:
+            assert uploader.upload_many([(l, f"/remote-file-{i}") for i in range(10)]) == [True] * 10
+        mocktransport.assert_called_once()
+        mocktransport.return_value.connect.assert_called_once()
+        assert 1 <= mockclient.from_transport.call_count <= 3
+
+    @patch("paramiko.Transport", autospec=True)
+    @patch("paramiko.SFTPClient", autospec=True)
+    def test_dryrun(self, mockclient, mocktransport):
+        create_files()
+        os.environ["DRYRUN"] = "1"
+        try:
+            with SFTPUploader(h, u, p) as uploader:
+                assert uploader.upload_many([(l, "/remote-file")]) == [False]
+        finally:
+            del os.environ["DRYRUN"]
+        mocktransport.assert_not_called()
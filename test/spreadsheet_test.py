@@ -1,5 +1,6 @@
 from coffeescraper.spreadsheet import write_sheet
 from datetime import datetime
+from openpyxl import load_workbook
 
 import pathlib
 
@@ -12,4 +13,25 @@ class TestSpreadsheet:
         p = pathlib.Path('/tmp/spreadsheet.xlsx')
         p.unlink(missing_ok=True)
         write_sheet(data,p)
-        assert p.exists()
\ No newline at end of file
+        assert p.exists()
+
+    def test_per_site(self):
+        data = (
+            (1, "https://www.example.org/coffee/1", 7.21, datetime(2021, 8, 8)),
+            (2, "https://www.example.org/coffee/2", 7.31, datetime(2021, 8, 8)),
+            (3, "https://www.example.org/coffee/1", 7.11, datetime(2021, 8, 9)),
+        )
+        p = pathlib.Path('/tmp/spreadsheet.xlsx')
+        p.unlink(missing_ok=True)
+        write_sheet(iter(data), p, per_site=True)
+
+        wb = load_workbook(p)
+        assert wb.sheetnames == ["prices", "www.example.org", "www.example.org(2)"]
+        ws = wb["prices"]
+        assert [cell.value for cell in ws[1]] == ["id", "url", "price", "timestamp"]
+        assert ws["A1"].font.bold
+        assert ws.max_row == 4
+        assert ws["D2"].value == datetime(2021, 8, 8)
+        assert ws["D2"].number_format == "yyyy-mm-dd hh:mm:ss"
+        assert [row[2] for row in wb["www.example.org"].iter_rows(min_row=2, values_only=True)] == [7.21, 7.11]
+        assert wb["www.example.org(2)"].max_row == 2
@@ -0,0 +1,125 @@
+import json
+from unittest.mock import patch, MagicMock
+
+from selenium.webdriver.common.by import By
+
+from coffeescraper.structured import find_price, offer_price
+from coffeescraper.scraper import CoffeeScraper, ChromiumCoffeeScraper, PricePattern
+
+product = {
+    "@context": "https://schema.org",
+    "@type": "Product",
+    "name": "Lungo XL",
+    "offers": {"@type": "Offer", "price": "3.66", "priceCurrency": "EUR"},
+}
+
+
+def page(head="", body=""):
+    return f"<!DOCTYPE html><html><head><title>coffee</title>{head}</head><body>{body}</body></html>"
+
+
+def ldjson(data):
+    return f'<script type="application/ld+json">{json.dumps(data)}</script>'
+
+
+def chunked(text, size):
+    return [text[i : i + size] for i in range(0, len(text), size)]
+
+
+def response(text):
+    r = MagicMock()
+    r.status_code = 200
+    r.text = text
+    r.encoding = "utf-8"
+    r.iter_content.side_effect = lambda chunk_size, decode_unicode: iter(chunked(text, 7))
+    r.__enter__.return_value = r
+    return r
+
+
+class TestOfferPrice:
+    def test_product(self):
+        assert offer_price(product) == 3.66
+
+    def test_graph(self):
+        data = {"@graph": [{"@type": "WebPage"}, {"@type": "Product", "offers": [{"price": 3.21}]}]}
+        assert offer_price(data) == 3.21
+
+    def test_aggregate(self):
+        assert offer_price({"@type": "Product", "offers": {"@type": "AggregateOffer", "lowPrice": "2.99", "highPrice": "3.99"}}) == 2.99
+
+    def test_specification(self):
+        data = {"@type": "Product", "offers": {"@type": "Offer", "priceSpecification": {"@type": "UnitPriceSpecification", "price": 4.5}}}
+        assert offer_price(data) == 4.5
+
+    def test_no_offer(self):
+        assert offer_price({"@type": "Product", "price": "3.66"}) is None
+        assert offer_price({"@type": "Offer", "price": "n/a"}) is None
+        assert offer_price("oink") is None
+
+
+class TestFindPrice:
+    def test_ldjson_head(self):
+        text = page(head=ldjson(product))
+        for size in (1, 7, 100000):
+            assert find_price(chunked(text, size)) == 3.66
+
+    def test_ldjson_body(self):
+        text = page(body="<p>" + "x" * 5000 + "</p>" + ldjson({"@type": "Organization"}) + ldjson(product))
+        for size in (1, 7, 100000):
+            assert find_price(chunked(text, size)) == 3.66
+
+    def test_meta(self):
+        text = page(head='<meta property="product:price:amount" content="3.21"/>', body=ldjson(product))
+        assert find_price(chunked(text, 7)) == 3.21
+
+    def test_ldjson_preferred_in_head(self):
+        text = page(head='<meta property="og:price:amount" content="3.21"/>' + ldjson(product))
+        assert find_price(chunked(text, 7)) == 3.66
+
+    def test_stops_early(self):
+        chunks = iter(chunked(page(head=ldjson(product), body="x" * 100000), 100))
+        assert find_price(chunks) == 3.66
+        assert len(list(chunks)) > 900
+
+    def test_invalid_json(self):
+        text = page(body='<script type="application/ld+json">{oink</script>' + ldjson(product))
+        assert find_price([text]) == 3.66
+
+    def test_none(self):
+        assert find_price(chunked(page(body="<span>3.66</span>"), 7)) is None
+        assert find_price([]) is None
+
+
+class TestStructuredCoffeeScraper:
+    pattern = r'<span\s+class="price">(?P<price>.*)</span>'
+
+    @patch("requests.get")
+    def test_structured_first(self, mockget):
+        mockget.return_value = response(page(head=ldjson(product), body='<span class="price">9.99</span>'))
+        for stream in (False, True):
+            cd = CoffeeScraper("http://webserver", self.pattern, stream=stream, structured=True)
+            assert cd() == ("http://webserver", 3.66)
+
+    @patch("requests.get")
+    def test_fallback(self, mockget):
+        mockget.return_value = response(page(body='<span class="price">9.99</span>'))
+        for stream in (False, True):
+            cd = CoffeeScraper("http://webserver", self.pattern, stream=stream, structured=True)
+            assert cd() == ("http://webserver", 9.99)
+
+    @patch("selenium.webdriver.Chrome")
+    @patch("requests.get")
+    def test_no_browser(self, mockget, mockchrome):
+        mockget.return_value = response(page(head=ldjson(product)))
+        cd = ChromiumCoffeeScraper("http://webserver", PricePattern(By.CLASS_NAME, "price"), structured=True)
+        assert cd() == ("http://webserver", 3.66)
+        mockchrome.assert_not_called()
+
+    @patch("selenium.webdriver.Chrome")
+    @patch("requests.get")
+    def test_browser_fallback(self, mockget, mockchrome):
+        mockget.return_value = response(page())
+        mockchrome.return_value.find_element.return_value.text = "3.21"
+        cd = ChromiumCoffeeScraper("http://webserver", PricePattern(By.CLASS_NAME, "price"), structured=True)
+        assert cd() == ("http://webserver", 3.21)
+        mockchrome.assert_called_once()
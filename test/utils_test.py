@@ -1,7 +1,10 @@
-from coffeescraper.utils import get_env,get_secret,get_secret_file
+from coffeescraper.utils import get_env,get_secret,get_secret_file,write_atomic,load_json,dump_json
 
 import pathlib
 import os
+from unittest.mock import patch
+
+import pytest
 
 envvar = "TESTENVVAR"
 novar = "THISENVIRONMENTVARDOESNOTEXIST"
@@ -41,4 +44,47 @@ class TestUtils:
             file.write(text)
         assert get_secret_file(p) == text
         p.unlink()
-        assert get_secret_file(p) is None
\ No newline at end of file
+        assert get_secret_file(p) is None
+
+    def test_dump_load_json(self, tmp_path):
+        p = tmp_path / "state.json"
+        assert load_json(p) is None
+        assert load_json(p, {}) == {}
+        dump_json(p, {"oink": [1, 2]})
+        assert load_json(p) == {"oink": [1, 2]}
+        assert os.stat(p).st_mode & 0o777 == 0o644
+        p.write_text("{not json")
+        assert load_json(p, {}) == {}
+
+    def test_write_atomic(self, tmp_path):
+        p = tmp_path / "file.txt"
+        p.write_text("old")
+        os.chmod(p, 0o600)
+        write_atomic(p, "new")
+        assert p.read_text() == "new"
+        assert os.stat(p).st_mode & 0o777 == 0o600
+        assert os.listdir(tmp_path) == ["file.txt"]
+
+    def test_write_atomic_failure(self, tmp_path):
+        p = tmp_path / "file.txt"
+        p.write_text("old")
+        with patch("coffeescraper.utils.os.replace", side_effect=OSError("disk full")):
+            with pytest.raises(OSError):
+                write_atomic(p, "new")
+        assert p.read_text() == "old"
+        assert os.listdir(tmp_path) == ["file.txt"]
+
+    def test_write_atomic_unique_tmpfile(self, tmp_path):
+        p = tmp_path / "file.txt"
+        names = []
+        replace = os.replace
+
+        def record(src, dst):
+            names.append(src)
+            replace(src, dst)
+
+        with patch("coffeescraper.utils.os.replace", side_effect=record):
+            write_atomic(p, "one")
+            write_atomic(p, "two")
+        assert names[0] != names[1]
+        assert all(os.path.dirname(name) == str(tmp_path) for name in names)